@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Benchmarks of the per-window computations: equations, coherence,
+transfer function and AIC, sweeping the parameters that drive their cost.
+
+Usage example:
+    python -m pytest benchmarks/bench_compute.py
+    python benchmarks/bench_compute.py
+"""
+
+import pytest
+from harness import BenchCase, check_case, datasets
+
+MODEL_ORDERS = (10, 42, 100)
+MAXTAUS = (64, 256)
+NFIRS = (32, 128, 512)
+WINDOW_SIZES = (512, 2048)
+FREQ_POINTS = (200, 1000)
+
+
+def solved_window(data, **changes):
+    """ Model of the first window of data, solved. """
+    from hvarma import ArmaParam, HVarma
+    param = ArmaParam().update(changes)
+    model = HVarma(data.make_window(0, param.window_size, copy=True), param)
+    model.solve_arma()
+    return model
+
+
+def equations_case(data, model_order, maxtau):
+    def setup():
+        from hvarma.compute import compute_equations
+        param = {'model_order': model_order, 'maxtau': maxtau, 'window_size': 2048}
+        model = solved_window(data, **param)
+        window = model.data
+        return lambda: compute_equations(window.dataE, window.dataN, window.dataZ, 0.5, 0.5,
+                                         2048, model_order, maxtau)
+    return setup
+
+
+def coherence_case(data, nfir, freq_points):
+    def setup():
+        from hvarma.compute import compute_coherence
+        maxtau = max(nfir, 64)
+        model = solved_window(data, nfir=nfir, maxtau=maxtau, window_size=max(512, 2 * maxtau),
+                              freq_points=freq_points)
+        covariances = model.get_correlations()
+        t = 1. / data.sampling_rate
+        return lambda: compute_coherence(*covariances, nfir, -10, 10, freq_points, t)
+    return setup
+
+
+def transfer_case(data, model_order, freq_points):
+    def setup():
+        model = solved_window(data, model_order=model_order, maxtau=max(model_order, 64),
+                              freq_points=freq_points)
+        return model.transfer_fun
+    return setup
+
+
+def aic_case(data, model_order, window_size):
+    def setup():
+        model = solved_window(data, model_order=model_order, maxtau=max(model_order, 64),
+                              window_size=window_size)
+        return model.get_AIC
+    return setup
+
+
+def get_cases():
+    cases = []
+    for name, data in datasets().items():
+        for p in MODEL_ORDERS:
+            for maxtau in MAXTAUS:
+                if p <= maxtau:
+                    cases.append(BenchCase(f'compute_equations[{name}-p{p}-maxtau{maxtau}]',
+                                           equations_case(data, p, maxtau)))
+        for nfir in NFIRS:
+            for npoints in FREQ_POINTS:
+                cases.append(BenchCase(f'compute_coherence[{name}-nfir{nfir}-freq{npoints}]',
+                                       coherence_case(data, nfir, npoints)))
+        for p in MODEL_ORDERS:
+            for npoints in FREQ_POINTS:
+                cases.append(BenchCase(f'transfer_function[{name}-p{p}-freq{npoints}]',
+                                       transfer_case(data, p, npoints)))
+        for p in MODEL_ORDERS:
+            for size in WINDOW_SIZES:
+                cases.append(BenchCase(f'get_AIC[{name}-p{p}-window{size}]', aic_case(data, p, size)))
+    return cases
+
+
+CASES = get_cases()
+
+
+@pytest.mark.parametrize('case', CASES, ids=[case.name for case in CASES])
+def test_benchmark(case):
+    check_case(case)
+
+
+if __name__ == '__main__':
+    from run import main
+    main(['--module', 'bench_compute'])
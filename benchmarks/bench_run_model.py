@@ -0,0 +1,51 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Benchmarks of run_model end to end, sweeping the number of windows,
+the window size and the model order.
+
+Usage example:
+    python -m pytest benchmarks/bench_run_model.py
+    python benchmarks/bench_run_model.py
+"""
+
+import pytest
+from harness import BenchCase, check_case, datasets
+
+WINDOW_COUNTS = (10, 50)
+WINDOW_SIZES = (512, 1024)
+MODEL_ORDERS = (10, 42)
+
+
+def run_model_case(data, num_windows, window_size, model_order):
+    def setup():
+        from hvarma import ArmaParam, run_model
+        param = ArmaParam().update({'max_windows': num_windows, 'window_size': window_size,
+                                    'overlap': window_size // 2, 'model_order': model_order,
+                                    'maxtau': 64, 'nfir': 40, 'freq_points': 1000})
+        return lambda: run_model(data, param, verbose=False)
+    return setup
+
+
+def get_cases():
+    cases = []
+    for name, data in datasets().items():
+        for num_windows in WINDOW_COUNTS:
+            for size in WINDOW_SIZES:
+                for p in MODEL_ORDERS:
+                    cases.append(BenchCase(f'run_model[{name}-windows{num_windows}-window{size}-p{p}]',
+                                           run_model_case(data, num_windows, size, p), repeat=3))
+    return cases
+
+
+CASES = get_cases()
+
+
+@pytest.mark.parametrize('case', CASES, ids=[case.name for case in CASES])
+def test_benchmark(case):
+    check_case(case)
+
+
+if __name__ == '__main__':
+    from run import main
+    main(['--module', 'bench_run_model'])
@@ -0,0 +1,145 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Timing, baselines and data shared by the benchmarks.
+
+Each bench_*.py module defines a list CASES of BenchCase and a test
+function, so it runs with pytest when given explicitly:
+
+    python -m pytest benchmarks/bench_compute.py
+
+or all modules with the standalone runner (see run.py). Baselines are
+stored in a JSON file, by host, and a case fails when it is slower than
+its baseline by more than the threshold factor. Settings are read from
+the environment:
+
+    HVARMA_BENCH_BASELINE   baseline file (benchmarks/baselines.json)
+    HVARMA_BENCH_THRESHOLD  allowed slowdown factor (1.5)
+    HVARMA_BENCH_SAVE       if 1, store the measured times as new baselines
+"""
+
+import os
+import json
+import time
+import socket
+import platform
+from dataclasses import dataclass
+from typing import Callable
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESOURCES = os.path.join(BENCH_DIR, '..', 'test', 'resources')
+
+
+@dataclass
+class BenchCase:
+    """ Benchmark case. setup prepares the inputs (not timed) and
+        returns the function to time, called without arguments. """
+    name: str
+    setup: Callable
+    repeat: int = 5
+
+
+def get_settings():
+    return {'baseline': os.environ.get('HVARMA_BENCH_BASELINE', os.path.join(BENCH_DIR, 'baselines.json')),
+            'threshold': float(os.environ.get('HVARMA_BENCH_THRESHOLD', 1.5)),
+            'save': os.environ.get('HVARMA_BENCH_SAVE', '0') == '1'}
+
+
+def host_key():
+    """ Baselines are only comparable on the same machine. """
+    return f'{socket.gethostname()}-{platform.machine()}-py{platform.python_version()}'
+
+
+def measure(func, repeat=5, min_time=0.05):
+    """ Best time per call over repeat rounds, each round calling
+        func enough times to last at least min_time seconds.  """
+    func()  # Warm up
+    number = 1
+    while True:
+        beg = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - beg
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(np.ceil(min_time / elapsed)))
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        beg = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - beg) / number)
+    return best
+
+
+def load_baselines(filename):
+    """ Baselines of this host: case name -> seconds. """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as file:
+        return json.load(file).get(host_key(), {})
+
+
+def save_baselines(filename, timings):
+    """ Merge timings into the baselines of this host. """
+    baselines = {}
+    if os.path.exists(filename):
+        with open(filename) as file:
+            baselines = json.load(file)
+    baselines.setdefault(host_key(), {}).update(timings)
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'w') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+    os.replace(tmp_name, filename)
+
+
+def run_case(case, settings=None):
+    """ Time a case and compare it with its baseline.
+        Returns a result dict, with 'ratio' None if there is no baseline. """
+    settings = settings or get_settings()
+    elapsed = measure(case.setup(), case.repeat)
+    baseline = load_baselines(settings['baseline']).get(case.name)
+    if settings['save']:
+        save_baselines(settings['baseline'], {case.name: elapsed})
+    ratio = None if baseline is None else elapsed / baseline
+    return {'name': case.name, 'seconds': elapsed, 'baseline': baseline, 'ratio': ratio,
+            'failed': ratio is not None and ratio > settings['threshold']}
+
+
+def check_case(case):
+    """ pytest entry point: fail if the case is slower than its baseline allows. """
+    settings = get_settings()
+    result = run_case(case, settings)
+    assert not result['failed'], \
+        '{} took {:.3g} s, {:.2f} times its baseline of {:.3g} s (threshold {})'.format(
+            case.name, result['seconds'], result['ratio'], result['baseline'], settings['threshold'])
+
+
+def synthetic_data(size=40000, sampling_rate=100., seed=0):
+    """ Synthetic record with a resonance at 2.5 Hz. """
+    from hvarma.synthetic import SyntheticModel, synthetic_data
+    model = SyntheticModel.from_resonances([2.5], 0.05, sampling_rate)
+    return synthetic_data(model, size / sampling_rate, seed=seed, noise=0.1)
+
+
+def b001_data():
+    """ Bundled B001 recording, or None if the files or obspy are missing. """
+    from hvarma import Data
+    fnames = [os.path.join(RESOURCES, f'B001_{comp}.sac') for comp in 'ZNE']
+    if not all(os.path.exists(fname) for fname in fnames):
+        return None
+    try:
+        return Data.from_sac(*fnames)
+    except ImportError:
+        return None
+
+
+def datasets():
+    """ Name and Data of the available datasets. """
+    data = {'synthetic': synthetic_data()}
+    b001 = b001_data()
+    if b001 is not None:
+        data['B001'] = b001
+    return data
@@ -0,0 +1,63 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Standalone runner of the benchmark suite.
+
+Usage example:
+    python benchmarks/run.py --save                 # record baselines
+    python benchmarks/run.py --threshold 1.3        # compare with them
+    python benchmarks/run.py --module bench_compute --filter p42
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import importlib
+from harness import BENCH_DIR, get_settings, run_case
+
+
+def get_modules():
+    return sorted(os.path.basename(fname)[:-3] for fname in glob.glob(os.path.join(BENCH_DIR, 'bench_*.py')))
+
+
+def main(argv=None):
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description='Run the hvarma benchmarks.')
+    parser.add_argument('--module', action='append', choices=get_modules(),
+                        help='Benchmark module to run (repeatable, all by default)')
+    parser.add_argument('--filter', type=str, default='', help='Only run cases whose name contains this text')
+    parser.add_argument('--baseline', type=str, default=settings['baseline'], help='Baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=settings['threshold'],
+                        help='Allowed slowdown factor over the baseline')
+    parser.add_argument('--save', action='store_true', default=settings['save'],
+                        help='Store the measured times as new baselines')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    args = parser.parse_args(argv)
+    settings = {'baseline': args.baseline, 'threshold': args.threshold, 'save': args.save}
+
+    results = []
+    print('{:60s} {:>10s} {:>10s} {:>7s}'.format('Case', 'Time(ms)', 'Base(ms)', 'Ratio'))
+    for module_name in args.module or get_modules():
+        for case in importlib.import_module(module_name).CASES:
+            if args.filter not in case.name:
+                continue
+            result = run_case(case, settings)
+            results.append(result)
+            baseline = '-' if result['baseline'] is None else '{:.3f}'.format(1e3 * result['baseline'])
+            ratio = '-' if result['ratio'] is None else '{:.2f}'.format(result['ratio'])
+            print('{:60s} {:10.3f} {:>10s} {:>7s}{}'.format(case.name, 1e3 * result['seconds'], baseline, ratio,
+                                                           '  SLOWER' if result['failed'] else ''), flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    failed = [result['name'] for result in results if result['failed']]
+    if failed:
+        print(len(failed), 'of', len(results), 'cases exceeded the threshold of', args.threshold)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
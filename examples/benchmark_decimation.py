@@ -0,0 +1,55 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Script to compare the running time and the estimated resonance
+frequencies with and without the decimation pre-processing stage.
+
+Usage example:
+    python benchmark_decimation.py Z_data.sac N_data.sac E_data.sac --max_windows=100
+"""
+
+import argparse
+import time
+from hvarma import Data, ArmaParam, run_model
+
+
+def benchmark(data, param):
+    """ Run the model and return the elapsed time and results """
+    beg = time.time()
+    results = run_model(data, param, verbose=False)
+    return time.time() - beg, results
+
+
+def main(args):
+    data = Data.from_sac(Z_fname=args.Z_fname,
+                         N_fname=args.N_fname,
+                         E_fname=args.E_fname)
+    param = ArmaParam.from_dict({
+        'model_order': args.model_order,
+        'maxtau': 64,
+        'neg_freq': -10,
+        'pos_freq': 10,
+        'freq_points': 1000,
+        'window_size': 512,
+        'overlap': 256,
+        'max_windows': args.max_windows,
+    })
+
+    print('Decimation Factor Window Time(s) Positive(Hz) Error(Hz) Negative(Hz) Error(Hz)')
+    for decimate in [0, 1]:
+        elapsed, results = benchmark(data, param.update({'decimate': decimate}))
+        pos_freq, pos_err, neg_freq, neg_err = results.get_frequency(param.freq_conf)
+        print('{:10d} {:6d} {:6d} {:7.2f} {:12.4f} {:9.4f} {:12.4f} {:9.4f}'
+              .format(decimate, results.decimation, results.param.window_size, elapsed,
+                      pos_freq, pos_err, neg_freq, neg_err))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('Z_fname', type=str, help="SAC data in direction Z")
+    parser.add_argument('N_fname', type=str, help="SAC data in direction N")
+    parser.add_argument('E_fname', type=str, help="SAC data in direction E")
+    parser.add_argument('--model_order', type=int, help="HVARMA model order", default=10)
+    parser.add_argument('--max_windows', type=int, help="Maximum number of windows to explore within data.",
+                        default=100)
+    main(parser.parse_args())
@@ -42,7 +42,8 @@ def main(args):
     param = param.update(args_dict)
     if not args.silent:
         print('Data read correctly')
-    results = find_optimal_order(data, param, 0.05, start_order=args.start_order, verbose=not args.silent)
+    results = find_optimal_order(data, param, 0.05, start_order=args.start_order, verbose=not args.silent,
+                                 method=args.method)
     plot_order_search(results, param.output_dir)
 
 
@@ -59,5 +60,7 @@ if __name__ == '__main__':
     parser.add_argument('--args', type=str, help="File with all the default arguments.", default=None)
     parser.add_argument('--freq_points', type=int, help="Number of frequency points to "
                                                         "calculate between neg_freq and pos_freq")
+    parser.add_argument('--method', type=str, help="Order search method: fast or multifidelity",
+                        default='fast')
     parser.add_argument('--silent', help="No output to stdout", action='store_false', default=False)
     main(parser.parse_args())
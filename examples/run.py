@@ -51,7 +51,7 @@ def main(args):
         print('Data read correctly')
 
     results = run_model(data, param, verbose=not args.silent)
-    write_results(data, param, results)
+    write_results(data, param, results, binary=args.binary)
     plot_hvratio(param, results, format='png')
     write_frequencies_in_file(param, results)
 
@@ -70,6 +70,7 @@ if __name__ == '__main__':
     parser.add_argument('--freq_points', type=int, help="Number of frequency points to "
                                                         "calculate between neg_freq and pos_freq")
     parser.add_argument('--freq_conf', type=float, help='Frequency confidence interval.')
+    parser.add_argument('--binary', help="Also write all window results in a .npz file", action='store_true')
     parser.add_argument('--silent', help="No output to stdout", action='store_false', default=False)
 
     main(parser.parse_args())
@@ -16,7 +16,11 @@ Usage example:
     print('Found order:', results.final_order)
 """
 
-from .running import run_model, find_optimal_order
+from .running import run_model, find_optimal_order, sweep_weights, run_directional, run_timelapse
 from .processing import HVarma, AverageData
-from .read_input import Data, ArmaParam
-from .write_output import plot_hvratio, write_results, plot_order_search
+from .read_input import Data, ArmaParam, WindowBatch
+from .lazy_input import LazyData
+from .cache import ResultCache
+from .instrumentation import RunStats
+from .write_output import plot_hvratio, write_results, plot_order_search, \
+    write_binary_results, read_binary_results
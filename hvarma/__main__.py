@@ -0,0 +1,127 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Command line entry point.
+
+Usage example:
+    hvarma serve /tmp/hvarma.sock --workers 8
+    hvarma batch data/ --output_dir output/ --workers 8
+    hvarma queue /shared/queue data/ --args args.txt
+    hvarma worker /shared/queue --workers 8
+    hvarma autotune
+"""
+
+import argparse
+
+
+def serve_command(args):
+    from .server import serve
+    serve(args.socket, workers=args.workers, cache_dir=args.cache_dir, processes=not args.threads)
+
+
+def read_jobs(args):
+    from .batch import discover_triplets, read_manifest
+    from .read_input import ArmaParam
+    param = ArmaParam.from_file(args.args) if args.args is not None else ArmaParam()
+    if args.manifest is not None:
+        jobs = read_manifest(args.manifest)
+    elif args.root is not None:
+        jobs = discover_triplets(args.root)
+    else:
+        raise SystemExit('Give a directory or a manifest')
+    return jobs, param
+
+
+def batch_command(args):
+    from .batch import run_batch
+    jobs, param = read_jobs(args)
+    run_batch(jobs, param, args.output_dir, workers=args.workers, prefetch=args.prefetch,
+              order_search=args.order_search, tol=args.tol)
+
+
+def queue_command(args):
+    from .workqueue import station_job, submit_jobs
+    jobs, param = read_jobs(args)
+    submit_jobs(args.queue, [station_job(job, param, args.order_search, args.tol) for job in jobs])
+    print('Queued', len(jobs), 'stations in', args.queue)
+
+
+def worker_command(args):
+    from .workqueue import run_workers, collect_results
+    run_workers(args.queue, workers=args.workers, cache_dir=args.cache_dir, heartbeat=args.heartbeat,
+                stale_after=args.stale_after, max_attempts=args.max_attempts, wait=args.wait)
+    if args.summary is not None:
+        collect_results(args.queue, args.summary)
+
+
+def autotune_command(args):
+    from .autotune import autotune, profile_path
+    profile = autotune(args.cache_dir, workers=args.workers, batch_sizes=args.batch_windows,
+                       num_windows=args.windows, repeat=args.repeat, verbose=True)
+    for entry in profile.entries:
+        print('p={model_order} maxtau={maxtau} freq_points={freq_points}: {backend}, {workers} workers, '
+              'batches of {batch_windows}, {throughput:.1f} windows/s ({serial_throughput:.1f} serial)'.format(**entry))
+    print('Profile written to', profile_path(args.cache_dir))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='hvarma')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Run jobs sent over a UNIX socket")
+    serve_parser.add_argument('socket', type=str, help="Path of the UNIX socket")
+    serve_parser.add_argument('--workers', type=int, help="Number of worker processes", default=None)
+    serve_parser.add_argument('--cache_dir', type=str, help="Directory of the shared result cache", default=None)
+    serve_parser.add_argument('--threads', help="Use worker threads instead of processes", action='store_true')
+    serve_parser.set_defaults(func=serve_command)
+
+    batch_parser = commands.add_parser('batch', help="Process many stations")
+    batch_parser.add_argument('root', type=str, nargs='?', help="Directory tree with Z/N/E triplets")
+    batch_parser.add_argument('--manifest', type=str, help="CSV file with columns station, Z, N, E")
+    batch_parser.add_argument('--output_dir', type=str, help="Directory in which to store output", default='.')
+    batch_parser.add_argument('--args', type=str, help="File with all the default arguments.", default=None)
+    batch_parser.add_argument('--workers', type=int, help="Number of worker processes", default=None)
+    batch_parser.add_argument('--prefetch', type=int, help="Stations queued ahead of the workers", default=2)
+    batch_parser.add_argument('--order_search', help="Find the model order of each station", action='store_true')
+    batch_parser.add_argument('--tol', type=float, help="Tolerance of the order search", default=0.05)
+    batch_parser.set_defaults(func=batch_command)
+
+    queue_parser = commands.add_parser('queue', help="Add stations to a work queue")
+    queue_parser.add_argument('queue', type=str, help="Directory of the work queue")
+    queue_parser.add_argument('root', type=str, nargs='?', help="Directory tree with Z/N/E triplets")
+    queue_parser.add_argument('--manifest', type=str, help="CSV file with columns station, Z, N, E")
+    queue_parser.add_argument('--args', type=str, help="File with all the default arguments.", default=None)
+    queue_parser.add_argument('--order_search', help="Find the model order of each station", action='store_true')
+    queue_parser.add_argument('--tol', type=float, help="Tolerance of the order search", default=0.05)
+    queue_parser.set_defaults(func=queue_command)
+
+    worker_parser = commands.add_parser('worker', help="Run the jobs of a work queue")
+    worker_parser.add_argument('queue', type=str, help="Directory of the work queue")
+    worker_parser.add_argument('--workers', type=int, help="Number of worker processes", default=None)
+    worker_parser.add_argument('--cache_dir', type=str, help="Directory of the shared result cache", default=None)
+    worker_parser.add_argument('--heartbeat', type=float, help="Seconds between heartbeats", default=30)
+    worker_parser.add_argument('--stale_after', type=float, help="Seconds after which a claim is stale",
+                               default=300)
+    worker_parser.add_argument('--max_attempts', type=int, help="Claims of a job before it fails", default=3)
+    worker_parser.add_argument('--wait', help="Keep waiting for new jobs", action='store_true')
+    worker_parser.add_argument('--summary', type=str, help="Write a summary table when done", default=None)
+    worker_parser.set_defaults(func=worker_command)
+
+    autotune_parser = commands.add_parser('autotune', help="Find the fastest backend of run_model on this host")
+    autotune_parser.add_argument('--cache_dir', type=str, help="Directory where the profile is stored", default=None)
+    autotune_parser.add_argument('--workers', type=int, nargs='+', help="Numbers of workers to try", default=None)
+    autotune_parser.add_argument('--batch_windows', type=int, nargs='+', help="Batch sizes to try",
+                                 default=[4, 16, 64])
+    autotune_parser.add_argument('--windows', type=int, help="Windows of each run", default=None)
+    autotune_parser.add_argument('--repeat', type=int, help="Runs of each choice, the best is kept", default=2)
+    autotune_parser.set_defaults(func=autotune_command)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Asynchronous counterparts of run_model and find_optimal_order.
+
+Windows are processed in batches on an executor (threads, since windows
+share the samples of data), so the event loop stays responsive. Jobs can
+be cancelled between batches, report progress through a ProgressStream
+and share a limiter to bound the number of concurrent jobs.
+
+Usage example:
+    limiter = asyncio.Semaphore(4)
+    progress = ProgressStream()
+    task = asyncio.create_task(run_model_async(data, param, progress=progress, limiter=limiter))
+    async for event in progress:
+        print(event.stage, event.done, event.total)
+    results = await task
+"""
+
+import asyncio
+import contextlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from .processing import AverageData, OrderSearchResults
+from .preprocessing import decimate, effective_parameters, screen_windows
+from .running import data_windows, get_difference, convergence_condition, solve_serial
+from .cache import get_cache
+
+
+@contextlib.asynccontextmanager
+async def no_limit():
+    """ Asynchronous null context, since contextlib.nullcontext is only
+        asynchronous from Python 3.10 on. """
+    yield
+
+
+@dataclass
+class Progress:
+    """ Progress event of an asynchronous job: windows solved for
+        a model order, or orders tested in a search (total is 0 if unknown). """
+    stage: str
+    done: int
+    total: int
+    order: int = None
+
+
+class ProgressStream:
+    """ Async iterator over the Progress events of one or more jobs.
+        Iteration ends when close is called (jobs close their stream when they finish). """
+    _END = object()
+
+    def __init__(self, maxsize=0):
+        self.queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    def put(self, event):
+        if not self.closed:
+            self.queue.put_nowait(event)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(self._END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is self._END:
+            raise StopAsyncIteration
+        return event
+
+
+def next_windows(iterator, num):
+    """ Up to num windows from iterator. """
+    windows = []
+    for data_window in iterator:
+        windows.append(data_window)
+        if len(windows) == num:
+            break
+    return windows
+
+
+async def compute_model_async(data, param, executor, batch_windows, progress):
+    """ Asynchronous compute_model. Batches of windows are solved in turn. """
+    loop = asyncio.get_running_loop()
+    data, param, factor = await loop.run_in_executor(executor, decimate, data, param)
+
+    starts, screening = None, None
+    if param.screen:
+        screening = await loop.run_in_executor(executor, screen_windows, data, param)
+        starts = screening.accepted_starts()
+        if len(starts) == 0:
+            raise ValueError('All windows were rejected by the screening')
+
+    if starts is None:
+        size, overlap = param.window_size, param.overlap
+        total = min((data.size - overlap) // (size - overlap), param.max_windows)
+    else:
+        total = min(len(starts), param.max_windows)
+
+    windows = data_windows(data, param, starts)
+    models = []
+    while len(models) < total:
+        num = min(batch_windows, total - len(models))
+        batch = await loop.run_in_executor(executor, next_windows, windows, num)
+        if not batch:
+            break
+        models += await loop.run_in_executor(executor, solve_serial, batch, param)
+        if progress is not None:
+            progress.put(Progress('windows', len(models), total, param.model_order))
+
+    return await loop.run_in_executor(executor, lambda: AverageData(models, param, decimation=factor,
+                                                                    screening=screening))
+
+
+async def run_model_async(data, param, executor=None, batch_windows=16, progress=None, limiter=None,
+                          cache=None, close_progress=True):
+    """ Asynchronous run_model (without plotting or writing).
+        executor runs the window batches (default executor of the loop if None),
+        progress is a ProgressStream receiving an event after each batch,
+        limiter is an asyncio.Semaphore shared by jobs to bound concurrency.
+        Cancellation takes effect between batches.   """
+    loop = asyncio.get_running_loop()
+    try:
+        async with limiter if limiter is not None else no_limit():
+            cache = get_cache(cache)
+            key = await loop.run_in_executor(executor, cache.key, data, param) if cache is not None else None
+            results = await loop.run_in_executor(executor, cache.get, key) if cache is not None else None
+            if results is None:
+                results = await compute_model_async(data, param, executor, batch_windows, progress)
+                if cache is not None:
+                    await loop.run_in_executor(executor, cache.put, key, results)
+            return results
+    finally:
+        if progress is not None and close_progress:
+            progress.close()
+
+
+async def find_optimal_order_async(data, param, tol=0.05, start_order=4, executor=None, batch_windows=16,
+                                   progress=None, limiter=None, cache=None):
+    """ Asynchronous find_optimal_order with the fast method.
+        The limiter is held for the whole search. Progress events are
+        sent for the windows of each order and for each tested order. """
+    assert start_order >= 4
+    tested_orders = OrderedDict()
+
+    async def results_for(order):
+        if order not in tested_orders:
+            tested_orders[order] = await run_model_async(data, param.update({'model_order': order}), executor,
+                                                         batch_windows, progress, cache=cache,
+                                                         close_progress=False)
+            if progress is not None:
+                progress.put(Progress('orders', len(tested_orders), 0, order))
+        return tested_orders[order]
+
+    async def converged(order):
+        results_cur = await results_for(order)
+        results_prev = await results_for(order - 3)
+        return convergence_condition(*get_difference(results_cur, results_prev), tol=tol)
+
+    try:
+        async with limiter if limiter is not None else no_limit():
+            max_order = effective_parameters(data, param).maxtau
+            order = start_order
+            while not await converged(order):
+                if order == max_order:
+                    break
+                order = min(int(order * 2), max_order)
+
+            low_p, high_p = int(order / 2), order
+            while low_p < high_p:
+                mid_p = (high_p + low_p) // 2
+                if await converged(mid_p):
+                    high_p = mid_p
+                else:
+                    low_p = mid_p + 1
+
+            success = await converged(low_p)
+            return OrderSearchResults(tested_orders, tol, 'fast', low_p, data.station, success)
+    finally:
+        if progress is not None:
+            progress.close()
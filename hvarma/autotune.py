@@ -0,0 +1,259 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Choice of the execution backend of run_model on each host.
+
+The windows of run_model are solved serially, or in batches on worker
+threads or processes. Which is fastest depends on the model order,
+maxtau, the frequency points and the number of cores, so autotune
+measures the throughput of every backend, batch size and number of
+workers on representative parameter sets and stores the fastest of each
+in a per-host profile under default_cache_dir(). run_model uses the
+choice of the closest parameter set when no backend is given, and runs
+serially if the host has no profile.
+
+Usage example:
+    profile = autotune()
+    backend = choose_backend(param)
+    results = run_model(data, param, verbose=False)  # uses the profile
+    with Backend('processes', workers=8, batch_windows=16) as backend:
+        results = [run_model(data, param, verbose=False, backend=backend) for param in params]
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import multiprocessing
+from functools import lru_cache
+from dataclasses import dataclass, field
+import numpy as np
+from .cache import default_cache_dir
+from .estimate import host_key
+
+PROFILE_VERSION = 1
+
+BACKENDS = ('serial', 'threads', 'processes')
+
+# Parameter sets of the tuning runs, from cheap to expensive windows
+TUNING_PARAMS = [
+    {'window_size': 256, 'maxtau': 32, 'model_order': 8, 'nfir': 16, 'freq_points': 200},
+    {'window_size': 512, 'maxtau': 64, 'model_order': 20, 'nfir': 40, 'freq_points': 500},
+    {'window_size': 1024, 'maxtau': 128, 'model_order': 42, 'nfir': 40, 'freq_points': 1000},
+    {'window_size': 2048, 'maxtau': 256, 'model_order': 80, 'nfir': 80, 'freq_points': 2000},
+]
+
+# Parameters that select the closest entry of a profile
+TUNING_KEYS = ('window_size', 'maxtau', 'model_order', 'freq_points')
+
+
+@dataclass
+class Backend:
+    """ How run_model solves the windows: 'serial', or batches of batch_windows
+        windows on workers 'threads' or 'processes'. Used as a context, its
+        pool is kept open and shared by all the runs inside, e.g. the orders
+        of a search; otherwise each run starts its own pool.  """
+    name: str = 'serial'
+    workers: int = 1
+    batch_windows: int = 1
+    pool: object = field(default=None, compare=False, repr=False)
+    depth: int = field(default=0, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.name not in BACKENDS:
+            raise ValueError(f'Unknown backend {self.name}, use one of {", ".join(BACKENDS)}')
+
+    def __enter__(self):
+        if self.depth == 0 and self.name != 'serial':
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            pool_class = ProcessPoolExecutor if self.name == 'processes' else ThreadPoolExecutor
+            self.pool = pool_class(max_workers=self.workers)
+            open_pools(1)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0 and self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+            open_pools(-1)
+
+
+SERIAL = Backend()
+
+_open_pools = 0
+_pools_lock = threading.Lock()
+
+
+def open_pools(change=0):
+    """ Number of pools of Backend contexts open in this process, after adding change. """
+    global _open_pools
+    with _pools_lock:
+        _open_pools += change
+        return _open_pools
+
+
+def in_worker():
+    """ True in a worker process, or while a Backend has a pool open, whose
+        workers would otherwise start pools of their own.  """
+    return multiprocessing.parent_process() is not None or open_pools() > 0
+
+
+class Profile:
+    """ Fastest backend, workers and batch_windows of each tuned parameter set
+        of a host. Each entry also holds its throughput (windows per second)
+        and that of the serial backend.   """
+
+    def __init__(self, entries, cpu_count, host=None):
+        self.entries = [dict(entry) for entry in entries]
+        self.cpu_count = cpu_count
+        self.host = host or host_key()
+
+    def closest(self, param):
+        """ Entry tuned on the parameters closest to param. """
+        values = np.array([getattr(param, key) for key in TUNING_KEYS], dtype=float)
+
+        def distance(entry):
+            tuned = np.array([entry[key] for key in TUNING_KEYS], dtype=float)
+            return np.abs(np.log(values / tuned)).sum()
+        return min(self.entries, key=distance)
+
+    def choose(self, param):
+        """ backend, workers, batch_windows of the entry closest to param. """
+        if not self.entries:
+            return 'serial', 1, 1
+        best = self.closest(param)
+        return best['backend'], min(best['workers'], os.cpu_count() or 1), best['batch_windows']
+
+    def to_dict(self):
+        return {'version': PROFILE_VERSION, 'host': self.host, 'numpy': np.__version__,
+                'cpu_count': self.cpu_count, 'entries': self.entries}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['entries'], values['cpu_count'], values['host'])
+
+
+def profile_path(cache_dir=None):
+    directory = os.path.join(cache_dir if cache_dir is not None else default_cache_dir(), 'autotune')
+    return os.path.join(directory, f'profile-{host_key()}.json')
+
+
+@lru_cache(maxsize=4)
+def read_profile(path, mtime):
+    """ Profile stored in path, kept in memory while the file is unchanged. """
+    with open(path) as file:
+        values = json.load(file)
+    if values.get('version') != PROFILE_VERSION or values.get('numpy') != np.__version__:
+        return None
+    return Profile.from_dict(values)
+
+
+def load_profile(cache_dir=None):
+    """ Profile of this host, or None if it was not tuned. """
+    path = profile_path(cache_dir)
+    try:
+        return read_profile(path, os.stat(path).st_mtime_ns)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_profile(profile, cache_dir=None):
+    path = profile_path(cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(profile.to_dict(), file, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def choose_backend(param, backend=None, workers=None, batch_windows=None, cache_dir=None):
+    """ Backend for run_model. backend is a Backend, returned as is, or its
+        name. Missing choices come from the profile of this host if backend
+        is None, else all the cores and batches of 16 windows. Without
+        backend the choice is serial in a worker process or inside an open
+        Backend, see in_worker.   """
+    if isinstance(backend, Backend):
+        return backend
+    if backend is None:
+        profile = None if in_worker() else load_profile(cache_dir)
+        if profile is not None:
+            backend, tuned_workers, tuned_batch = profile.choose(param)
+            return Backend(backend, workers or tuned_workers, batch_windows or tuned_batch)
+        backend = 'serial'
+    if backend == 'serial':
+        return Backend()
+    return Backend(backend, workers or os.cpu_count() or 1, batch_windows or 16)
+
+
+def candidates(workers, batch_sizes):
+    """ (backend, workers, batch_windows) combinations to measure. """
+    combinations = [('serial', 1, 1)]
+    for backend in BACKENDS[1:]:
+        for num_workers in workers:
+            for batch_windows in batch_sizes:
+                combinations.append((backend, num_workers, batch_windows))
+    return combinations
+
+
+def default_workers():
+    """ Powers of two up to the number of cores, and the number of cores. """
+    cpu_count = os.cpu_count() or 1
+    workers = [2 ** k for k in range(1, cpu_count.bit_length()) if 2 ** k < cpu_count]
+    return workers + [cpu_count] if cpu_count > 1 else []
+
+
+def measure(arrays, param, backend, workers, batch_windows, repeat):
+    """ Best throughput (windows per second) of run_model on copies of arrays. """
+    from .read_input import Data
+    from .running import run_model
+    best = np.inf
+    for _ in range(repeat):
+        data = Data(*arrays, 100, 'TUNE')
+        beg = time.perf_counter()
+        results = run_model(data, param, verbose=False, backend=backend, workers=workers,
+                            batch_windows=batch_windows)
+        best = min(best, time.perf_counter() - beg)
+    return results.num_windows / best
+
+
+def autotune(cache_dir=None, params=None, workers=None, batch_sizes=(4, 16, 64), num_windows=None,
+             repeat=2, seed=0, verbose=False):
+    """ Measure every backend on each parameter set of params (TUNING_PARAMS
+        by default) and save the fastest in the profile of this host.
+        workers are the numbers of workers to try (default_workers() by
+        default) and num_windows the windows per run, at least 64 and 4
+        per worker by default. Returns the Profile.    """
+    from .read_input import ArmaParam
+    from .synthetic import SyntheticModel, synthetic_data
+
+    workers = default_workers() if workers is None else list(workers)
+    num_windows = num_windows or max(64, 4 * max(workers, default=1))
+    model = SyntheticModel.from_resonances([2.5], 0.05, 100)
+    entries = []
+    for values in params or TUNING_PARAMS:
+        values = dict(values, overlap=values['window_size'] // 2, max_windows=num_windows,
+                      neg_freq=-10, pos_freq=10)
+        param = ArmaParam().update(values)
+        data = synthetic_data(model, (num_windows + 3) * param.overlap / 100, seed=seed)
+        arrays = (data.dataZ, data.dataN, data.dataE)
+        measure(arrays, param, 'serial', 1, 1, 1)  # Warm up
+
+        throughput = {}
+        for choice in candidates(workers, [size for size in batch_sizes if size <= num_windows]):
+            throughput[choice] = measure(arrays, param, *choice, repeat)
+            if verbose:
+                print('p={model_order} maxtau={maxtau} freq_points={freq_points}'.format(**values),
+                      '{} workers={} batch={}:'.format(*choice), round(throughput[choice], 1), 'windows/s')
+        backend, num_workers, batch_windows = max(throughput, key=throughput.get)
+        entries.append({**{key: values[key] for key in TUNING_KEYS}, 'backend': backend,
+                        'workers': num_workers, 'batch_windows': batch_windows,
+                        'throughput': throughput[backend, num_workers, batch_windows],
+                        'serial_throughput': throughput['serial', 1, 1]})
+
+    profile = Profile(entries, os.cpu_count())
+    save_profile(profile, cache_dir)
+    return profile
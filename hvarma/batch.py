@@ -0,0 +1,191 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Batch processing of many stations.
+
+Stations are discovered as Z/N/E SAC triplets in a directory tree or
+listed in a manifest. Station jobs hold the file names of each station,
+which worker processes read and decode before running the model.
+Each station gets its own output directory and a summary table with
+one row per station is written at the end.
+"""
+
+import os
+import re
+import csv
+import time
+from dataclasses import dataclass
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SUMMARY_FIELDS = ('station', 'status', 'model_order', 'num_windows', 'pos_freq', 'pos_err',
+                  'neg_freq', 'neg_err', 'elapsed', 'error')
+
+# Component as last letter before the extension, e.g. B001_Z.sac or XX.STA..HHZ.SAC
+TRIPLET_PATTERN = re.compile(r'^(?P<name>.*?)(?P<comp>[ZNE])\.(?P<ext>sac|mseed|msd)$', re.IGNORECASE)
+
+
+@dataclass
+class StationJob:
+    """ Files of one station. sampling_rate and station are needed for npy files only. """
+    name: str
+    Z: str
+    N: str
+    E: str
+    format: str = 'sac'
+    sampling_rate: float = None
+    station: str = None
+
+
+def discover_triplets(root):
+    """ Find Z/N/E SAC or miniSEED triplets in the directory tree of root.
+        Files of a triplet share their name except for the component letter.
+        Stations found in several directories are named by their path
+        relative to root, e.g. 2021/B001 and 2022/B001.   """
+    found = []
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        groups = {}
+        for fname in sorted(filenames):
+            match = TRIPLET_PATTERN.match(fname)
+            if match is not None:
+                key = (match['name'], match['ext'].lower())
+                groups.setdefault(key, {})[match['comp'].upper()] = os.path.join(dirpath, fname)
+        for (name, ext), comps in sorted(groups.items()):
+            if len(comps) == 3:
+                name = name.rstrip('._-') or os.path.basename(dirpath)
+                found.append((os.path.relpath(dirpath, root), name, comps, 'sac' if ext == 'sac' else 'mseed'))
+
+    counts = Counter(name for _, name, _, _ in found)
+    jobs = []
+    for directory, name, comps, fmt in found:
+        if counts[name] > 1 and directory != os.curdir:
+            name = os.path.join(directory, name)
+        jobs.append(StationJob(name, comps['Z'], comps['N'], comps['E'], fmt))
+    check_names(jobs)
+    return jobs
+
+
+def read_manifest(filename):
+    """ Read station jobs from a CSV file with columns station, Z, N, E and
+        optionally format and sampling_rate. Relative paths are taken
+        from the directory of the manifest.    """
+    base = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with open(filename, newline='') as file:
+        for row in csv.DictReader(file):
+            paths = [os.path.join(base, row[comp]) for comp in 'ZNE']
+            sampling_rate = row.get('sampling_rate')
+            jobs.append(StationJob(row['station'], *paths, row.get('format') or 'sac',
+                                   float(sampling_rate) if sampling_rate else None, row['station']))
+    check_names(jobs)
+    return jobs
+
+
+def check_names(jobs):
+    """ Raise ValueError if several jobs have the same name, since their
+        outputs would be written to the same directory.   """
+    duplicates = sorted(name for name, count in Counter(job.name for job in jobs).items() if count > 1)
+    if duplicates:
+        raise ValueError(f'Duplicated station names: {", ".join(duplicates)}')
+
+
+def load_station(job):
+    """ Read and decode the data of a station. """
+    from .read_input import Data
+    from .server import load_arrays
+    arrays, sampling_rate, station = load_arrays(job.format, (job.Z, job.N, job.E), job.sampling_rate,
+                                                 job.station or job.name)
+    return Data(*arrays, sampling_rate, station, copy_data=False)
+
+
+def process_station(job, param, output_dir, order_search=False, tol=0.05):
+    """ Read and run a station in a worker and write its outputs. Returns its
+        summary row. Stations already run in parallel, so each one is solved serially. """
+    from .running import run_model, find_optimal_order
+    from .write_output import write_results
+    beg = time.time()
+    data = load_station(job)
+    param = param.update({'output_dir': os.path.join(output_dir, job.name)})
+    os.makedirs(param.output_dir, exist_ok=True)
+    if order_search:
+        results = find_optimal_order(data, param, tol=tol, backend='serial')
+        results = results.order_results[results.final_order]
+    else:
+        results = run_model(data, param, verbose=False, backend='serial')
+    param = results.param.update({'output_dir': param.output_dir})
+    write_results(data, param, results, binary=True)
+
+    pos_freq, pos_err, neg_freq, neg_err = results.get_frequency(param.freq_conf)
+    return {'station': job.name, 'status': 'ok', 'model_order': param.model_order,
+            'num_windows': results.num_windows, 'pos_freq': pos_freq, 'pos_err': pos_err,
+            'neg_freq': neg_freq, 'neg_err': neg_err, 'elapsed': round(time.time() - beg, 3), 'error': ''}
+
+
+def failed_row(name, err):
+    row = dict.fromkeys(SUMMARY_FIELDS, '')
+    row.update({'station': name, 'status': 'error', 'error': f'{type(err).__name__}: {err}'})
+    return row
+
+
+def finished_stations(running, jobs):
+    """ Wait for the first stations of running, futures mapped to job indices,
+        to finish. Yields the index and summary row of each.  """
+    done, _ = wait(running, return_when=FIRST_COMPLETED)
+    for future in done:
+        idx = running.pop(future)
+        try:
+            row = future.result()
+        except Exception as err:
+            row = failed_row(jobs[idx].name, err)
+        yield idx, row
+
+
+def run_stations(pool, jobs, max_running, *args):
+    """ Submit process_station(job, *args) of each job to pool, with at most
+        max_running stations submitted at a time. Yields the index and
+        summary row of each job as it finishes.  """
+    running = {}
+    for idx, job in enumerate(jobs):
+        if len(running) == max_running:
+            yield from finished_stations(running, jobs)
+        running[pool.submit(process_station, job, *args)] = idx
+    while running:
+        yield from finished_stations(running, jobs)
+
+
+def run_batch(jobs, param, output_dir, workers=None, prefetch=2, order_search=False, tol=0.05,
+              processes=True, verbose=True):
+    """ Process station jobs on workers, which read the files of their
+        stations. prefetch stations are queued ahead of the workers, so they
+        never wait for the next one. Writes the outputs of each station in
+        its own directory under output_dir and the summary table summary.csv.
+        Returns the summary rows, in the order of jobs.   """
+    check_names(jobs)
+    workers = workers or os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    rows = [None] * len(jobs)
+    beg = time.time()
+
+    with pool_class(max_workers=workers) as pool:
+        for idx, row in run_stations(pool, jobs, workers + prefetch, param, output_dir, order_search, tol):
+            rows[idx] = row
+            if verbose:
+                finished = sum(row is not None for row in rows)
+                print(f'{finished}/{len(jobs)} {jobs[idx].name}: {row["status"]}', flush=True)
+
+    write_summary(rows, os.path.join(output_dir, 'summary.csv'))
+    if verbose:
+        elapsed = time.time() - beg
+        print('Processed', len(jobs), 'stations in', round(elapsed / 60, 1), 'min,',
+              round(3600 * len(jobs) / max(elapsed, 1e-9)), 'stations per hour')
+    return rows
+
+
+def write_summary(rows, filename):
+    """ Write the summary table, one row per station. """
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
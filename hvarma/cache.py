@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Persistent cache of model results.
+
+Results are stored in binary format under a hash of the input samples,
+the sampling rate, the station and the parameters that affect them.
+The cache directory can be shared by several processes.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+
+# Parameters that do not change the content of AverageData
+IGNORED_FIELDS = ('freq_conf', 'plot_conf', 'output_dir')
+CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    """ Directory for hvarma caches, HVARMA_CACHE_DIR or ~/.cache/hvarma """
+    return os.environ.get('HVARMA_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'hvarma'))
+
+
+def data_digest(data, chunk_size=2**20):
+    """ Hash of the samples, sampling rate and station of Data or LazyData.
+        The arrays' buffers are hashed in place, LazyData is read in chunks. """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([data.size, data.sampling_rate, data.station]).encode())
+    if hasattr(data, 'readers'):  # LazyData
+        for reader in data.readers:
+            for start in range(0, data.size, chunk_size):
+                digest.update(reader.read(start, min(start + chunk_size, data.size)))
+    else:
+        for comp in (data.dataZ, data.dataN, data.dataE):
+            digest.update(np.ascontiguousarray(comp).data)
+    return digest.hexdigest()
+
+
+def param_digest(param):
+    """ Hash of the parameters that affect the results. """
+    values = {key: value for key, value in param.get_dict().items() if key not in IGNORED_FIELDS}
+    values['cache_version'] = CACHE_VERSION
+    return hashlib.blake2b(json.dumps(values, sort_keys=True).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """ Content-addressed on-disk cache of AverageData, bounded in size.
+        Least recently used entries are evicted first.  """
+
+    def __init__(self, directory=None, max_bytes=2**30):
+        self.directory = directory if directory is not None else os.path.join(default_cache_dir(), 'results')
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, data, param):
+        return data_digest(data) + '-' + param_digest(param)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """ Return cached results or None. """
+        from .write_output import read_binary_results
+        path = self.path(key)
+        try:
+            results = read_binary_results(path)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):  # Corrupt entry
+            self.remove(path)
+            return None
+        return results
+
+    def put(self, key, results):
+        """ Store results. The file is written aside and moved in place atomically. """
+        from .write_output import write_binary_results
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write_binary_results(results, file)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            self.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """ List of (mtime, size, path) of the cached results. """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits in max_bytes. """
+        with self.lock():
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+
+    def clear(self):
+        with self.lock():
+            for _, _, path in self.entries():
+                self.remove(path)
+
+    def lock(self):
+        return FileLock(os.path.join(self.directory, '.lock'))
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class FileLock:
+    """ Exclusive inter-process lock on a file (no-op where flock is missing). """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        try:
+            import fcntl
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()  # Releases the lock
+        self.file = None
+
+
+def get_cache(cache):
+    """ Accept a ResultCache, a directory name or None. """
+    if cache is None or isinstance(cache, ResultCache):
+        return cache
+    return ResultCache(cache)
@@ -0,0 +1,103 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Checkpoints of long computations.
+
+A checkpoint directory stores the results of every finished run_model
+call (as a ResultCache) and the models of the windows solved so far
+by the current call, in compressed chunks. Running again with the same
+checkpoint skips the finished windows and orders, replaying the
+centering of their windows so that results are identical.
+"""
+
+import os
+import tempfile
+import numpy as np
+from .cache import ResultCache
+
+WINDOW_FIELDS = ('a', 'b', 'coherence', 'auto_cov_x', 'auto_cov_v', 'cross_cov_v_zx', 'cross_cov_zx_v')
+
+
+class Checkpoint(ResultCache):
+    """ ResultCache without size limit that also keeps the partial window
+        results of the runs in progress, saved every `every` windows.  """
+
+    def __init__(self, directory, every=50):
+        super().__init__(os.path.join(directory, 'results'), max_bytes=float('inf'))
+        self.window_dir = os.path.join(directory, 'windows')
+        self.every = every
+
+    def windows(self, key):
+        return WindowCheckpoint(os.path.join(self.window_dir, key), self.every)
+
+
+class WindowCheckpoint:
+    """ Models of the consecutive windows solved by a run, saved in chunks. """
+
+    def __init__(self, directory, every=50):
+        self.directory = directory
+        self.every = every
+        self.buffer = []
+        self.saved = None
+
+    def chunk_files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith('windows_') and name.endswith('.npz'))
+
+    def load(self):
+        """ Arrays of the saved windows (one row per window), or None. """
+        chunks = []
+        for fname in self.chunk_files():
+            first = int(os.path.basename(fname)[len('windows_'):-len('.npz')])
+            if first != sum(len(chunk['a']) for chunk in chunks):
+                break  # Chunks must be consecutive
+            with np.load(fname) as npz:
+                chunks.append({field: npz[field] for field in WINDOW_FIELDS})
+        self.saved = sum(len(chunk['a']) for chunk in chunks)
+        if not chunks:
+            return None
+        return {field: np.concatenate([chunk[field] for chunk in chunks]) for field in WINDOW_FIELDS}
+
+    def add(self, model):
+        """ Add the model of the next window, saving a chunk every `every` windows. """
+        self.buffer.append(model)
+        if len(self.buffer) == self.every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.saved is None:
+            self.load()
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {'a': np.vstack([model.a for model in self.buffer]),
+                  'b': np.vstack([model.b for model in self.buffer]),
+                  'coherence': np.vstack([model.coherence for model in self.buffer])}
+        for name, covs in zip(WINDOW_FIELDS[3:], zip(*[model.correlations for model in self.buffer])):
+            arrays[name] = np.vstack(covs)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(tmp_path, os.path.join(self.directory, f'windows_{self.saved:09d}.npz'))
+        self.saved += len(self.buffer)
+        self.buffer = []
+
+    def clear(self):
+        """ Remove the saved windows once the run has finished. """
+        for fname in self.chunk_files():
+            os.remove(fname)
+        if os.path.isdir(self.directory):
+            os.rmdir(self.directory)
+        self.buffer = []
+        self.saved = 0
+
+
+def restore_window(model, saved, idx):
+    """ Set the results of a saved window on a (centered) HVarma model. """
+    model.a = saved['a'][idx]
+    model.b = saved['b'][idx]
+    model.coherence = saved['coherence'][idx]
+    model.correlations = tuple(saved[name][idx] for name in WINDOW_FIELDS[3:])
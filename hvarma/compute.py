@@ -30,10 +30,21 @@ def setup_c_extension():
                     ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
                     ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
                     ctypes.c_size_t, ctypes.c_int, ctypes.c_int]
-    return fun
 
+    assemble = CLIB.assemble_equations
+    assemble.restype = None
+    assemble.argtypes = [ndpointer(np.complex128, flags="C_CONTIGUOUS"),
+                         ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
+                         ndpointer(np.complex128, flags="C_CONTIGUOUS"),
+                         ctypes.c_double, ctypes.c_double,
+                         ctypes.c_size_t,
+                         ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
+                         ndpointer(ctypes.c_double, flags="C_CONTIGUOUS"),
+                         ctypes.c_int, ctypes.c_int]
+    return fun, assemble
 
-compute_equations_c = setup_c_extension()
+
+compute_equations_c, assemble_equations_c = setup_c_extension()
 
 
 def compute_crosscovariance(dataE, dataN, dataZ, size, maxtau):
@@ -70,6 +81,40 @@ def compute_autocovariance(dataE, dataN, dataZ, size, maxtau):
     return auto_cov_x, auto_cov_v
 
 
+def compute_covariances_batch(dataE, dataN, dataZ, maxtau):
+    """ Compute auto and crosscovariances for a batch of windows (one per row).
+        Returns the same quantities as compute_autocovariance and
+        compute_crosscovariance, with one row per window.      """
+    x = dataN + 1j * dataE
+    v = dataZ
+    size = x.shape[-1]
+    batch_shape = x.shape[:-1] + (maxtau,)
+
+    auto_cov_x = np.zeros(batch_shape, dtype=complex)
+    auto_cov_v = np.zeros(batch_shape)
+    cross_cov_v_zx = np.zeros(batch_shape, dtype=complex)
+    cross_cov_zx_v = np.zeros(batch_shape, dtype=complex)
+    xc = np.conj(x)
+    for tau in range(maxtau):
+        auto_cov_x[..., tau] = np.einsum('...i,...i->...', x[..., tau:], xc[..., :size - tau])
+        auto_cov_v[..., tau] = np.einsum('...i,...i->...', v[..., tau:], v[..., :size - tau])
+        cross_cov_zx_v[..., tau] = np.einsum('...i,...i->...', x[..., tau:], v[..., :size - tau])
+        cross_cov_v_zx[..., tau] = np.einsum('...i,...i->...', v[..., tau:], x[..., :size - tau])
+
+    for cov in (auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v):
+        cov /= size
+    return auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v
+
+
+def full_lag_covariances(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v):
+    """ Arrange covariances of lags 0..maxtau (last axis) as the lags
+        -maxtau..maxtau expected by assemble_equations.   """
+    zcx = np.concatenate((np.conj(auto_cov_x[..., :0:-1]), auto_cov_x), axis=-1)
+    cv = np.concatenate((auto_cov_v[..., :0:-1], auto_cov_v), axis=-1)
+    zcxv = np.concatenate((cross_cov_v_zx[..., :0:-1], cross_cov_zx_v), axis=-1)
+    return zcx, cv, zcxv
+
+
 def compute_equations(dataE, dataN, dataZ, mu, nu, wsize, p, maxtau):
     """ Wrapper of C function to compute equations.
         Uses compiled library "gradient.so".    """
@@ -77,7 +122,7 @@ def compute_equations(dataE, dataN, dataZ, mu, nu, wsize, p, maxtau):
     for data in [dataZ, dataN, dataE]:
         assert len(data) == wsize
         assert isinstance(data, np.ndarray)
-        assert data.dtype is np.dtype('float64')
+        assert data.dtype == np.float64
 
 
 
@@ -90,6 +135,59 @@ def compute_equations(dataE, dataN, dataZ, mu, nu, wsize, p, maxtau):
     return mat, indep
 
 
+def compute_lag_covariances(dataE, dataN, dataZ, maxtau):
+    """ Covariances for lags -maxtau..maxtau, stored at index maxtau+tau,
+        as computed by the C extension: horizontal autocovariance zcx,
+        vertical autocovariance cv and crosscovariance zcxv. Also returns
+        the horizontal pseudo-autocovariance pxx (without conjugation). """
+    x = dataN + 1j * dataE
+    v = dataZ
+    size = len(x)
+    zcx = np.zeros(2 * maxtau + 1, dtype=complex)
+    pxx = np.zeros(2 * maxtau + 1, dtype=complex)
+    cv = np.zeros(2 * maxtau + 1)
+    zcxv = np.zeros(2 * maxtau + 1, dtype=complex)
+    for tau in range(maxtau + 1):
+        zcx[maxtau + tau] = np.sum(x[tau:] * np.conj(x[:size - tau])) / size
+        pxx[maxtau + tau] = np.sum(x[tau:] * x[:size - tau]) / size
+        cv[maxtau + tau] = np.sum(v[tau:] * v[:size - tau]) / size
+        zcxv[maxtau + tau] = np.sum(x[tau:] * v[:size - tau]) / size
+        zcxv[maxtau - tau] = np.sum(x[:size - tau] * v[tau:]) / size
+    zcx[:maxtau] = np.conj(zcx[:maxtau:-1])
+    pxx[:maxtau] = pxx[:maxtau:-1]
+    cv[:maxtau] = cv[:maxtau:-1]
+    return zcx, cv, zcxv, pxx
+
+
+def rotate_covariances(zcx, cv, zcxv, pxx, azimuths):
+    """ Covariances of the horizontal component along each azimuth
+        (degrees from North towards East), h = N cos(az) + E sin(az),
+        obtained in closed form from those of x = N + iE.
+        Returns zcx, cv, zcxv with one row per azimuth.   """
+    theta = np.deg2rad(np.asarray(azimuths, dtype=float))[:, None]
+    phase = np.exp(-1j * theta)
+    zcx_rot = (0.5 * np.real(zcx) + 0.5 * np.real(phase ** 2 * pxx)).astype(complex)
+    zcxv_rot = np.real(phase * zcxv).astype(complex)
+    cv_rot = np.broadcast_to(cv, zcx_rot.shape)
+    return zcx_rot, cv_rot, zcxv_rot
+
+
+def assemble_equations(zcx, cv, zcxv, mu, nu, p, maxtau):
+    """ Wrapper of C function to compute equations from covariances
+        given by compute_lag_covariances.    """
+    for cov in [zcx, cv, zcxv]:
+        assert len(cov) == 2 * maxtau + 1
+
+    size = 3 * p + 2
+    mat = np.zeros((size, size))
+    indep = np.zeros(size)
+
+    assemble_equations_c(np.ascontiguousarray(zcx, dtype=complex), np.ascontiguousarray(cv, dtype=float),
+                         np.ascontiguousarray(zcxv, dtype=complex), mu, nu, size, mat, indep, p, maxtau)
+
+    return mat, indep
+
+
 def transfer_function(f0, f1, npun, t, a, b, p):
     """ Compute H/V in frequency range [neg_freq,pos_freq] with freq_points points,
         for a model with coefficients a, b, (length p). t is sampling interval """
@@ -110,6 +208,81 @@ def transfer_function(f0, f1, npun, t, a, b, p):
     return np.abs(h/v)
 
 
+def compute_AIC_batch(dataE, dataN, dataZ, a, b):
+    """ Compute the AIC of a window for several models at once.
+        a, b have one row per model, see HVarma.get_AIC.  """
+    from numpy.lib.stride_tricks import sliding_window_view
+    x = dataN + 1j * dataE
+    v = dataZ
+    p, size = a.shape[-1], len(x)
+    xs = sliding_window_view(x, p)[:size - p]
+    vs = sliding_window_view(v, p)[:size - p]
+    ssr = np.sum(np.abs(xs @ a.T - vs @ b.T) ** 2, axis=0)
+    return 2 * 3 * p + size * np.log(ssr / size)
+
+
+def transfer_function_batch(f0, f1, npun, t, a, b):
+    """ Compute H/V as in transfer_function for a batch of models,
+        with coefficients a, b of shape (num_windows, p).  """
+    if f1 < f0 or 1/(2*t) < max(abs(f0), abs(f1)):
+        raise AttributeError('Wrong frequencies')
+
+    freq = np.linspace(f0, f1, npun)
+    z = np.exp(-1j * 2 * np.pi * freq * t)
+    zk = np.power.outer(z, np.arange(0, a.shape[-1]))
+    return np.abs((b @ zk.T) / (a @ zk.T))
+
+
+def batch_toeplitz(c, r):
+    """ Toeplitz matrices with first columns c and first rows r (one per row of c, r). """
+    n = c.shape[-1]
+    idx = np.arange(n)[:, None] - np.arange(n)[None, :]
+    return np.where(idx >= 0, c[..., np.abs(idx)], r[..., np.abs(idx)])
+
+
+def compute_coherence_batch(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v, nfir, f0, f1, npun, t,
+                            max_elements=2**22):
+    """ Compute coherence as in compute_coherence for a batch of windows
+        (covariances with one row per window). Windows are processed in
+        chunks so that temporaries have at most max_elements elements.  """
+    if f1 < f0 or 1 / (2 * t) < max(abs(f0), abs(f1)):
+        raise AttributeError('Wrong frequencies')
+
+    auto_cov_x = auto_cov_x[:, :nfir]
+    auto_cov_v = np.asarray(auto_cov_v[:, :nfir], dtype=complex)
+    zc1 = batch_toeplitz(auto_cov_x, np.conj(auto_cov_x))
+    zc2 = batch_toeplitz(auto_cov_v, auto_cov_v)
+    zc12 = batch_toeplitz(cross_cov_zx_v[:, :nfir], cross_cov_v_zx[:, :nfir])
+
+    # Perform inversions and products as in compute_coherence
+    zisum = np.linalg.inv(zc1 + zc2)
+    zic1 = np.linalg.inv(zc1)
+    zic2 = np.linalg.inv(zc2)
+    z2isum = zisum @ zisum
+    znum12 = zisum @ zc12 @ zisum
+    z2ic1 = zic1 @ zic1
+    z2ic2 = zic2 @ zic2
+
+    freq = np.linspace(f0, f1, npun)
+    z = np.exp(1j * 2 * np.pi * freq * t)
+    zste = np.power.outer(z, np.arange(0, nfir)).T  # steering vectors, one per column
+
+    def quadz(a):
+        """ Quadratic forms of every steering vector with matrices a. """
+        return np.sum(np.conj(zste) * (a @ zste), axis=-2)
+
+    num_windows = auto_cov_x.shape[0]
+    chunk = max(1, max_elements // (nfir * npun))
+    coh = np.zeros((num_windows, npun))
+    for first in range(0, num_windows, chunk):
+        sl = slice(first, first + chunk)
+        zcuad1, zcuad2, zcuad12 = quadz(zic1[sl]), quadz(zic2[sl]), quadz(znum12[sl])
+        zcuad11, zcuad22, zden = quadz(z2ic1[sl]), quadz(z2ic2[sl]), quadz(z2isum[sl])
+        coh[sl] = np.sqrt(np.abs(zcuad12 / zden) ** 2 /
+                          (np.real(zcuad1 / zcuad11) * np.real(zcuad2 / zcuad22)))
+    return coh
+
+
 def compute_coherence(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v, nfir, f0, f1, npun, t):
     """ Compute coherence in the [neg_freq, pos_freq] interval.
         nfir is the number of correlation that are considered.
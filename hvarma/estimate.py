@@ -0,0 +1,341 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Prediction of the cost of run_model and find_optimal_order.
+
+The time of each stage of a window is modelled as a linear combination
+of its complexity terms (window size, lags, model order, frequency
+points...). The coefficients are fitted to a short micro-benchmark of
+the stages on synthetic data, run once per host and cached under
+default_cache_dir(). Runs on a parallel backend are faster by the
+speedup that hvarma.autotune measured, or by the number of workers in
+the stages solved on them. Memory is predicted from the sizes of the
+arrays kept per window and of the largest temporary arrays.
+
+Usage example:
+    estimate = estimate_run_model(data, param)
+    print(estimate.num_windows, estimate.runtime, estimate.peak_memory)
+    estimate = estimate_order_search((3600 * 100, 100), param)
+"""
+
+import os
+import json
+import time
+import socket
+import platform
+import tempfile
+from types import SimpleNamespace
+from dataclasses import dataclass, field
+from typing import Mapping
+import numpy as np
+from .preprocessing import effective_parameters, decimation_factor
+from .cache import default_cache_dir
+
+CALIBRATION_VERSION = 2
+
+# Complexity terms of each stage, per call, as functions of the parameters
+STAGE_TERMS = {
+    'windowing': lambda w, m, p, nfir, f: [1.],
+    'centering': lambda w, m, p, nfir, f: [1., w],
+    'assembly': lambda w, m, p, nfir, f: [1., w * m, p * p * m],
+    'solve': lambda w, m, p, nfir, f: [1., p ** 2, p ** 3],
+    'covariance': lambda w, m, p, nfir, f: [1., m, w * m],
+    'coherence': lambda w, m, p, nfir, f: [1., f, nfir * f],
+    'transfer_function': lambda w, m, p, nfir, f: [1., f, f * p],
+    'aic': lambda w, m, p, nfir, f: [1., w, w * p],
+}
+
+# Stages of a window that solve_parallel runs on the workers of a backend
+PARALLEL_STAGES = ('covariance', 'assembly', 'solve', 'coherence')
+
+# Parameters of the micro-benchmark runs, varying every complexity term
+CALIBRATION_PARAMS = [
+    {'window_size': 512, 'maxtau': 64, 'model_order': 10, 'nfir': 40, 'freq_points': 256},
+    {'window_size': 256, 'maxtau': 32, 'model_order': 4, 'nfir': 16, 'freq_points': 128},
+    {'window_size': 2048, 'maxtau': 64, 'model_order': 10, 'nfir': 40, 'freq_points': 256},
+    {'window_size': 1024, 'maxtau': 256, 'model_order': 10, 'nfir': 40, 'freq_points': 256},
+    {'window_size': 1024, 'maxtau': 128, 'model_order': 60, 'nfir': 40, 'freq_points': 256},
+    {'window_size': 512, 'maxtau': 128, 'model_order': 100, 'nfir': 16, 'freq_points': 128},
+    {'window_size': 512, 'maxtau': 128, 'model_order': 30, 'nfir': 128, 'freq_points': 1024},
+    {'window_size': 512, 'maxtau': 64, 'model_order': 40, 'nfir': 16, 'freq_points': 2048},
+    {'window_size': 256, 'maxtau': 64, 'model_order': 20, 'nfir': 64, 'freq_points': 512},
+]
+
+
+@dataclass
+class CostEstimate:
+    """ Predicted cost of a run. runtime is in seconds, peak_memory in bytes
+        of array data (the input samples included, not the interpreter).
+        For order searches, orders are the model orders that would be run. """
+    num_windows: int
+    runtime: float
+    peak_memory: int
+    stages: Mapping[str, float] = field(default_factory=dict)
+    orders: list = None
+
+
+class Calibration:
+    """ Stage coefficients of a host, see STAGE_TERMS. Times per sample
+        of the decimation and screening stages are in 'per_sample'. """
+
+    def __init__(self, coefficients, per_sample, host=None):
+        self.coefficients = {name: np.array(coefs, dtype=float) for name, coefs in coefficients.items()}
+        self.per_sample = dict(per_sample)
+        self.host = host or host_key()
+
+    def window_stages(self, param):
+        """ Predicted seconds of each stage for one window. """
+        args = (param.window_size, param.maxtau, param.model_order, param.nfir, param.freq_points)
+        return {name: max(float(np.dot(self.coefficients[name], terms(*args))), 0.)
+                for name, terms in STAGE_TERMS.items()}
+
+    def to_dict(self):
+        return {'version': CALIBRATION_VERSION, 'host': self.host, 'numpy': np.__version__,
+                'coefficients': {name: coefs.tolist() for name, coefs in self.coefficients.items()},
+                'per_sample': self.per_sample}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['coefficients'], values['per_sample'], values['host'])
+
+
+def host_key():
+    """ Calibrations are only valid on the same machine and software. """
+    return f'{socket.gethostname()}-{platform.machine()}-py{platform.python_version()}'
+
+
+def calibration_path(cache_dir=None):
+    directory = os.path.join(cache_dir if cache_dir is not None else default_cache_dir(), 'estimate')
+    return os.path.join(directory, f'calibration-{host_key()}.json')
+
+
+def calibrate(num_windows=4, repeat=2, seed=0):
+    """ Run the micro-benchmark and fit the stage coefficients. Takes a few seconds.
+        Each stage keeps its best time of repeat runs, since other load on
+        the host only makes them slower.   """
+    from scipy.optimize import nnls
+    from .read_input import ArmaParam
+    from .running import run_model
+    from .instrumentation import RunStats
+    from .preprocessing import decimate, screen_windows
+    from .synthetic import SyntheticModel, synthetic_data
+
+    model = SyntheticModel.from_resonances([2.5], 0.05, 100)
+    rows = {name: [] for name in STAGE_TERMS}
+    times = {name: [] for name in STAGE_TERMS}
+    for idx, values in enumerate([CALIBRATION_PARAMS[0]] + CALIBRATION_PARAMS):
+        values = dict(values, overlap=values['window_size'] // 2, max_windows=num_windows,
+                      neg_freq=-10, pos_freq=10)
+        param = ArmaParam().update(values)
+        size = (num_windows + 1) * param.window_size
+        best = {name: np.inf for name in STAGE_TERMS}
+        for _ in range(repeat):
+            data = synthetic_data(model, size / 100, seed=seed)
+            stats = RunStats()
+            run_model(data, param, verbose=False, stats=stats, backend='serial')
+            for name in STAGE_TERMS:
+                best[name] = min(best[name], stats.stages[name].wall / max(stats.stages[name].calls, 1))
+        if idx == 0:
+            continue  # Warm up
+        args = (param.window_size, param.maxtau, param.model_order, param.nfir, param.freq_points)
+        for name, terms in STAGE_TERMS.items():
+            rows[name].append(terms(*args))
+            times[name].append(best[name])
+
+    coefficients = {}
+    for name in STAGE_TERMS:
+        # Fit relative errors, so that cheap and expensive configurations weigh alike
+        mat, target = np.array(rows[name]), np.array(times[name])
+        scale = 1 / np.maximum(target, 1e-9)
+        coefficients[name] = nnls(mat * scale[:, None], target * scale)[0]
+
+    # Pre-processing stages, linear in the number of samples
+    data = synthetic_data(model, 600, seed=seed)
+    param = ArmaParam().update({'decimate': 1, 'neg_freq': -5, 'pos_freq': 5, 'model_order': 4})
+    per_sample = {}
+    beg = time.perf_counter()
+    decimate(data, param)
+    per_sample['decimation'] = (time.perf_counter() - beg) / data.size
+    beg = time.perf_counter()
+    screen_windows(data, ArmaParam())
+    per_sample['screening'] = (time.perf_counter() - beg) / data.size
+    return Calibration(coefficients, per_sample)
+
+
+def get_calibration(cache_dir=None, recalibrate=False):
+    """ Calibration of this host, from the cache or measured (and then cached). """
+    path = calibration_path(cache_dir)
+    if not recalibrate and os.path.exists(path):
+        try:
+            with open(path) as file:
+                values = json.load(file)
+            if values.get('version') == CALIBRATION_VERSION and values.get('numpy') == np.__version__:
+                return Calibration.from_dict(values)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    calibration = calibrate()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(calibration.to_dict(), file, indent=2)
+    os.replace(tmp_path, path)
+    return calibration
+
+
+def describe_data(data):
+    """ Size and sampling rate of Data, LazyData or a (size, sampling_rate) pair.
+        Only a chunk of LazyData is in memory at a time.  """
+    if isinstance(data, (tuple, list)):
+        size, sampling_rate = data
+        return SimpleNamespace(size=int(size), sampling_rate=float(sampling_rate), loaded=int(size))
+    loaded = min(data.chunk_size, data.size) if hasattr(data, 'readers') else data.size
+    return SimpleNamespace(size=data.size, sampling_rate=data.sampling_rate, loaded=loaded)
+
+
+def count_windows(size, param):
+    """ Number of windows run_model processes (an upper bound with screening). """
+    if size <= param.window_size:
+        return 0
+    return min((size - param.window_size - 1) // (param.window_size - param.overlap) + 1, param.max_windows)
+
+
+def window_bytes(param):
+    """ Bytes of the arrays kept per window until the results are built, and in the results. """
+    pp, f, nfir = param.model_order + 1, param.freq_points, param.nfir
+    kept = 8 * (pp + 2 * pp + f + 4 * nfir + 3 * param.window_size)  # a, b, coherence, lags, centered data
+    results = 8 * (2 * f + 1 + pp + 2 * pp + 4 * nfir)  # spectra, coherence, AIC, a, b, covariances
+    return kept, results
+
+
+def temporary_bytes(param):
+    """ Bytes of the largest temporary arrays of a window. """
+    n = 3 * param.model_order
+    equations = 8 * (n * n + n)
+    covariances = 16 * 4 * (param.maxtau + 1) + 16 * 2 * param.window_size
+    coherence = 16 * 4 * param.freq_points * param.nfir
+    return max(equations, covariances, coherence)
+
+
+def estimate_run_model(data, param, calibration=None, cache_dir=None, backend=None, workers=None,
+                       batch_windows=None):
+    """ Predict the number of windows, runtime and peak memory of run_model.
+        data is Data, LazyData or a (size, sampling_rate) pair. The
+        calibration of the host is loaded or measured if not given.
+        backend, workers and batch_windows are chosen as in run_model.  """
+    from .autotune import choose_backend, load_profile
+    calibration = calibration or get_calibration(cache_dir)
+    backend = choose_backend(param, backend, workers, batch_windows, cache_dir)
+    return predict(describe_data(data), param, calibration, backend=backend, profile=load_profile(cache_dir))
+
+
+def backend_speedup(param, backend, profile, num_windows):
+    """ Speedup of all the stages of a window on backend, as measured by
+        autotune for the parameters closest to param, and the speedup of
+        PARALLEL_STAGES if the profile did not measure backend.   """
+    if backend is None or backend.name == 'serial':
+        return 1., 1.
+    if profile is not None and profile.entries and \
+            profile.choose(param) == (backend.name, backend.workers, backend.batch_windows):
+        entry = profile.closest(param)
+        return entry['throughput'] / entry['serial_throughput'], 1.
+    return 1., float(max(min(backend.workers, -(-num_windows // backend.batch_windows)), 1))
+
+
+def predict(data, param, calibration, num_windows=None, backend=None, profile=None):
+    """ CostEstimate of run_model on data described by describe_data,
+        solved on backend (serially if None).   """
+    eff_param = effective_parameters(data, param)
+    factor = 1
+    if param.decimate:
+        factor = decimation_factor(data.sampling_rate, param.neg_freq, param.pos_freq, param.band_margin)
+    size = -(-data.size // factor)
+    if num_windows is None:
+        num_windows = count_windows(size, eff_param)
+
+    speedup, parallel_speedup = backend_speedup(eff_param, backend, profile, num_windows)
+    stages = {name: seconds * num_windows / (speedup * (parallel_speedup if name in PARALLEL_STAGES else 1.))
+              for name, seconds in calibration.window_stages(eff_param).items()}
+    input_bytes = 3 * 8 * data.loaded
+    if factor > 1:
+        stages['decimation'] = calibration.per_sample['decimation'] * data.size
+        input_bytes += 3 * 8 * -(-data.loaded // factor)
+    if param.screen:
+        stages['screening'] = calibration.per_sample['screening'] * size
+
+    kept, results = window_bytes(eff_param)
+    peak_memory = input_bytes + num_windows * (kept + results) + temporary_bytes(eff_param)
+    return CostEstimate(num_windows, sum(stages.values()), int(peak_memory), stages)
+
+
+def search_orders(expected_order, start_order, max_order, confirm=False):
+    """ Model orders that the fast search of find_optimal_order would run if
+        every order from expected_order on converged (none if expected_order
+        is None). With confirm, only the bracket ending the doubling of the
+        order is tested before the bisection, as in the multifidelity search.  """
+    from .running import doubling_orders
+    orders = []
+
+    def converged(order):
+        for value in (order, order - 3):
+            if value not in orders:
+                orders.append(value)
+        return expected_order is not None and order >= expected_order
+
+    if confirm and expected_order is not None and expected_order <= max_order:
+        *lower, order = doubling_orders(start_order, max_order, expected_order)
+        for tested in ([] if order == max_order else [order]) + lower[-1:]:
+            converged(tested)
+    else:
+        order = start_order
+        while not converged(order) and order != max_order:
+            order = min(int(order * 2), max_order)
+    low_p, high_p = int(order / 2), order
+    while low_p < high_p:
+        mid_p = (high_p + low_p) // 2
+        if converged(mid_p):
+            high_p = mid_p
+        else:
+            low_p = mid_p + 1
+    converged(low_p)
+    return orders
+
+
+def estimate_order_search(data, param, expected_order=None, start_order=4, method='fast',
+                          screening_windows=None, calibration=None, cache_dir=None, backend=None):
+    """ Predict the cost of find_optimal_order. The tested orders depend on
+        the data: they are those of a search whose smallest converged order
+        is expected_order, or the worst case (no convergence) if None.
+        Results of all tested orders are kept, so they add to the memory.
+        backend is chosen once as in find_optimal_order.   """
+    from .autotune import choose_backend, load_profile
+    calibration = calibration or get_calibration(cache_dir)
+    backend = choose_backend(param, backend, cache_dir=cache_dir)
+    profile = load_profile(cache_dir)
+    data = describe_data(data)
+    max_order = effective_parameters(data, param).maxtau
+
+    if method == 'fast':
+        runs = [(order, None) for order in search_orders(expected_order, start_order, max_order)]
+    elif method == 'multifidelity':
+        if screening_windows is None:
+            screening_windows = max(32, param.max_windows // 4)
+        subset_windows = min(screening_windows, predict(data, param, calibration).num_windows)
+        screened = search_orders(expected_order, start_order, max_order)
+        runs = [(order, subset_windows) for order in screened] + \
+               [(order, None) for order in search_orders(expected_order, start_order, max_order, confirm=True)]
+    else:
+        raise ValueError(f'Method {method} not available')
+
+    runtime, stages, results_bytes, peak = 0., {}, 0, 0
+    num_windows = 0
+    for order, windows in runs:
+        order_param = param.update({'model_order': order})
+        estimate = predict(data, order_param, calibration, num_windows=windows, backend=backend, profile=profile)
+        runtime += estimate.runtime
+        for name, seconds in estimate.stages.items():
+            stages[name] = stages.get(name, 0.) + seconds
+        peak = max(peak, results_bytes + estimate.peak_memory)
+        results_bytes += estimate.num_windows * window_bytes(effective_parameters(data, order_param))[1]
+        num_windows = max(num_windows, estimate.num_windows)
+    return CostEstimate(num_windows, runtime, int(peak), stages, [order for order, _ in runs])
@@ -212,3 +212,12 @@ void compute_equations(const double *x1, const double *x2, const double *v,
     gradient_matrix(zcx, cv, zcxv, size, mat, indep, mu, nu, p, maxtau);
 
 }
+
+/** Compute optimality conditions equations from given covariances.
+    Covariances have 2*maxtau+1 lags, lag tau is stored at maxtau+tau. **/
+void assemble_equations(const double complex *zcx, const double *cv,
+    const double complex *zcxv, double mu, double nu, size_t size,
+    double mat[size][size], double *indep, int p, int maxtau)
+{
+    gradient_matrix(zcx, cv, zcxv, size, mat, indep, mu, nu, p, maxtau);
+}
@@ -0,0 +1,193 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Per-stage timing and counters of run_model and find_optimal_order.
+
+Pass a RunStats as `stats` to record the wall and CPU time, the number
+of calls and optionally the memory allocated by each processing stage.
+Without it a NullStats is used, whose stages do nothing.
+
+Usage example:
+    stats = RunStats(memory=True)
+    results = run_model(data, param, verbose=False, stats=stats)
+    print(stats.to_json())
+    stats.to_prometheus('/var/lib/node_exporter/hvarma.prom', labels={'station': data.station})
+"""
+
+import os
+import json
+import time
+import tempfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+STAGES = ('windowing', 'centering', 'covariance', 'assembly', 'solve', 'transfer_function',
+          'coherence', 'aic', 'aggregation')
+
+PROMETHEUS_METRICS = (('wall', 'hvarma_stage_wall_seconds', 'Wall time spent in each stage.'),
+                      ('cpu', 'hvarma_stage_cpu_seconds', 'Process CPU time spent in each stage.'),
+                      ('calls', 'hvarma_stage_calls', 'Number of calls of each stage.'),
+                      ('bytes', 'hvarma_stage_allocated_bytes', 'Peak memory allocated by each stage.'))
+
+
+@dataclass
+class StageStats:
+    """ Accumulated statistics of a stage. bytes is the sum of the peak
+        allocations of its calls, if memory tracing is enabled. """
+    wall: float = 0.
+    cpu: float = 0.
+    calls: int = 0
+    bytes: int = 0
+
+    def add(self, other):
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.calls += other.calls
+        self.bytes += other.bytes
+
+
+class RunStats:
+    """ Statistics of the stages of a run. Searches of the model order keep
+        one child RunStats per tested order in children.
+        callback(stage, wall, cpu, nbytes, labels) is called after every stage call.  """
+    enabled = True
+
+    def __init__(self, callback=None, memory=False, labels=None):
+        self.stages = OrderedDict((name, StageStats()) for name in STAGES)
+        self.children = OrderedDict()
+        self.callback = callback
+        self.memory = memory
+        self.labels = labels or {}
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self):
+        """ Start of a stage call, to be passed to finish. """
+        current = 0
+        if self.memory:
+            if hasattr(tracemalloc, 'reset_peak'):
+                current, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            else:  # Python < 3.9 only resets the peak by clearing the traces
+                tracemalloc.clear_traces()
+        return time.perf_counter(), time.process_time(), current
+
+    def finish(self, name, start):
+        """ Record a call of stage name begun at start. """
+        wall, cpu, current = start
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        nbytes = tracemalloc.get_traced_memory()[1] - current if self.memory else 0
+        stats = self.stages.setdefault(name, StageStats())
+        stats.add(StageStats(wall, cpu, 1, nbytes))
+        if self.callback is not None:
+            self.callback(name, wall, cpu, nbytes, self.labels)
+
+    @contextmanager
+    def stage(self, name):
+        """ Context that records a call of stage name. Stages must not be nested. """
+        start = self.start()
+        try:
+            yield
+        finally:
+            self.finish(name, start)
+
+    def timed(self, name, iterable):
+        """ Iterate over iterable, recording each step that returns an item
+            as a call of stage name. """
+        iterator = iter(iterable)
+        while True:
+            start = self.start()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.finish(name, start)
+            yield item
+
+    def child(self, key):
+        """ Statistics of a part of the run, e.g. a tested model order. """
+        if key not in self.children:
+            labels = dict(self.labels, order=str(key) if 'order' not in self.labels
+                          else f"{self.labels['order']}/{key}")
+            self.children[key] = RunStats(self.callback, self.memory, labels)
+        return self.children[key]
+
+    def total(self):
+        """ Stages of this run and all its children added together. """
+        total = OrderedDict((name, StageStats(**asdict(stats))) for name, stats in self.stages.items())
+        for child in self.children.values():
+            for name, stats in child.total().items():
+                total.setdefault(name, StageStats()).add(stats)
+        return total
+
+    def to_dict(self):
+        return {'stages': {name: asdict(stats) for name, stats in self.stages.items()},
+                'total': {name: asdict(stats) for name, stats in self.total().items()},
+                'children': {str(key): child.to_dict() for key, child in self.children.items()}}
+
+    def to_json(self, filename=None):
+        """ Statistics as a JSON string, also written to filename if given. """
+        text = json.dumps(self.to_dict(), indent=2)
+        if filename is not None:
+            write_atomic(filename, text)
+        return text
+
+    def samples(self):
+        """ (labels, stage, StageStats) of this run and its children. """
+        for name, stats in self.stages.items():
+            yield self.labels, name, stats
+        for child in self.children.values():
+            yield from child.samples()
+
+    def to_prometheus(self, filename=None, labels=None):
+        """ Statistics in the Prometheus text format, also written atomically
+            to filename if given (for the node exporter textfile collector).
+            labels are added to every sample, e.g. {'station': 'B001'}.  """
+        samples = list(self.samples())
+        lines = []
+        for field, metric, doc in PROMETHEUS_METRICS:
+            lines.append(f'# HELP {metric} {doc}')
+            lines.append(f'# TYPE {metric} gauge')
+            for sample_labels, name, stats in samples:
+                all_labels = dict(labels or {}, **sample_labels, stage=name)
+                text = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                for key, value in all_labels.items())
+                lines.append(f'{metric}{{{text}}} {getattr(stats, field)}')
+        text = '\n'.join(lines) + '\n'
+        if filename is not None:
+            write_atomic(filename, text)
+        return text
+
+
+class NullStats:
+    """ Statistics that record nothing, used when instrumentation is disabled. """
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def child(self, key):
+        return self
+
+
+NULL_STATS = NullStats()
+
+
+def get_stats(stats):
+    """ stats, or NULL_STATS if None. """
+    return NULL_STATS if stats is None else stats
+
+
+def write_atomic(filename, text):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        file.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, filename)
@@ -0,0 +1,235 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Chunked data loading for long recordings.
+
+LazyData behaves like Data inside run_model, but only keeps in memory
+the samples needed by the windows in flight. Samples are read from
+SAC or miniSEED segments and the next chunk is prefetched on a
+background thread.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .read_input import Data, WindowBatch
+
+
+class ArraySegment:
+    """ Segment backed by an array already in memory (or memory mapped). """
+    def __init__(self, data, sampling_rate, station):
+        self.data = data
+        self.npts = len(data)
+        self.sampling_rate = float(sampling_rate)
+        self.station = str(station)
+
+    def read(self, start, stop):
+        return np.array(self.data[start:stop], dtype=np.float64)
+
+
+class SACSegment:
+    """ Segment of a SAC binary file. Samples are read straight from disk. """
+    HEADER_SIZE = 632
+    NVHDR_OFFSET = 304
+
+    def __init__(self, filename):
+        from obspy import read
+        stats = read(filename, headonly=True)[0].stats
+        self.filename = filename
+        self.npts = int(stats.npts)
+        self.sampling_rate = float(stats.sampling_rate)
+        self.station = str(stats.station)
+        self.dtype = self.get_dtype(filename)
+
+    @classmethod
+    def get_dtype(cls, filename):
+        """ Guess byte order from the header version number. """
+        with open(filename, 'rb') as file:
+            file.seek(cls.NVHDR_OFFSET)
+            nvhdr = np.frombuffer(file.read(4), dtype='<i4')[0]
+        return np.dtype('<f4') if 0 < nvhdr < 20 else np.dtype('>f4')
+
+    def read(self, start, stop):
+        with open(self.filename, 'rb') as file:
+            file.seek(self.HEADER_SIZE + start * self.dtype.itemsize)
+            data = np.fromfile(file, dtype=self.dtype, count=stop - start)
+        return data.astype(np.float64)
+
+
+class MSEEDSegment:
+    """ Segment of a miniSEED file. Only records in the requested span are decoded. """
+    def __init__(self, filename):
+        from obspy import read
+        st = read(filename, headonly=True)
+        st.merge()
+        if len(st) != 1:
+            raise ValueError(f'{filename} should contain a single trace')
+        stats = st[0].stats
+        self.filename = filename
+        self.npts = int(stats.npts)
+        self.sampling_rate = float(stats.sampling_rate)
+        self.station = str(stats.station)
+        self.starttime = stats.starttime
+
+    def read(self, start, stop):
+        from obspy import read
+        t0 = self.starttime + start / self.sampling_rate
+        t1 = self.starttime + (stop - 1) / self.sampling_rate
+        st = read(self.filename, starttime=t0, endtime=t1)
+        st.merge(fill_value=0)
+        st.trim(t0, t1, pad=True, fill_value=0, nearest_sample=True)
+        return np.array(st[0].data[:stop - start], dtype=np.float64)
+
+
+class SegmentReader:
+    """ Concatenation of contiguous segments of a single component. """
+    def __init__(self, segments):
+        assert len(segments) > 0, "segments should not be empty"
+        self.segments = segments
+        self.offsets = np.cumsum([0] + [seg.npts for seg in segments])
+        self.npts = int(self.offsets[-1])
+        self.sampling_rate = segments[0].sampling_rate
+        self.station = segments[0].station
+        for seg in segments:
+            if seg.sampling_rate != self.sampling_rate or seg.station != self.station:
+                raise ValueError('Segments have different header values')
+
+    def read(self, start, stop):
+        """ Read samples in [start, stop) as float64. """
+        assert 0 <= start <= stop <= self.npts, "Read exceeds data size"
+        parts = []
+        for seg, offset in zip(self.segments, self.offsets[:-1]):
+            lo, hi = max(start - offset, 0), min(stop - offset, seg.npts)
+            if lo < hi:
+                parts.append(seg.read(int(lo), int(hi)))
+        if not parts:
+            return np.zeros(0)
+        return np.concatenate(parts)
+
+
+class LazyData:
+    """ Drop-in replacement of Data for recordings that do not fit in memory.
+        Windows must be requested in increasing order to benefit from prefetching. """
+
+    def __init__(self, readerZ, readerN, readerE, chunk_size=2**20, prefetch=True):
+        self.readers = (readerZ, readerN, readerE)
+        for key in ['sampling_rate', 'station']:
+            if len({getattr(reader, key) for reader in self.readers}) != 1:
+                raise ValueError('Fields have different header value at: ' + key)
+        assert readerZ.npts == readerN.npts == readerE.npts, \
+            "Data do not have the same size in Z, N or E directions"
+
+        self.size = readerZ.npts
+        self.sampling_rate = readerZ.sampling_rate
+        self.station = readerZ.station
+        self.chunk_size = int(chunk_size)
+
+        self.buffer_start = 0
+        self.buffer = None
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+
+    @classmethod
+    def from_sac(cls, Z_fname, N_fname, E_fname, **kwargs):
+        """ Read data from SAC. Each argument can be a file or a list of consecutive files. """
+        return cls(*[cls.make_reader(SACSegment, fname) for fname in (Z_fname, N_fname, E_fname)],
+                   **kwargs)
+
+    @classmethod
+    def from_mseed(cls, Z_fname, N_fname, E_fname, **kwargs):
+        """ Read data from miniSEED. Each argument can be a file or a list of consecutive files. """
+        return cls(*[cls.make_reader(MSEEDSegment, fname) for fname in (Z_fname, N_fname, E_fname)],
+                   **kwargs)
+
+    @staticmethod
+    def make_reader(segment_class, filenames):
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        return SegmentReader([segment_class(fname) for fname in filenames])
+
+    def read(self, start, stop):
+        """ Read the three components in [start, stop) from disk. """
+        return tuple(reader.read(start, stop) for reader in self.readers)
+
+    def get_chunk(self, start, stop):
+        """ Return samples in [start, stop), using the prefetched chunk if possible. """
+        if self.pending is not None and self.pending[0] == start:
+            chunk_start, chunk_stop, future = self.pending
+            self.pending = None
+            chunk = future.result()
+            if chunk_stop < stop:
+                rest = self.read(chunk_stop, stop)
+                chunk = tuple(np.concatenate(pair) for pair in zip(chunk, rest))
+            return chunk
+        return self.read(start, stop)
+
+    def prefetch(self, start):
+        """ Start reading the chunk beginning at start in the background. """
+        if self.executor is None or start >= self.size:
+            return
+        if self.pending is not None and self.pending[0] == start:
+            return
+        stop = min(start + self.chunk_size, self.size)
+        self.pending = (start, stop, self.executor.submit(self.read, start, stop))
+
+    def make_window(self, start, size, copy=False):
+        """ Create a slice of data. The slice is a view on the current chunk,
+            so changes made to it persist while the samples stay loaded.  """
+        assert start + size < self.size, "Window exceeds data size"
+        end = start + size
+        buffer_end = self.buffer_start + (0 if self.buffer is None else len(self.buffer[0]))
+
+        if self.buffer is None or start < self.buffer_start or start >= buffer_end:
+            stop = min(max(end, start + self.chunk_size), self.size)
+            self.buffer = self.get_chunk(start, stop)
+            self.buffer_start = start
+        elif end > buffer_end:
+            # Keep the samples still in use and append the following chunk
+            stop = min(max(end, buffer_end + self.chunk_size), self.size)
+            keep = start - self.buffer_start
+            self.buffer = tuple(np.concatenate((old[keep:], new))
+                                for old, new in zip(self.buffer, self.get_chunk(buffer_end, stop)))
+            self.buffer_start = start
+
+        self.prefetch(self.buffer_start + len(self.buffer[0]))
+
+        offset = start - self.buffer_start
+        dataZ, dataN, dataE = (comp[offset:offset + size] for comp in self.buffer)
+        return Data(dataZ, dataN, dataE, self.sampling_rate, self.station, copy_data=copy)
+
+    def iter_batches(self, size, overlap, batch_windows, max_windows=None):
+        """ Generator of consecutive batches of at most batch_windows windows.
+            Batches are read from disk independently of the window buffer. """
+        if self.size < size:
+            raise ValueError('Window exceeds available data')
+        step = size - overlap
+        num_windows = (self.size - size) // step + 1
+        if max_windows is not None:
+            num_windows = min(num_windows, max_windows)
+        spans = [(first * step, (min(first + batch_windows, num_windows) - 1) * step + size)
+                 for first in range(0, num_windows, batch_windows)]
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.read, *spans[0])
+            for idx, (start, stop) in enumerate(spans):
+                arrays = future.result()
+                if idx + 1 < len(spans):
+                    future = executor.submit(self.read, *spans[idx + 1])
+                yield WindowBatch.from_arrays(*arrays, size, overlap, self.sampling_rate,
+                                              self.station, offset=start)
+
+    def load(self):
+        """ Read the whole recording into a Data instance. """
+        return Data(*self.read(0, self.size), self.sampling_rate, self.station, copy_data=False)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.pending = None
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,181 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Function definitions for the optional pre-processing stages
+applied to the data before windowing.
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from .read_input import Data
+
+
+def decimation_factor(sampling_rate, neg_freq, pos_freq, band_margin):
+    """ Largest integer factor such that the decimated Nyquist frequency
+        stays band_margin times above the analysed band.       """
+    fmax = max(abs(neg_freq), abs(pos_freq))
+    return max(int(sampling_rate / (2 * band_margin * fmax)), 1)
+
+
+def resample(data, factor):
+    """ Anti-alias filter and downsample the rows of data (zero-phase FIR). """
+    from scipy.signal import resample_poly
+    return resample_poly(data, 1, factor, axis=-1)
+
+
+class DecimatedReader:
+    """ Reader of a LazyData component that filters and downsamples on the fly.
+        Chunks are read with enough margin so that the result matches
+        the decimation of the whole recording.         """
+    def __init__(self, reader, factor):
+        self.reader = reader
+        self.factor = factor
+        self.margin = 10 * factor  # Half length of the anti-alias filter
+        self.npts = -(-reader.npts // factor)
+        self.sampling_rate = reader.sampling_rate / factor
+        self.station = reader.station
+
+    def read(self, start, stop):
+        raw_start = max(start * self.factor - self.margin, 0)
+        raw_stop = min(stop * self.factor + self.margin, self.reader.npts)
+        data = resample(self.reader.read(raw_start, raw_stop), self.factor)
+        first = (start * self.factor - raw_start) // self.factor
+        return data[first:first + stop - start]
+
+
+def decimated_parameters(param, factor):
+    """ Parameters at the decimated rate. Windows, overlap and
+        covariance lags keep their duration in seconds. The model
+        order is limited to the decimated number of lags.    """
+    maxtau = param.maxtau // factor
+    if maxtau < 1:
+        raise ValueError(f'maxtau={param.maxtau} leaves no covariance lags after decimating by {factor}')
+    return param.update({'window_size': param.window_size // factor,
+                         'overlap': param.overlap // factor,
+                         'maxtau': maxtau,
+                         'model_order': min(param.model_order, maxtau),
+                         'nfir': min(param.nfir, maxtau),
+                         'decimate': 0})
+
+
+def effective_parameters(data, param):
+    """ Parameters that run_model uses on data after the pre-processing stages. """
+    if not param.decimate:
+        return param
+    factor = decimation_factor(data.sampling_rate, param.neg_freq, param.pos_freq, param.band_margin)
+    if factor < 2:
+        return param.update({'decimate': 0})
+    return decimated_parameters(param, factor)
+
+
+def decimate(data, param):
+    """ Decimate data to the lowest rate that keeps the frequency band
+        of param, if param.decimate is set.
+        Returns the data and parameters to use, and the decimation factor. """
+    if not param.decimate:
+        return data, param, 1
+
+    factor = decimation_factor(data.sampling_rate, param.neg_freq, param.pos_freq, param.band_margin)
+    if factor < 2:
+        return data, param.update({'decimate': 0}), 1
+
+    eff_param = decimated_parameters(param, factor)
+    if hasattr(data, 'readers'):  # LazyData
+        from .lazy_input import LazyData
+        eff_data = LazyData(*[DecimatedReader(reader, factor) for reader in data.readers],
+                            chunk_size=data.chunk_size)
+    else:
+        dataZ, dataN, dataE = resample(np.vstack((data.dataZ, data.dataN, data.dataE)), factor)
+        eff_data = Data(dataZ, dataN, dataE, data.sampling_rate / factor, data.station, copy_data=False)
+
+    return eff_data, eff_param, factor
+
+
+@dataclass
+class WindowScreening:
+    """ Per-window statistics of the pre-screening stage and rejection reasons.
+        Statistics are the maximum over the three components.   """
+    starts: np.ndarray
+    sta_lta: np.ndarray
+    rms: np.ndarray
+    kurtosis: np.ndarray
+    clipping: np.ndarray
+    reasons: list
+
+    @property
+    def accepted(self):
+        return np.array([not reason for reason in self.reasons], dtype=bool)
+
+    def accepted_starts(self):
+        return self.starts[self.accepted]
+
+    def skipped(self):
+        """ Mapping from the start of each rejected window to the rejection reasons. """
+        return {int(start): reason for start, reason in zip(self.starts, self.reasons) if reason}
+
+
+def pinned_samples(comp, extreme):
+    """ Number of samples of each window in runs of two or more consecutive
+        samples at the extreme value, as left by a clipped sensor. A single
+        sample at the maximum or minimum, as in every window, is not counted. """
+    at_extreme = comp == extreme
+    repeated = at_extreme[:, 1:] & at_extreme[:, :-1]
+    pinned = np.zeros_like(at_extreme)
+    pinned[:, 1:] |= repeated
+    pinned[:, :-1] |= repeated
+    return pinned.sum(axis=1)
+
+
+def window_statistics(batch, sta_size):
+    """ Cheap statistics for each window of a WindowBatch, computed at once.
+        Returns STA/LTA, RMS, kurtosis and clipping fraction stacked
+        in an array of shape (4, num_windows, 3).          """
+    stats = []
+    for comp in (batch.dataZ, batch.dataN, batch.dataE):
+        centered = comp - comp.mean(axis=1, keepdims=True)
+        power = centered ** 2
+        var = power.mean(axis=1)
+        safe_var = np.where(var > 0, var, 1)
+
+        # Maximum short-term average over the window average
+        cum = np.cumsum(power, axis=1)
+        sta = (cum[:, sta_size:] - cum[:, :-sta_size]) / sta_size
+        sta_lta = sta.max(axis=1) / safe_var
+
+        kurtosis = (power ** 2).mean(axis=1) / safe_var ** 2
+
+        # Fraction of samples stuck at the extreme values of the window
+        clipping = (pinned_samples(comp, comp.max(axis=1, keepdims=True))
+                    + pinned_samples(comp, comp.min(axis=1, keepdims=True))) / comp.shape[1]
+
+        stats.append(np.stack((sta_lta, np.sqrt(var), kurtosis, clipping)))
+    return np.stack(stats, axis=-1)
+
+
+def screen_windows(data, param, sta_length=0.5, batch_windows=256):
+    """ Compute cheap statistics of all windows of data in one pass and
+        reject windows with transients, outlier amplitude or clipping.
+        sta_length is the short-term average duration in seconds.  """
+    sta_size = min(max(int(sta_length * data.sampling_rate), 1), param.window_size - 1)
+    starts, stats = [], []
+    for batch in data.iter_batches(param.window_size, param.overlap, batch_windows):
+        starts.append(batch.starts)
+        stats.append(window_statistics(batch, sta_size))
+    starts = np.concatenate(starts)
+    sta_lta, rms, kurtosis, clipping = np.concatenate(stats, axis=1)
+
+    # Robust z-score of the log RMS of each component
+    log_rms = np.log(np.where(rms > 0, rms, np.finfo(float).tiny))
+    median = np.median(log_rms, axis=0)
+    mad = 1.4826 * np.median(np.abs(log_rms - median), axis=0)
+    rms_score = np.abs(log_rms - median) / np.where(mad > 0, mad, 1)
+
+    rejected = {'sta_lta': sta_lta.max(axis=1) > param.screen_sta_lta,
+                'rms': rms_score.max(axis=1) > param.screen_rms,
+                'kurtosis': kurtosis.max(axis=1) > param.screen_kurtosis,
+                'clipping': clipping.max(axis=1) > param.screen_clip}
+    reasons = [','.join(name for name in rejected if rejected[name][idx])
+               for idx in range(len(starts))]
+
+    return WindowScreening(starts, sta_lta.max(axis=1), rms.max(axis=1),
+                           kurtosis.max(axis=1), clipping.max(axis=1), reasons)
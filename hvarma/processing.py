@@ -5,43 +5,51 @@ Class definitions for processing and results objects.
 """
 
 from functools import lru_cache
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Mapping
 import numpy as np
 from .compute import compute_crosscovariance, compute_autocovariance,\
-                       compute_equations, transfer_function, compute_coherence
+                       compute_equations, transfer_function, compute_coherence,\
+                       transfer_function_batch, compute_coherence_batch,\
+                       compute_lag_covariances, rotate_covariances, assemble_equations
 from .read_input import ArmaParam, Data
+from .instrumentation import get_stats
 
 
 class HVarma:
     """ Class that handles processing of a single time window """
-    def __init__(self, window, param):
-        """ Initializes window with defined parameters. """
+    def __init__(self, window, param, stats=None):
+        """ Initializes window with defined parameters.
+            stats is an optional RunStats recording the time of each stage. """
         if not isinstance(window, Data):
             raise AttributeError('Bad data window initialization')
         if not isinstance(param, ArmaParam):
             raise AttributeError('Bad parameter initialization')
-        self.data = window.copy()
+        self.data = window
         self.param = param
+        self.stats = get_stats(stats)
 
         # Center data
         self.muE, self.muN, self.muZ = None, None, None
-        self.center()
+        with self.stats.stage('centering'):
+            self.center()
 
         # ARMA coefficients
         self.a = None
         self.b = None
 
         self.coherence = None
+        self.correlations = None
 
     def center(self):
-        """ Center series to 0 and assume they are stationary """
-        self.muE = np.mean(self.data.dataE)
-        self.data.dataE -= self.muE
-        self.muN = np.mean(self.data.dataN)
-        self.data.dataN -= self.muN
-        self.muZ = np.mean(self.data.dataZ)
-        self.data.dataZ -= self.muZ
+        """ Center series to 0 and assume they are stationary.
+            The centered series are copies, the window is not modified. """
+        data = self.data
+        self.muE = np.mean(data.dataE)
+        self.muN = np.mean(data.dataN)
+        self.muZ = np.mean(data.dataZ)
+        self.data = Data(data.dataZ - self.muZ, data.dataN - self.muN, data.dataE - self.muE,
+                         data.sampling_rate, data.station, copy_data=False)
 
     def solve_arma(self):
         """ Find optimal coefficients for ARMA model minimizing prediction errors. """
@@ -51,10 +59,12 @@ class HVarma:
         mu = float(self.param.mu)
 
         # Find system of equations satisfying optimality conditions
-        mat, indep = compute_equations(self.data.dataE, self.data.dataN, self.data.dataZ, mu, nu,
-                                       self.param.window_size, self.param.model_order, self.param.maxtau)
+        with self.stats.stage('assembly'):
+            mat, indep = compute_equations(self.data.dataE, self.data.dataN, self.data.dataZ, mu, nu,
+                                           self.param.window_size, self.param.model_order, self.param.maxtau)
 
-        solution = np.linalg.solve(mat, indep)
+        with self.stats.stage('solve'):
+            solution = np.linalg.solve(mat, indep)
 
         solution = np.concatenate(([1], solution))
 
@@ -63,6 +73,43 @@ class HVarma:
         self.a = solution[:pp]
         self.b = solution[pp:2*pp] + 1j*solution[2*pp:]
 
+    def solve_arma_weights(self, weights):
+        """ Find ARMA coefficients for several (mu, nu) weight pairs at once.
+            The equations are linear in the weights, so they are assembled
+            only for unit weights. Returns a, b with one row per pair.  """
+        (mat_mu, indep_mu), (mat_nu, indep_nu) = [
+            compute_equations(self.data.dataE, self.data.dataN, self.data.dataZ, mu, nu,
+                              self.param.window_size, self.param.model_order, self.param.maxtau)
+            for mu, nu in ((1., 0.), (0., 1.))]
+
+        mu, nu = np.array(weights, dtype=float).reshape(-1, 2).T
+        mat = mu[:, None, None] * mat_mu + nu[:, None, None] * mat_nu
+        indep = mu[:, None] * indep_mu + nu[:, None] * indep_nu
+        solution = np.linalg.solve(mat, indep[..., None])[..., 0]
+
+        solution = np.hstack((np.ones((len(mu), 1)), solution))
+        pp = self.param.model_order+1
+        return solution[:, :pp], solution[:, pp:2*pp] + 1j*solution[:, 2*pp:]
+
+    def solve_arma_directional(self, azimuths):
+        """ Find ARMA coefficients of the horizontal component along each azimuth
+            (degrees from North towards East). Covariances are computed once
+            and rotated for each azimuth. Returns a, b with one row per azimuth
+            and the rotated covariances needed by the coherence.   """
+        p, maxtau = self.param.model_order, self.param.maxtau
+        zcx, cv, zcxv = rotate_covariances(*compute_lag_covariances(self.data.dataE, self.data.dataN,
+                                                                    self.data.dataZ, maxtau), azimuths)
+        solution = np.array([np.linalg.solve(*assemble_equations(zcx[k], cv[k], zcxv[k], float(self.param.mu),
+                                                                 float(self.param.nu), p, maxtau))
+                             for k in range(len(zcx))])
+
+        solution = np.hstack((np.ones((len(zcx), 1)), solution))
+        pp = p+1
+        nfir = self.param.nfir
+        correlations = (zcx[:, maxtau:maxtau + nfir], cv[:, maxtau:maxtau + nfir],
+                        zcxv[:, maxtau::-1][:, :nfir], zcxv[:, maxtau:maxtau + nfir])
+        return solution[:, :pp], solution[:, pp:2*pp] + 1j*solution[:, 2*pp:], correlations
+
     def get_correlations(self):
         """ Compute auto and cross correlations of data. """
         auto_cov_x, auto_cov_v = compute_autocovariance(self.data.dataE, self.data.dataN, self.data.dataZ,
@@ -73,75 +120,179 @@ class HVarma:
 
     def transfer_fun(self):
         """ Obtain H/V amplitude from coefficients in the corresponding frequency interval. """
-        return transfer_function(self.param.neg_freq, self.param.pos_freq, self.param.freq_points, 1. / self.data.sampling_rate,
-                                 self.a, self.b, self.param.model_order + 1)
+        with self.stats.stage('transfer_function'):
+            return transfer_function(self.param.neg_freq, self.param.pos_freq, self.param.freq_points,
+                                     1. / self.data.sampling_rate, self.a, self.b, self.param.model_order + 1)
 
     def get_coherence(self):
         """ Call corresponding functions to compute coherence. """
         if self.coherence is None:
-            auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v = self.get_correlations()
-            self.coherence = compute_coherence(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v,
-                                               self.param.nfir, self.param.neg_freq, self.param.pos_freq,
-                                               self.param.freq_points, 1. / self.data.sampling_rate)
+            with self.stats.stage('covariance'):
+                auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v = self.get_correlations()
+            nfir = self.param.nfir
+            self.correlations = (auto_cov_x[:nfir], auto_cov_v[:nfir], cross_cov_v_zx[:nfir], cross_cov_zx_v[:nfir])
+            with self.stats.stage('coherence'):
+                self.coherence = compute_coherence(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v,
+                                                   self.param.nfir, self.param.neg_freq, self.param.pos_freq,
+                                                   self.param.freq_points, 1. / self.data.sampling_rate)
         return self.coherence
 
     def get_AIC(self):
         """ Compute AIC = n * log (ssr/n) + 2*k. """
-        x = self.data.dataN + 1j * self.data.dataE
-        v = self.data.dataZ
-        p, size = self.param.model_order+1, self.param.window_size
-        a, b = self.a, self.b
-        ssr = 0
-        for i in range(p, size):
-            ssr += np.abs(np.dot(x[i - p:i], a) - np.dot(v[i - p:i], b)) ** 2
-
-        AIC = 2 * 3 * p + size * np.log(ssr / size)
+        with self.stats.stage('aic'):
+            x = self.data.dataN + 1j * self.data.dataE
+            v = self.data.dataZ
+            p, size = self.param.model_order+1, self.param.window_size
+            a, b = self.a, self.b
+            ssr = 0
+            for i in range(p, size):
+                ssr += np.abs(np.dot(x[i - p:i], a) - np.dot(v[i - p:i], b)) ** 2
+
+            AIC = 2 * 3 * p + size * np.log(ssr / size)
         return AIC
 
 
+def peak_frequency(spectra, freq, conf):
+    """ Resonance frequencies of the median of spectra (one row per window)
+        on the grid freq, and their errors from the conf percentile band. """
+    # Positive peak
+    pos_freq, pos_err = 0, 0
+    if freq[-1] > 0:
+        pos, f = spectra[:, freq > 0], freq[freq > 0]
+        upp_pos = f[np.argmax(np.percentile(pos, 100-conf/2, axis=0))]
+        low_pos = f[np.argmax(np.percentile(pos, conf/2, axis=0))]
+        pos_freq = f[np.argmax(np.percentile(pos, 50, axis=0))]
+        pos_err = max(abs(upp_pos - pos_freq), abs(pos_freq - low_pos))
+
+    # Negative peak
+    neg_freq, neg_err = 0, 0
+    if freq[0] < 0:
+        neg, f = spectra[:, freq < 0], freq[freq < 0]
+        upp_neg = f[np.argmax(np.percentile(neg, 100-conf/2, axis=0))]
+        low_neg = f[np.argmax(np.percentile(neg, conf/2, axis=0))]
+        neg_freq = f[np.argmax(np.percentile(neg, 50, axis=0))]
+        neg_err = max(abs(upp_neg - neg_freq), abs(neg_freq - low_neg))
+
+    return pos_freq, pos_err, neg_freq, neg_err
+
+
 class AverageData:
     """ Helper class to handle calculations over all windows """
 
-    def __init__(self, window_list, param):
+    def __init__(self, window_list, param, decimation=1, screening=None, stats=None):
         assert len(window_list) > 0, "window_list should not be empty"
+        stats = get_stats(stats)
         self.param = param
         self.num_windows = len(window_list)
         self.station = window_list[0].data.station
+        self.sampling_rate = window_list[0].data.sampling_rate
+        self.decimation = decimation
+        self.screening = screening
         res, coh, aic = [], [], []
         for model in window_list:
             res.append(model.transfer_fun())
             coh.append(model.get_coherence())
             aic.append(model.get_AIC())
 
-        self.spectra = np.vstack(res)
-        self.coherence = np.vstack(coh)
-        self.AIC = np.array(aic)
+        with stats.stage('aggregation'):
+            self.spectra = np.vstack(res)
+            self.coherence = np.vstack(coh)
+            self.AIC = np.array(aic)
+            self.a = np.vstack([model.a for model in window_list])
+            self.b = np.vstack([model.b for model in window_list])
+            # Covariance lags needed to evaluate the coherence, one row per window
+            self.covariances = tuple(np.vstack(covs) for covs in zip(*[model.correlations for model in window_list]))
+
+    @classmethod
+    def from_arrays(cls, param, station, sampling_rate, spectra, coherence, AIC, a, b,
+                    decimation=1, screening=None, covariances=None):
+        """ Build results from per-window arrays (one row per window). """
+        results = cls.__new__(cls)
+        results.param = param
+        results.station = station
+        results.sampling_rate = sampling_rate
+        results.decimation = decimation
+        results.screening = screening
+        results.num_windows = len(spectra)
+        results.spectra = spectra
+        results.coherence = coherence
+        results.AIC = AIC
+        results.a = a
+        results.b = b
+        results.covariances = covariances
+        return results
+
+    def evaluate(self, **changes):
+        """ Evaluate the stored window models on a new frequency range, grid or
+            confidence level without solving them again. Accepts new values
+            of neg_freq, pos_freq, freq_points, freq_conf and plot_conf.  """
+        allowed = ('neg_freq', 'pos_freq', 'freq_points', 'freq_conf', 'plot_conf')
+        for key in changes:
+            if key not in allowed:
+                raise AttributeError(f'Parameter {key} requires solving the models again.')
+        if self.covariances is None:
+            raise AttributeError('Results do not store the window covariances.')
+
+        param = self.param.update(changes)
+        t = 1. / self.sampling_rate
+        spectra = transfer_function_batch(param.neg_freq, param.pos_freq, param.freq_points, t,
+                                          self.a, self.b)
+        coherence = compute_coherence_batch(*self.covariances, param.nfir, param.neg_freq, param.pos_freq,
+                                            param.freq_points, t)
+        return AverageData.from_arrays(param, self.station, self.sampling_rate, spectra, coherence,
+                                       self.AIC, self.a, self.b, decimation=self.decimation,
+                                       screening=self.screening, covariances=self.covariances)
+
+    def get_frequencies(self):
+        """ Frequency grid of the spectra """
+        return np.linspace(self.param.neg_freq, self.param.pos_freq, self.param.freq_points)
 
     @lru_cache(maxsize=10)
     def get_frequency(self, conf):
         """ Get resonance frequency, corresponding to the maximum peak """
-        f0, f1 = self.param.neg_freq, self.param.pos_freq
-        freq = np.linspace(f0, f1, self.param.freq_points)
-
-        # Positive peak
-        pos_freq, pos_err = 0, 0
-        if f1 > 0:
-            pos, f = self.spectra[:, freq > 0], freq[freq > 0]
-            upp_pos = f[np.argmax(np.percentile(pos, 100-conf/2, axis=0))]
-            low_pos = f[np.argmax(np.percentile(pos, conf/2, axis=0))]
-            pos_freq = f[np.argmax(np.percentile(pos, 50, axis=0))]
-            pos_err = max(abs(upp_pos - pos_freq), abs(pos_freq - low_pos))
-
-        # Negative peak
-        neg_freq, neg_err = 0, 0
-        if f0 < 0:
-            neg, f = self.spectra[:, freq < 0], freq[freq < 0]
-            upp_neg = f[np.argmax(np.percentile(neg, 100-conf/2, axis=0))]
-            low_neg = f[np.argmax(np.percentile(neg, conf/2, axis=0))]
-            neg_freq = f[np.argmax(np.percentile(neg, 50, axis=0))]
-            neg_err = max(abs(upp_neg - neg_freq), abs(neg_freq - low_neg))
-
-        return pos_freq, pos_err, neg_freq, neg_err
+        return peak_frequency(self.spectra, self.get_frequencies(), conf)
+
+    def bootstrap_frequency(self, n_resamples=1000, conf=95, seed=None, max_bytes=2**27, n_jobs=1):
+        """ Bootstrap confidence intervals of the resonance frequencies.
+            Each resample draws num_windows windows with replacement, and the
+            peaks of its median spectrum are located. Resamples are processed
+            in chunks of at most about max_bytes of temporaries, on n_jobs threads.
+            Each resample has its own random stream spawned from seed, so results
+            do not depend on max_bytes or n_jobs.  """
+        from concurrent.futures import ThreadPoolExecutor
+        freq = self.get_frequencies()
+        num_windows, npun = self.spectra.shape
+
+        # The median of a resample only depends on how many times each window is drawn:
+        # sort the windows once per frequency and locate the middle ranks in the counts.
+        order = np.argsort(self.spectra, axis=0).T
+        sorted_spectra = np.take_along_axis(self.spectra.T, order, axis=1)
+        rows = np.arange(npun)
+        low_rank, upp_rank = (num_windows - 1) // 2, num_windows // 2
+        dtype = np.int16 if num_windows < 2**15 else np.int32
+        chunk = max(1, min(n_resamples, max_bytes // (4 * num_windows * npun)))
+
+        seeds = np.random.SeedSequence(seed).spawn(n_resamples)
+        chunks = [seeds[first:first + chunk] for first in range(0, n_resamples, chunk)]
+
+        def peaks(chunk_seeds):
+            size = len(chunk_seeds)
+            index = np.concatenate([np.random.default_rng(seed_seq).integers(0, num_windows, size=num_windows)
+                                    for seed_seq in chunk_seeds])
+            index += np.repeat(np.arange(size) * num_windows, num_windows)
+            counts = np.bincount(index, minlength=size * num_windows).reshape(size, num_windows).astype(dtype)
+            cumulative = np.cumsum(counts[:, order], axis=-1, dtype=dtype)
+            median = 0.5 * (sorted_spectra[rows, np.sum(cumulative <= low_rank, axis=-1)]
+                            + sorted_spectra[rows, np.sum(cumulative <= upp_rank, axis=-1)])
+            pos = freq[freq > 0][np.argmax(median[:, freq > 0], axis=1)] if np.any(freq > 0) else np.zeros(size)
+            neg = freq[freq < 0][np.argmax(median[:, freq < 0], axis=1)] if np.any(freq < 0) else np.zeros(size)
+            return pos, neg
+
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            pos_peaks, neg_peaks = zip(*executor.map(peaks, chunks))
+
+        pos_freq, _, neg_freq, _ = self.get_frequency(self.param.freq_conf)
+        return BootstrapResults(pos_freq, neg_freq, np.concatenate(pos_peaks), np.concatenate(neg_peaks), conf)
 
     def get_spectrum_percentile(self, perc):
         """ Get data corresponding to a given percentile"""
@@ -156,6 +307,92 @@ class AverageData:
         return self.AIC
 
 
+@dataclass
+class BootstrapResults:
+    """ Peak frequencies of the median spectrum of each bootstrap resample. """
+    pos_freq: float
+    neg_freq: float
+    pos_peaks: np.ndarray
+    neg_peaks: np.ndarray
+    conf: float
+
+    @property
+    def pos_interval(self):
+        """ Confidence interval of the positive resonance frequency """
+        return tuple(np.percentile(self.pos_peaks, [(100 - self.conf) / 2, (100 + self.conf) / 2]))
+
+    @property
+    def neg_interval(self):
+        """ Confidence interval of the negative resonance frequency """
+        return tuple(np.percentile(self.neg_peaks, [(100 - self.conf) / 2, (100 + self.conf) / 2]))
+
+    def get_frequency(self):
+        """ Resonance frequencies and errors as AverageData.get_frequency,
+            the error being the largest distance to the interval bounds. """
+        pos_low, pos_upp = self.pos_interval
+        neg_low, neg_upp = self.neg_interval
+        return (self.pos_freq, max(abs(pos_upp - self.pos_freq), abs(self.pos_freq - pos_low)),
+                self.neg_freq, max(abs(neg_upp - self.neg_freq), abs(self.neg_freq - neg_low)))
+
+
+@dataclass
+class PreviewResults:
+    """ Quick-look results of a single model fitted to the covariances
+        averaged over all windows. There is no confidence band. """
+    param: ArmaParam
+    station: str
+    sampling_rate: float
+    num_windows: int
+    spectrum: np.ndarray
+    coherence: np.ndarray
+    a: np.ndarray
+    b: np.ndarray
+
+    def get_frequencies(self):
+        """ Frequency grid of the spectrum """
+        return np.linspace(self.param.neg_freq, self.param.pos_freq, self.param.freq_points)
+
+    def get_frequency(self, conf=None):
+        """ Get resonance frequency, corresponding to the maximum peak.
+            Errors are always 0, conf is accepted for compatibility with AverageData. """
+        freq = self.get_frequencies()
+        pos_freq, neg_freq = 0, 0
+        if self.param.pos_freq > 0:
+            pos_freq = freq[freq > 0][np.argmax(self.spectrum[freq > 0])]
+        if self.param.neg_freq < 0:
+            neg_freq = freq[freq < 0][np.argmax(self.spectrum[freq < 0])]
+        return pos_freq, 0, neg_freq, 0
+
+
+@dataclass
+class TimelapseResults:
+    """ Results of consecutive segments of a long recording: median spectrum
+        and coherence of each segment (one row per segment) and the peak
+        frequency time series. times are the segment starts in seconds.
+        Segments without windows are NaN. """
+    param: ArmaParam
+    station: str
+    sampling_rate: float
+    times: np.ndarray
+    segment_length: float
+    num_windows: np.ndarray
+    spectra: np.ndarray
+    coherence: np.ndarray
+    pos_freq: np.ndarray
+    pos_err: np.ndarray
+    neg_freq: np.ndarray
+    neg_err: np.ndarray
+    decimation: int = 1
+
+    def get_frequencies(self):
+        """ Frequency grid of the spectra """
+        return np.linspace(self.param.neg_freq, self.param.pos_freq, self.param.freq_points)
+
+    def get_frequency(self):
+        """ Resonance frequencies and errors of every segment, as arrays. """
+        return self.pos_freq, self.pos_err, self.neg_freq, self.neg_err
+
+
 @dataclass
 class OrderSearchResults:
     order_results: Mapping[int, AverageData]
@@ -164,3 +401,6 @@ class OrderSearchResults:
     final_order: int
     station: str
     success: bool
+    screening_results: Mapping[int, AverageData] = None
+    screening_order: int = None
+    stats: object = field(default=None, compare=False, repr=False)
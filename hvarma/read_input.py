@@ -30,6 +30,13 @@ class ArmaParam:
     freq_conf:   float = 20
     plot_conf:   float = 50
     output_dir:  str = '.'
+    decimate:    int = 0
+    band_margin: float = 1.25
+    screen:      int = 0
+    screen_sta_lta:  float = 4
+    screen_rms:      float = 4
+    screen_kurtosis: float = 6
+    screen_clip:     float = 0.01
 
     def __post_init__(self):
         """ Match the input values type during initialization. """
@@ -47,6 +54,7 @@ class ArmaParam:
         assert self.overlap <= self.window_size
         assert self.neg_freq < self.pos_freq
         assert self.nfir <= self.maxtau
+        assert self.band_margin >= 1
 
     @classmethod
     def from_dict(cls, args_dict):
@@ -157,6 +165,77 @@ class Data:
         dataE = self.dataE[start:start + size]
         return Data(dataZ, dataN, dataE, self.sampling_rate, self.station, copy_data=copy)
 
+    def make_batch(self, size, overlap, max_windows=None):
+        """ Create a batch with all the windows of data (strided views, no copies). """
+        return WindowBatch.from_arrays(self.dataZ, self.dataN, self.dataE, size, overlap,
+                                       self.sampling_rate, self.station, max_windows=max_windows)
+
+    def iter_batches(self, size, overlap, batch_windows, max_windows=None):
+        """ Generator of consecutive batches of at most batch_windows windows. """
+        batch = self.make_batch(size, overlap, max_windows=max_windows)
+        for first in range(0, batch.num_windows, batch_windows):
+            yield batch.subset(slice(first, first + batch_windows))
+
     def copy(self):
         # To be consistent with an old bug, this function returns itself!
         return self  # Data(self.dataZ, self.dataN, self.dataE, self.sampling_rate, self.station)
+
+
+@dataclass
+class WindowBatch:
+    """ Consecutive data windows stored as read-only strided views,
+        one window per row. Rows overlap in memory when windows do. """
+    dataZ: np.ndarray
+    dataN: np.ndarray
+    dataE: np.ndarray
+    starts: np.ndarray
+    sampling_rate: float
+    station: str
+
+    @classmethod
+    def from_arrays(cls, dataZ, dataN, dataE, size, overlap, sampling_rate, station,
+                    max_windows=None, offset=0):
+        """ Build the batch of windows of a given size and overlap.
+            offset is the position of the arrays within the whole recording. """
+        from numpy.lib.stride_tricks import sliding_window_view
+        assert overlap < size, "Window size must be larger than overlap"
+        if len(dataZ) < size:
+            raise ValueError('Window exceeds available data')
+
+        step = size - overlap
+        views = [sliding_window_view(np.asarray(comp, dtype=np.float64), size)[::step]
+                 for comp in (dataZ, dataN, dataE)]
+        if max_windows is not None:
+            views = [view[:max_windows] for view in views]
+        starts = offset + step * np.arange(len(views[0]))
+        return cls(*views, starts, float(sampling_rate), str(station))
+
+    @property
+    def num_windows(self):
+        return self.dataZ.shape[0]
+
+    @property
+    def size(self):
+        return self.dataZ.shape[1]
+
+    def __len__(self):
+        return self.num_windows
+
+    def subset(self, index):
+        """ Batch with the windows selected by index (slice or array). """
+        return WindowBatch(self.dataZ[index], self.dataN[index], self.dataE[index],
+                           self.starts[index], self.sampling_rate, self.station)
+
+    def means(self):
+        """ Mean of each window, for each component Z, N, E. """
+        return self.dataZ.mean(axis=1), self.dataN.mean(axis=1), self.dataE.mean(axis=1)
+
+    def centered(self):
+        """ Centered copies of the windows (Z, N, E). The source data is not modified. """
+        return tuple(comp - comp.mean(axis=1, keepdims=True)
+                     for comp in (self.dataZ, self.dataN, self.dataE))
+
+    def window(self, idx, copy=True):
+        """ Single window as a Data instance, a copy or a read-only view. """
+        return Data(self.dataZ[idx], self.dataN[idx], self.dataE[idx],
+                    self.sampling_rate, self.station, copy_data=copy)
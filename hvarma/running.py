@@ -8,43 +8,284 @@ import sys
 import os
 import time
 import warnings
-from collections import OrderedDict
-from .processing import HVarma, AverageData, OrderSearchResults
-from .write_output import progress_bar, write_results, plot_hvratio, plot_order_search
+from collections import OrderedDict, deque
+from itertools import chain
+from concurrent.futures import Future
+import numpy as np
+from .compute import transfer_function, compute_coherence, transfer_function_batch, compute_AIC_batch, \
+    compute_coherence_batch, compute_covariances_batch, full_lag_covariances, assemble_equations
+from .read_input import Data
+from .processing import HVarma, AverageData, OrderSearchResults, PreviewResults, TimelapseResults, \
+    peak_frequency
+from .preprocessing import decimate, effective_parameters, screen_windows
+from .cache import get_cache
+from .checkpoint import Checkpoint, restore_window
+from .instrumentation import get_stats
+from .autotune import choose_backend, SERIAL
+from .write_output import progress_bar, window_progress, write_results, plot_hvratio, plot_order_search, \
+    write_binary_results
+
+
+def window_batches(data, param, starts=None, batch_windows=256, max_windows=None):
+    """ Generator of WindowBatch of the windows run_model processes, at most
+        max_windows (param.max_windows by default). starts restricts the
+        windows to the given start positions. Windows are views of data,
+        which is never modified.   """
+    size = param.window_size
+    max_windows = param.max_windows if max_windows is None else max_windows
+    num_windows = 0
+    # One more window, since the last one is dropped if it ends at the last sample
+    for batch in data.iter_batches(size, param.overlap, batch_windows,
+                                   max_windows=max_windows + 1 if starts is None else None):
+        batch = batch.subset(batch.starts + size < data.size)  # As make_window requires
+        if starts is not None:
+            batch = batch.subset(np.isin(batch.starts, starts))
+        batch = batch.subset(slice(0, max_windows - num_windows))
+        if batch.num_windows > 0:
+            yield batch
+            num_windows += batch.num_windows
+        if num_windows == max_windows:
+            break
 
 
-def get_data_windows(data, size, overlap):
-    """ Generator of data slices from data of a given size,
-        overlapping one another """
-    if data.size < size:
-        raise ValueError('Window exceeds available data')
+def data_windows(data, param, starts=None):
+    """ Windows of data in the order run_model solves them, as Data views. """
+    for batch in window_batches(data, param, starts):
+        for idx in range(batch.num_windows):
+            yield batch.window(idx, copy=False)
 
-    for start in range(0, data.size-size+1, size-overlap):
-        yield data.make_window(start, size)
 
+def select_windows(data, param, out):
+    """ Apply the optional pre-screening stage. Returns the start
+        positions of the windows to process (None for all windows)
+        and the screening results.     """
+    if not param.screen:
+        return None, None
 
-def run_model(data, param, plot=False, verbose=True, write=False):
-    out = sys.stdout if verbose else open(os.devnull, "w")
+    screening = screen_windows(data, param)
+    starts = screening.accepted_starts()
+    print('Screening rejected', len(screening.skipped()), 'of', len(screening.starts),
+          'windows', file=out)
+    if len(starts) == 0:
+        raise ValueError('All windows were rejected by the screening')
+    return starts, screening
 
-    # Start windowing
-    beg = time.time()
-    processed_windows = []
 
-    progress = progress_bar(data.size, param.window_size, param.overlap, param.max_windows, file=out)
-    for idx, data_window in enumerate(get_data_windows(data, param.window_size, param.overlap)):
+def model_progress(data, param, starts, out):
+    """ Progress bar on out of the windows run_model solves. """
+    if starts is None:
+        return progress_bar(data.size, param.window_size, param.overlap, param.max_windows, file=out)
+    return window_progress(min(len(starts), param.max_windows), file=out)
+
+
+def model_windows(data, param, starts, out):
+    """ data_windows advancing a progress bar on out. """
+    progress = model_progress(data, param, starts, out)
+    for data_window in data_windows(data, param, starts):
         next(progress)
-        model = HVarma(data_window, param)
-        model.solve_arma()
-        model.get_coherence()
+        yield data_window
+
+
+def solve_serial(windows, param, saved=None, checkpoint=None, stats=None):
+    """ Center and solve windows one after the other. Returns their models. """
+    processed_windows = []
+    for idx, data_window in enumerate(windows):
+        model = HVarma(data_window, param, stats)
+        if saved is not None and idx < len(saved['a']):
+            restore_window(model, saved, idx)
+        else:
+            model.solve_arma()
+            model.get_coherence()
+            if checkpoint is not None:
+                checkpoint.add(model)
 
         processed_windows.append(model)
-        if idx + 1 == param.max_windows:  # Limited windows version
-            break
+    return processed_windows
+
+
+def solve_windows(batch, param):
+    """ Solve the windows of a WindowBatch. Returns the coefficients,
+        coherence and correlations of each.  """
+    solved = []
+    for idx in range(batch.num_windows):
+        model = HVarma(batch.window(idx, copy=False), param)
+        model.solve_arma()
+        solved.append((model.a, model.b, model.get_coherence(), model.correlations))
+    return solved
+
+
+def solve_batches(batches, param, backend, function):
+    """ Solve batches, pairs (keys, WindowBatch), with function(batch, param)
+        on the pool of backend, or in this thread if it is serial. Yields the
+        keys and the result of each batch in order, keeping at most twice as
+        many batches as workers running.   """
+    def submit(batch):
+        if backend.pool is not None:
+            return backend.pool.submit(function, batch, param)
+        future = Future()
+        future.set_result(function(batch, param))
+        return future
+
+    running = deque()
+    with backend:
+        for keys, batch in batches:
+            if batch.num_windows == 0:
+                continue
+            running.append((keys, submit(batch)))
+            while len(running) > 2 * backend.workers:
+                keys_done, future = running.popleft()
+                yield keys_done, future.result()
+        while running:
+            keys_done, future = running.popleft()
+            yield keys_done, future.result()
+
+
+def solve_parallel(batches, param, backend, saved, checkpoint, stats, progress):
+    """ Solve the windows of batches of backend.batch_windows windows on the
+        pool of backend. Windows restored from saved are not solved again.
+        The AIC is computed later in this thread, so results are the same
+        as those of solve_serial. Only the stages of this thread are
+        recorded in stats.    """
+    processed_windows = []
+
+    def pending():
+        for batch in batches:
+            first = len(processed_windows)
+            models = []
+            for idx in range(batch.num_windows):
+                next(progress)
+                model = HVarma(batch.window(idx, copy=False), param, stats)
+                processed_windows.append(model)
+                if saved is not None and first + idx < len(saved['a']):
+                    restore_window(model, saved, first + idx)
+                else:
+                    models.append(model)
+            yield models, batch.subset(slice(batch.num_windows - len(models), None))
+
+    for models, solved in solve_batches(pending(), param, backend, solve_windows):
+        for model, (a, b, coherence, correlations) in zip(models, solved):
+            model.a, model.b, model.coherence, model.correlations = a, b, coherence, correlations
+            if checkpoint is not None:
+                checkpoint.add(model)
+    return processed_windows
+
+
+def compute_model(data, param, out, checkpoint=None, stats=None, backend=SERIAL):
+    """ Pre-process data and solve the model in every window.
+        checkpoint is a WindowCheckpoint where solved windows are saved
+        and from which they are restored.
+        stats is a RunStats recording the time of each stage.
+        backend is a Backend, see solve_parallel.  """
+    stats = get_stats(stats)
+    # Optional decimation to the analysed band
+    data, param, factor = decimate(data, param)
+    if factor > 1:
+        print('Decimated by', factor, 'to', data.sampling_rate, 'Hz', file=out)
+
+    # Optional rejection of windows with transients
+    starts, screening = select_windows(data, param, out)
+
+    # Start windowing
+    beg = time.time()
+    saved = checkpoint.load() if checkpoint is not None else None
+    if saved is not None:
+        print('Restoring', len(saved['a']), 'windows from checkpoint', file=out)
+    if backend.name == 'serial':
+        windows = stats.timed('windowing', model_windows(data, param, starts, out))
+        processed_windows = solve_serial(windows, param, saved, checkpoint, stats)
+    else:
+        batches = stats.timed('windowing', window_batches(data, param, starts, backend.batch_windows))
+        processed_windows = solve_parallel(batches, param, backend, saved, checkpoint, stats,
+                                           model_progress(data, param, starts, out))
 
     print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
 
     print('Retrieving spectra...', file=out)
-    results = AverageData(processed_windows, param)
+    return AverageData(processed_windows, param, decimation=factor, screening=screening, stats=stats)
+
+
+def compute_preview(data, param, out, batch_windows=256):
+    """ Average the covariances of all windows and solve a single model. """
+    data, param, factor = decimate(data, param)
+    starts, _ = select_windows(data, param, out)
+
+    beg = time.time()
+    num_windows = 0
+    sums = None
+    for batch in window_batches(data, param, starts, batch_windows):
+        dataZ, dataN, dataE = batch.centered()
+        covs = [cov.sum(axis=0) for cov in compute_covariances_batch(dataE, dataN, dataZ, param.maxtau + 1)]
+        sums = covs if sums is None else [total + cov for total, cov in zip(sums, covs)]
+        num_windows += batch.num_windows
+    covariances = [total / num_windows for total in sums]
+
+    p = param.model_order
+    mat, indep = assemble_equations(*full_lag_covariances(*covariances), float(param.mu), float(param.nu),
+                                    p, param.maxtau)
+    solution = np.concatenate(([1], np.linalg.solve(mat, indep)))
+    a, b = solution[:p+1], solution[p+1:2*p+2] + 1j*solution[2*p+2:]
+
+    t = 1. / data.sampling_rate
+    spectrum = transfer_function(param.neg_freq, param.pos_freq, param.freq_points, t, a, b, p+1)
+    coherence = compute_coherence(*covariances, param.nfir, param.neg_freq, param.pos_freq,
+                                  param.freq_points, t)
+    print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
+    return PreviewResults(param, data.station, data.sampling_rate, num_windows, spectrum, coherence, a, b)
+
+
+def run_model(data, param, plot=False, verbose=True, write=False, cache=None, save_models=None,
+              preview=False, checkpoint=None, stats=None, backend=None, workers=None,
+              batch_windows=None):
+    """ Solve the model on data and aggregate the results of all windows.
+        cache is a ResultCache or a directory where results are reused
+        across calls with the same data and parameters.
+        save_models is a .npz filename where the window models are saved,
+        see AverageData.evaluate to use them on other frequencies.
+        preview solves a single model on the covariances averaged over
+        all windows and returns PreviewResults, a quick estimate of the
+        peak without confidence band. Preview results are not cached,
+        saved, written or plotted.
+        checkpoint is a Checkpoint or a directory where solved windows
+        and finished results are saved. Running again with the same
+        checkpoint resumes an interrupted run (cache must then be None).
+        stats is a RunStats where the time, calls and memory of each
+        stage are recorded (nothing is recorded for cached results),
+        also returned as results.stats.
+        backend is 'serial', 'threads' or 'processes', which solve
+        batches of batch_windows windows on workers (all the cores by
+        default), or a Backend whose pool is shared with other runs.
+        Without backend, the choice of the host profile written by
+        hvarma.autotune is used, or 'serial' if there is none. Pass
+        'serial' when run_model is itself called from a pool of workers.  """
+    out = sys.stdout if verbose else open(os.devnull, "w")
+
+    if preview:
+        results = compute_preview(data, param, out)
+        pos_freq, _, neg_freq, _ = results.get_frequency()
+        print('Preview positive resonance frequency: {:.6f} Hz'.format(pos_freq), file=out)
+        print('Preview negative resonance frequency: {:.6f} Hz'.format(neg_freq), file=out)
+        if not verbose:
+            out.close()
+        return results
+
+    cache = get_store(cache, checkpoint)
+    key = cache.key(data, param) if cache is not None else None
+    results = cache.get(key) if cache is not None else None
+
+    if results is None:
+        windows = cache.windows(key) if isinstance(cache, Checkpoint) else None
+        results = compute_model(data, param, out, checkpoint=windows, stats=stats,
+                                backend=choose_backend(param, backend, workers, batch_windows))
+        if cache is not None:
+            cache.put(key, results)
+        if windows is not None:
+            windows.clear()
+    else:
+        print('Results found in cache', file=out)
+    param = results.param
+
+    if save_models is not None:
+        write_binary_results(results, save_models)
 
     if write:
         print('Constructing output...', file=out)
@@ -60,9 +301,210 @@ def run_model(data, param, plot=False, verbose=True, write=False):
     if not verbose:
         out.close()
 
+    results.stats = stats
+    return results
+
+
+def sweep_weights(data, param, weights, verbose=False):
+    """ Run the model for each (mu, nu) pair in weights. Equations are
+        assembled once per window and solved for all pairs.
+        Returns an OrderedDict mapping each pair to its AverageData.  """
+    out = sys.stdout if verbose else open(os.devnull, "w")
+    weights = [(float(mu), float(nu)) for mu, nu in weights]
+
+    data, param, factor = decimate(data, param)
+    starts, screening = select_windows(data, param, out)
+
+    beg = time.time()
+    models, coefs, spectra, coherence, covariances = [], [], [], [], []
+    t = 1. / data.sampling_rate
+    for data_window in model_windows(data, param, starts, out):
+        model = HVarma(data_window, param)
+        a, b = model.solve_arma_weights(weights)
+        coefs.append((a, b))
+        spectra.append(transfer_function_batch(param.neg_freq, param.pos_freq, param.freq_points, t, a, b))
+        coherence.append(model.get_coherence())
+        models.append(model)
+        covariances.append(model.correlations)
+
+    # AIC is evaluated after all windows, as AverageData does
+    aic = [compute_AIC_batch(model.data.dataE, model.data.dataN, model.data.dataZ, a, b)
+           for model, (a, b) in zip(models, coefs)]
+    print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
+
+    coherence = np.vstack(coherence)
+    covariances = tuple(np.vstack(covs) for covs in zip(*covariances))
+    results = OrderedDict()
+    for k, (mu, nu) in enumerate(weights):
+        results[(mu, nu)] = AverageData.from_arrays(
+            param.update({'mu': mu, 'nu': nu}), data.station, data.sampling_rate,
+            np.vstack([spec[k] for spec in spectra]), coherence, np.array([val[k] for val in aic]),
+            np.vstack([a[k] for a, _ in coefs]), np.vstack([b[k] for _, b in coefs]),
+            decimation=factor, screening=screening, covariances=covariances)
+
+    if not verbose:
+        out.close()
     return results
 
 
+def run_directional(data, param, azimuths, verbose=False):
+    """ Run the model on the horizontal component along each azimuth
+        (degrees from North towards East), as if the traces had been
+        rotated beforehand. Covariances are computed once per window
+        and rotated in closed form for every azimuth.
+        Returns an OrderedDict mapping each azimuth to its AverageData. """
+    out = sys.stdout if verbose else open(os.devnull, "w")
+    azimuths = [float(az) for az in azimuths]
+    theta = np.deg2rad(azimuths)
+
+    data, param, factor = decimate(data, param)
+    starts, screening = select_windows(data, param, out)
+
+    beg = time.time()
+    models, coefs, spectra, coherence, covariances = [], [], [], [], []
+    t = 1. / data.sampling_rate
+    for data_window in model_windows(data, param, starts, out):
+        model = HVarma(data_window, param)
+        a, b, correlations = model.solve_arma_directional(azimuths)
+        coefs.append((a, b))
+        spectra.append(transfer_function_batch(param.neg_freq, param.pos_freq, param.freq_points, t, a, b))
+        coherence.append(compute_coherence_batch(*correlations, param.nfir, param.neg_freq, param.pos_freq,
+                                                 param.freq_points, t))
+        covariances.append(correlations)
+        models.append(model)
+
+    # AIC is evaluated after all windows, as AverageData does
+    aic = []
+    for model, (a, b) in zip(models, coefs):
+        dataN, dataE, dataZ = model.data.dataN, model.data.dataE, model.data.dataZ
+        aic.append([compute_AIC_batch(np.zeros(1), dataN * np.cos(th) + dataE * np.sin(th), dataZ,
+                                      a[k:k+1], b[k:k+1])[0]
+                    for k, th in enumerate(theta)])
+    print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
+
+    results = OrderedDict()
+    for k, az in enumerate(azimuths):
+        results[az] = AverageData.from_arrays(
+            param, data.station, data.sampling_rate,
+            np.vstack([spec[k] for spec in spectra]), np.vstack([coh[k] for coh in coherence]),
+            np.array([val[k] for val in aic]),
+            np.vstack([a[k] for a, _ in coefs]), np.vstack([b[k] for _, b in coefs]),
+            decimation=factor, screening=screening,
+            covariances=tuple(np.vstack([covs[j][k] for covs in covariances]) for j in range(4)))
+
+    if not verbose:
+        out.close()
+    return results
+
+
+def solve_spectra(batch, param):
+    """ Solve the windows of a WindowBatch, returning their spectra and coherence (one row per window). """
+    spectra, coherence = [], []
+    for idx in range(batch.num_windows):
+        model = HVarma(batch.window(idx, copy=False), param)
+        model.solve_arma()
+        spectra.append(model.transfer_fun())
+        coherence.append(model.get_coherence())
+    return np.vstack(spectra), np.vstack(coherence)
+
+
+def segment_windows(starts, seg_starts, seg_size, size, max_windows):
+    """ Windows of each segment, as a range [lo, hi) of the window starts,
+        at most max_windows per segment. """
+    lo = np.searchsorted(starts, seg_starts, side='left')
+    hi = np.minimum(np.searchsorted(starts, seg_starts + seg_size - size, side='right'), lo + max_windows)
+    return lo, hi
+
+
+def solve_segment_windows(data, param, starts, lo, hi, backend, out):
+    """ Solve each window of the segments [lo, hi) once, in order, with
+        solve_batches. Yields the index in starts, spectrum and coherence of each. """
+    needed = np.zeros(len(starts), dtype=bool)
+    for first, last in zip(lo, hi):
+        needed[first:last] = True
+    last_needed = np.flatnonzero(needed)[-1] + 1 if needed.any() else 0
+    progress = window_progress(last_needed, file=out)
+
+    def pending():
+        for batch in window_batches(data, param, starts[:last_needed], backend.batch_windows, last_needed):
+            keys = np.searchsorted(starts, batch.starts)
+            for _ in keys:
+                next(progress)
+            yield keys[needed[keys]], batch.subset(needed[keys])
+
+    for keys, (spectra, coherence) in solve_batches(pending(), param, backend, solve_spectra):
+        yield from zip(keys, spectra, coherence)
+
+
+def aggregate_segments(windows, lo, hi, freq, conf):
+    """ Median spectrum and coherence and the peaks of each segment [lo, hi)
+        of windows, triplets (index, spectrum, coherence) in order of index.
+        Windows are dropped once no later segment needs them.
+        Segments without windows are NaN.  """
+    num_segments = len(lo)
+    spectra = np.full((num_segments, len(freq)), np.nan)
+    coherence = np.full((num_segments, len(freq)), np.nan)
+    peaks = np.full((num_segments, 4), np.nan)
+    solved = {}
+    seg = 0
+    # The last triplet closes the remaining segments
+    for idx, window_spectrum, window_coherence in chain(windows, [(np.inf, None, None)]):
+        solved[idx] = (window_spectrum, window_coherence)
+        while seg < num_segments and hi[seg] - 1 <= idx:
+            if hi[seg] > lo[seg]:
+                seg_spectra = np.vstack([solved[k][0] for k in range(lo[seg], hi[seg])])
+                spectra[seg] = np.percentile(seg_spectra, 50, axis=0)
+                coherence[seg] = np.percentile(np.vstack([solved[k][1] for k in range(lo[seg], hi[seg])]),
+                                               50, axis=0)
+                peaks[seg] = peak_frequency(seg_spectra, freq, conf)
+            seg += 1
+            keep = lo[seg] if seg < num_segments else np.inf
+            for k in [k for k in solved if k < keep]:
+                del solved[k]
+    return spectra, coherence, peaks
+
+
+def run_timelapse(data, param, segment_length, step=None, workers=None, batch_windows=None, verbose=False,
+                  backend=None):
+    """ Run the model on consecutive segments of segment_length seconds,
+        starting every step seconds (segment_length by default), e.g. one
+        estimate per hour of a long Data or LazyData recording.
+        Windows are those of run_model on the whole recording; each window
+        is solved once and shared by all the segments containing it, at most
+        param.max_windows per segment.
+        backend, workers and batch_windows are chosen as in run_model.
+        Returns TimelapseResults with the median spectra and peaks per segment. """
+    out = sys.stdout if verbose else open(os.devnull, "w")
+    backend = choose_backend(param, backend, workers, batch_windows)
+    data, param, factor = decimate(data, param)
+    starts, _ = select_windows(data, param, out)
+
+    size = param.window_size
+    seg_size = int(round(segment_length * data.sampling_rate))
+    seg_step = int(round((segment_length if step is None else step) * data.sampling_rate))
+    if seg_size < size or seg_step < 1:
+        raise ValueError('Segments must be longer than a window')
+    if data.size < seg_size:
+        raise ValueError('Segment exceeds available data')
+    seg_starts = np.arange(0, data.size - seg_size + 1, seg_step)
+    if starts is None:
+        starts = np.arange(0, data.size - size, size - param.overlap)
+    starts = np.asarray(starts)
+    lo, hi = segment_windows(starts, seg_starts, seg_size, size, param.max_windows)
+
+    beg = time.time()
+    freq = np.linspace(param.neg_freq, param.pos_freq, param.freq_points)
+    spectra, coherence, peaks = aggregate_segments(solve_segment_windows(data, param, starts, lo, hi, backend, out),
+                                                   lo, hi, freq, param.freq_conf)
+    print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
+
+    if not verbose:
+        out.close()
+    return TimelapseResults(param, data.station, data.sampling_rate, seg_starts / data.sampling_rate,
+                            seg_size / data.sampling_rate, hi - lo, spectra, coherence,
+                            *peaks.T, decimation=factor)
+
+
 def get_difference(cur, prev):
     """ Subtract current and previous frequencies (positive, negative) """
     freqs_cur = cur.get_frequency(20)
@@ -79,30 +521,51 @@ def convergence_condition(pos_diff, neg_diff, tol):
     return abs(pos_diff)+abs(neg_diff) < 2*tol
 
 
-def get_results_for_order(data, param, tested_orders, order):
+def get_checkpoint(checkpoint):
+    """ Accept a Checkpoint or a directory name. """
+    if checkpoint is None or isinstance(checkpoint, Checkpoint):
+        return checkpoint
+    return Checkpoint(checkpoint)
+
+
+def get_store(cache, checkpoint):
+    """ Checkpoint if given, else the cache of results. A checkpoint also
+        keeps finished results, so both cannot be given.   """
+    if cache is not None and checkpoint is not None:
+        raise ValueError('Pass either cache or checkpoint, not both')
+    return get_cache(cache) if checkpoint is None else get_checkpoint(checkpoint)
+
+
+def get_results_for_order(data, param, tested_orders, order, cache=None, stats=None, backend=SERIAL):
     """ Run model for given order and order-3
-        if not already computed in tested_orders."""
+        if not already computed in tested_orders.
+        Stages of each order are recorded in a child of stats.  """
+    stats = get_stats(stats)
     param_cur = param.update({'model_order': order})
     param_prev = param.update({'model_order': order-3})
 
     if order not in tested_orders:
-        tested_orders[order] = run_model(data, param_cur, plot=False, verbose=False, write=False)
+        tested_orders[order] = run_model(data, param_cur, plot=False, verbose=False, write=False,
+                                         cache=cache, stats=stats.child(order), backend=backend)
 
     if order-3 not in tested_orders:
-        tested_orders[order-3] = run_model(data, param_prev, plot=False, verbose=False, write=False)
+        tested_orders[order-3] = run_model(data, param_prev, plot=False, verbose=False, write=False,
+                                           cache=cache, stats=stats.child(order-3), backend=backend)
 
     return tested_orders[order], tested_orders[order-3]
 
 
-def is_converged(data, param, tested_orders, order, tol=0.1):
+def is_converged(data, param, tested_orders, order, tol=0.1, cache=None, stats=None, backend=SERIAL):
     """ Check if a model order is sufficient to model given data (convergence criterion) """
-    results_cur, results_prev = get_results_for_order(data, param, tested_orders, order)
+    results_cur, results_prev = get_results_for_order(data, param, tested_orders, order, cache=cache,
+                                                      stats=stats, backend=backend)
     pos_diff, neg_diff = get_difference(results_cur, results_prev)
     converged = convergence_condition(pos_diff, neg_diff, tol=tol)
     return converged
 
 
-def binary_search(data, param, tested_orders, low_p, high_p, tol=0.1, verbose=False):
+def binary_search(data, param, tested_orders, low_p, high_p, tol=0.1, verbose=False, cache=None,
+                  stats=None, backend=SERIAL):
     """ Find smallest converged order in range low_p, high_p """
     out = sys.stdout if verbose else open(os.devnull, "w")
     print('Refining order within found bounds:', end='', file=out)
@@ -111,7 +574,7 @@ def binary_search(data, param, tested_orders, low_p, high_p, tol=0.1, verbose=Fa
         mid_p = (high_p + low_p) // 2
         print(f' {mid_p}', end='', file=out)
         sys.stdout.flush()
-        if is_converged(data, param, tested_orders, mid_p, tol):
+        if is_converged(data, param, tested_orders, mid_p, tol, cache=cache, stats=stats, backend=backend):
             high_p = mid_p
         else:
             low_p = mid_p+1
@@ -123,36 +586,61 @@ def binary_search(data, param, tested_orders, low_p, high_p, tol=0.1, verbose=Fa
     return low_p
 
 
+def find_upper_bound(data, param, tested_orders, start_order, max_order, tol=0.1, out=None, cache=None,
+                     stats=None, backend=SERIAL):
+    """ Double the order from start_order until it converges or reaches
+        max_order. Returns the last order tested.  """
+    order = start_order
+    print(f' {order}', end='', file=out)
+    while not is_converged(data, param, tested_orders, order, tol=tol, cache=cache, stats=stats,
+                           backend=backend):
+        sys.stdout.flush()
+        if order == max_order:
+            break
+        order = int(order * 2)
+        if order > max_order:
+            order = max_order
+        print(f' {order}', end='', file=out)
+    print(file=out)
+    return order
+
+
+def doubling_orders(start_order, max_order, order):
+    """ Orders find_upper_bound tests until it reaches order (or max_order). """
+    orders = [start_order]
+    while orders[-1] < min(order, max_order):
+        orders.append(min(orders[-1] * 2, max_order))
+    return orders
+
+
 def find_optimal_order_fast(data, param, tol=0.05, start_order=4, output_dir='.',
-                            plot=False, verbose=False, write=False):
+                            plot=False, verbose=False, write=False, cache=None, checkpoint=None, stats=None,
+                            backend=None):
     """
     Use fast algorithm to find a small converged hvarma order for given data.
+    backend is chosen once as in run_model and its pool is shared by all orders.
     """
     out = sys.stdout if verbose else open(os.devnull, "w")
     assert start_order >= 4
+    cache = get_store(cache, checkpoint)
+    backend = choose_backend(param, backend)
 
     beg = time.time()
     order = start_order
     tested_orders = OrderedDict()
+    max_order = effective_parameters(data, param).maxtau
 
-    print('Finding order upper bound. Tested orders:', end='', file=out)
-    sys.stdout.flush()
-
-    print(f' {order}', end='', file=out)
-    while not is_converged(data, param, tested_orders, order, tol=tol):
+    with backend:
+        print('Finding order upper bound. Tested orders:', end='', file=out)
         sys.stdout.flush()
-        if order == param.maxtau:
-            break
-        order = int(order * 2)
-        if order > param.maxtau:
-            order = param.maxtau
-        print(f' {order}', end='', file=out)
-    print(file=out)
-    # Now bisection search to refine order
-    final_order = binary_search(data, param, tested_orders, int(order / 2), order,
-                                tol=tol, verbose=verbose)
-
-    converged = is_converged(data, param, tested_orders, final_order, tol=tol)
+        order = find_upper_bound(data, param, tested_orders, order, max_order, tol=tol, out=out, cache=cache,
+                                 stats=stats, backend=backend)
+        # Now bisection search to refine order
+        final_order = binary_search(data, param, tested_orders, int(order / 2), order,
+                                    tol=tol, verbose=verbose, cache=cache, stats=stats, backend=backend)
+
+        converged = is_converged(data, param, tested_orders, final_order, tol=tol, cache=cache, stats=stats,
+                                 backend=backend)
     results = OrderSearchResults(tested_orders, tol, 'fast', final_order, data.station, converged)
     if plot:
         plot_order_search(results, output_dir=output_dir)
@@ -171,15 +659,124 @@ def find_optimal_order_fast(data, param, tol=0.05, start_order=4, output_dir='.'
     return results
 
 
+def stratified_windows(data, param, num_windows):
+    """ Data made of num_windows windows evenly spread over the windows
+        that run_model would process, placed one after another without
+        overlap. Returns the new data and parameters.  """
+    data, param, _ = decimate(data, param)
+    size, step = param.window_size, param.window_size - param.overlap
+    starts = list(range(0, data.size - size, step))[:param.max_windows]
+    if num_windows < len(starts):
+        starts = [starts[idx] for idx in np.unique(np.linspace(0, len(starts) - 1, num_windows).round().astype(int))]
+
+    windows = [data.make_window(start, size) for start in starts]
+    # One trailing sample, since make_window requires data past the window end
+    subset = Data(*[np.concatenate([getattr(window, comp) for window in windows] + [np.zeros(1)])
+                    for comp in ('dataZ', 'dataN', 'dataE')],
+                  data.sampling_rate, data.station, copy_data=False)
+    return subset, param.update({'overlap': 0, 'max_windows': len(starts), 'screen': 0})
+
+
+def find_optimal_order_multifidelity(data, param, tol=0.05, start_order=4, output_dir='.',
+                                     plot=False, verbose=False, write=False, cache=None,
+                                     screening_windows=None, checkpoint=None, stats=None, backend=None):
+    """
+    Search orders as find_optimal_order_fast on a stratified subset of
+    screening_windows windows (by default a quarter of max_windows, at least 32).
+    The screening order predicts the bracket where find_optimal_order_fast
+    ends its doubling of the order. If its bounds are confirmed with all windows
+    (upper converged or max_order, lower unconverged), the doubling orders below
+    are skipped. Otherwise the doubling is followed with all windows. The bracket
+    is then bisected with all windows as find_optimal_order_fast does, so both
+    methods return the same order unless one of the skipped orders converges
+    with all windows.
+    backend is chosen once as in run_model and its pool is shared by all orders.
+    """
+    out = sys.stdout if verbose else open(os.devnull, "w")
+    cache = get_store(cache, checkpoint)
+    stats = get_stats(stats)
+    backend = choose_backend(param, backend)
+    if screening_windows is None:
+        screening_windows = max(32, param.max_windows // 4)
+
+    beg = time.time()
+    with backend:
+        subset, subset_param = stratified_windows(data, param, screening_windows)
+        print('Screening orders on', subset_param.max_windows, 'windows', file=out)
+        screening = find_optimal_order_fast(subset, subset_param, tol=tol, start_order=start_order,
+                                            verbose=verbose, cache=cache, stats=stats.child('screening'),
+                                            backend=backend)
+        screened = screening.order_results
+        screening_order = screening.final_order
+        max_order = effective_parameters(data, param).maxtau
+
+        tested_orders = OrderedDict()
+        kwargs = dict(tol=tol, cache=cache, stats=stats, backend=backend)
+        order = None
+        if screening.success:
+            *lower, upper = doubling_orders(start_order, max_order, screening_order)
+            print('Confirming order bracket with all windows. Tested orders:', end='', file=out)
+            print(f' {upper}', end='', file=out)
+            if upper == max_order or is_converged(data, param, tested_orders, upper, **kwargs):
+                if lower:
+                    print(f' {lower[-1]}', end='', file=out)
+                if not lower or not is_converged(data, param, tested_orders, lower[-1], **kwargs):
+                    order = upper
+            print(file=out)
+        if order is None:
+            print('Screening was not confirmed, searching with all windows. Tested orders:', end='', file=out)
+            order = find_upper_bound(data, param, tested_orders, start_order, max_order, out=out, **kwargs)
+
+        final_order = binary_search(data, param, tested_orders, int(order / 2), order,
+                                    tol=tol, verbose=verbose, cache=cache, stats=stats, backend=backend)
+        converged = is_converged(data, param, tested_orders, final_order, tol=tol, cache=cache, stats=stats,
+                                 backend=backend)
+    results = OrderSearchResults(tested_orders, tol, 'multifidelity', final_order, data.station, converged,
+                                 screening_results=screened, screening_order=screening_order)
+    if plot:
+        plot_order_search(results, output_dir=output_dir)
+
+    print('Elapsed:', round((time.time() - beg) / 60, 1), 'min', file=out)
+
+    if converged:
+        print('Final order', final_order, file=out)
+    else:
+        message = 'Could not find order with the given parameters.'
+        warnings.warn(message, RuntimeWarning)
+
+    if not verbose:
+        out.close()
+    return results
+
+
 def find_optimal_order(data, param, tol=0.05, start_order=4, output_dir='.',
-                       plot=False, verbose=False, write=False, method='fast'):
+                       plot=False, verbose=False, write=False, method='fast', cache=None, checkpoint=None,
+                       stats=None, backend=None):
     """
     Find a small hvarma order that suffices to describe data.
     The returned order satisfies a convergence criterion.
+    method 'multifidelity' screens the orders on a subset of windows
+    and only confirms the final bracket with all windows.
+    Results of each order are reused from cache if given.
+    With a checkpoint directory, finished orders and the windows of the
+    order in progress are saved, and a new call with the same checkpoint
+    resumes the search. cache and checkpoint cannot be given together.
+    stats is a RunStats that keeps the stage statistics of each tested
+    order in stats.children (those of the screening in stats.children['screening'])
+    and is returned as results.stats.
+    backend is chosen once as in run_model and its pool is shared by all orders.
     """
     if method == 'fast':
-        return find_optimal_order_fast(data, param, tol=tol, start_order=start_order,
-                                       output_dir=output_dir,
-                                       plot=plot, verbose=verbose, write=write)
-
-    assert 0, f"Method {method} not available"
+        results = find_optimal_order_fast(data, param, tol=tol, start_order=start_order,
+                                          output_dir=output_dir,
+                                          plot=plot, verbose=verbose, write=write, cache=cache,
+                                          checkpoint=checkpoint, stats=stats, backend=backend)
+    elif method == 'multifidelity':
+        results = find_optimal_order_multifidelity(data, param, tol=tol, start_order=start_order,
+                                                   output_dir=output_dir,
+                                                   plot=plot, verbose=verbose, write=write, cache=cache,
+                                                   checkpoint=checkpoint, stats=stats, backend=backend)
+    else:
+        assert 0, f"Method {method} not available"
+    results.stats = stats
+    return results
@@ -0,0 +1,194 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Resident server that runs jobs sent over a local UNIX socket.
+
+Imports, the C extension and the caches are loaded once per worker
+process, so many short jobs can be pushed with little overhead.
+Requests and responses are JSON objects, one per line. A job is
+
+    {"id": "B001", "Z": "B001_Z.sac", "N": "B001_N.sac", "E": "B001_E.sac",
+     "format": "sac", "param": {"model_order": 42}, "output": "B001.npz"}
+
+"format" is sac (default), mseed or npy (then "sampling_rate" and
+"station" are also given), "output" is an optional binary results file,
+"write" writes the text results and "order_search" runs find_optimal_order.
+Responses are sent as soon as each job finishes, with the same "id".
+The request {"command": "ping"} is answered with {"status": "ok"}.
+"""
+
+import os
+import json
+import stat
+import socket
+import threading
+import socketserver
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def load_arrays(fmt, filenames, sampling_rate=None, station=None):
+    """ Samples of the three components in filenames, their sampling rate
+        and station. sampling_rate and station are needed for npy files only. """
+    import numpy as np
+    if fmt == 'npy':
+        arrays = [np.load(fname) for fname in filenames]
+        return arrays, float(sampling_rate), str(station)
+    from .lazy_input import LazyData
+    reader = LazyData.from_mseed if fmt == 'mseed' else LazyData.from_sac
+    with reader(*filenames, prefetch=False) as lazy:
+        data = lazy.load()
+    return (data.dataZ, data.dataN, data.dataE), data.sampling_rate, data.station
+
+
+@lru_cache(maxsize=16)
+def read_arrays(fmt, filenames, mtimes, sampling_rate=None, station=None):
+    """ load_arrays, kept in memory by each worker while the files are
+        unchanged (mtimes are part of the key). """
+    return load_arrays(fmt, filenames, sampling_rate, station)
+
+
+def load_data(job):
+    """ Data of a job. Each job gets its own copy of the samples. """
+    from .read_input import Data
+    filenames = tuple(job[comp] for comp in ('Z', 'N', 'E'))
+    mtimes = tuple(os.stat(fname).st_mtime_ns for fname in filenames)
+    arrays, sampling_rate, station = read_arrays(job.get('format', 'sac'), filenames, mtimes,
+                                                 job.get('sampling_rate'), job.get('station'))
+    return Data(*arrays, sampling_rate, station)
+
+
+@lru_cache(maxsize=4)
+def get_worker_cache(directory):
+    from .cache import ResultCache
+    return ResultCache(directory)
+
+
+def warm_up():
+    """ Load the modules and the C extension when a worker starts. """
+    from . import running, write_output  # noqa: F401
+
+
+def run_job(job, cache_dir=None):
+    """ Run a job in a worker. Returns the response. Jobs already run in
+        parallel, so each one is solved serially.  """
+    from .read_input import ArmaParam
+    from .running import run_model, find_optimal_order
+    from .write_output import write_binary_results, write_results
+    try:
+        data = load_data(job)
+        param = ArmaParam.from_dict(job.get('param', {}))
+        cache = get_worker_cache(cache_dir) if cache_dir is not None else None
+        response = {'id': job.get('id'), 'status': 'ok', 'station': data.station}
+
+        if job.get('order_search'):
+            search = find_optimal_order(data, param, tol=job.get('tol', 0.05), cache=cache, backend='serial')
+            response['final_order'] = search.final_order
+            response['success'] = bool(search.success)
+            results = search.order_results[search.final_order]
+        else:
+            results = run_model(data, param, verbose=False, cache=cache, backend='serial')
+        param = results.param
+
+        pos_freq, pos_err, neg_freq, neg_err = results.get_frequency(param.freq_conf)
+        response.update({'pos_freq': float(pos_freq), 'pos_err': float(pos_err),
+                         'neg_freq': float(neg_freq), 'neg_err': float(neg_err),
+                         'num_windows': results.num_windows})
+        if job.get('output'):
+            write_binary_results(results, job['output'])
+            response['output'] = job['output']
+        if job.get('write'):
+            write_results(data, param, results)
+        return response
+    except Exception as err:
+        return {'id': job.get('id'), 'status': 'error', 'error': f'{type(err).__name__}: {err}'}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ Read jobs from a connection and stream back their responses. """
+
+    def handle(self):
+        lock = threading.Lock()
+        finished = threading.Semaphore(0)
+        pending = 0
+
+        def send(response):
+            with lock:
+                self.wfile.write((json.dumps(response) + '\n').encode())
+                self.wfile.flush()
+
+        def reply(future, job):
+            try:
+                send(future.result())
+            except Exception as err:
+                send({'id': job.get('id'), 'status': 'error', 'error': f'{type(err).__name__}: {err}'})
+            finally:
+                finished.release()
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as err:
+                send({'status': 'error', 'error': f'Bad request: {err}'})
+                continue
+            if job.get('command') == 'ping':
+                send({'id': job.get('id'), 'status': 'ok'})
+                continue
+            future = self.server.pool.submit(run_job, job, self.server.cache_dir)
+            future.add_done_callback(lambda fut, job=job: reply(fut, job))
+            pending += 1
+
+        # The client closed its side: answer its jobs before closing the connection
+        for _ in range(pending):
+            finished.acquire()
+
+
+def remove_socket(path):
+    """ Remove a stale socket left at path. Raises if path is another kind of file. """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f'{path} exists and is not a socket')
+    os.remove(path)
+
+
+class HVarmaServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, workers=None, cache_dir=None, processes=True):
+        remove_socket(path)
+        super().__init__(path, JobHandler)
+        pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = pool_class(max_workers=workers or os.cpu_count(), initializer=warm_up)
+        self.cache_dir = cache_dir
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+        remove_socket(self.server_address)
+
+
+def serve(path, workers=None, cache_dir=None, processes=True):
+    """ Serve jobs on the UNIX socket path until interrupted. """
+    with HVarmaServer(path, workers, cache_dir, processes) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def submit(path, jobs):
+    """ Send jobs to a server and yield the responses as they arrive. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile('rwb') as stream:
+            for job in jobs:
+                stream.write((json.dumps(job) + '\n').encode())
+            stream.flush()
+            sock.shutdown(socket.SHUT_WR)
+            for line in stream:
+                yield json.loads(line)
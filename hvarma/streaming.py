@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Streaming processing of continuous recordings.
+
+StreamingHVarma receives chunks of samples of any size, solves each
+window as soon as it is complete and keeps the results of the last
+windows in fixed-size arrays, so the current resonance estimate is
+available at any time with a bounded memory footprint.
+
+Usage example:
+    stream = StreamingHVarma(param, sampling_rate=100, station='B001')
+    for dataZ, dataN, dataE in chunks:
+        stream.push(dataZ, dataN, dataE)
+        pos_freq, pos_err, neg_freq, neg_err = stream.get_frequency()
+"""
+
+import numpy as np
+from .processing import HVarma, AverageData
+from .read_input import Data
+
+
+class StreamingHVarma:
+    """ Rolling aggregate of the last max_windows windows of a stream.
+        Windows overlap as in run_model, so with enough max_windows the
+        results match run_model on the whole recording.  """
+
+    def __init__(self, param, sampling_rate, station='', max_windows=None, max_windows_per_push=None):
+        if param.decimate or param.screen:
+            raise ValueError('Decimation and screening are not available when streaming')
+        if param.overlap >= param.window_size:
+            raise ValueError('Overlap must be smaller than the window size')
+        self.param = param
+        self.sampling_rate = float(sampling_rate)
+        self.station = str(station)
+        self.capacity = max_windows or param.max_windows
+        self.max_windows_per_push = max_windows_per_push
+        self.step = param.window_size - param.overlap
+
+        # Samples from the start of the oldest window still needed
+        self.buffer = np.zeros((3, 0))
+        self.buffer_start = 0
+        self.next_start = 0
+        self.received = 0
+        self.num_windows = 0
+
+        pp = param.model_order + 1
+        self.spectra = np.zeros((self.capacity, param.freq_points))
+        self.coherence = np.zeros((self.capacity, param.freq_points))
+        self.AIC = np.zeros(self.capacity)
+        self.a = np.zeros((self.capacity, pp))
+        self.b = np.zeros((self.capacity, pp), dtype=complex)
+        self.starts = np.zeros(self.capacity, dtype=np.int64)
+
+    def push(self, dataZ, dataN, dataE):
+        """ Add a chunk of samples and solve the windows completed by it, at most
+            max_windows_per_push of them (the others wait for the next call).
+            Returns the number of windows solved.  """
+        assert len(dataZ) == len(dataN) == len(dataE), \
+            "Data do not have the same size in Z, N or E directions"
+        chunk = np.vstack((dataZ, dataN, dataE)).astype(np.float64)
+        self.buffer = np.concatenate((self.buffer, chunk), axis=1)
+        self.received += chunk.shape[1]
+        return self.process(self.max_windows_per_push)
+
+    def pending_windows(self):
+        """ Number of complete windows waiting to be solved. """
+        available = self.received - self.next_start
+        if available < self.param.window_size:
+            return 0
+        return (available - self.param.window_size) // self.step + 1
+
+    def window(self, start):
+        """ Data of the window starting at sample start (views of the buffer). """
+        offset = start - self.buffer_start
+        dataZ, dataN, dataE = self.buffer[:, offset:offset + self.param.window_size]
+        return Data(dataZ, dataN, dataE, self.sampling_rate, self.station, copy_data=False)
+
+    def process(self, max_windows=None):
+        """ Solve complete windows, at most max_windows of them. Returns the number solved. """
+        solved = 0
+        while self.pending_windows() and (max_windows is None or solved < max_windows):
+            start = self.next_start
+            model = HVarma(self.window(start), self.param)
+            model.solve_arma()
+
+            idx = self.num_windows % self.capacity
+            self.spectra[idx] = model.transfer_fun()
+            self.coherence[idx] = model.get_coherence()
+            self.AIC[idx] = model.get_AIC()
+            self.a[idx], self.b[idx] = model.a, model.b
+            self.starts[idx] = start
+            self.num_windows += 1
+            self.next_start += self.step
+            solved += 1
+            self.trim()
+        return solved
+
+    def trim(self):
+        """ Drop the samples no longer needed. """
+        keep = min(self.next_start, self.received)
+        self.buffer = self.buffer[:, keep - self.buffer_start:]
+        self.buffer_start = keep
+
+    def flush(self):
+        """ End of the stream. Every solved window is final, so this only
+            drops the samples no longer needed.  """
+        self.trim()
+
+    def window_order(self):
+        """ Indices of the stored windows, from oldest to newest. """
+        stored = min(self.num_windows, self.capacity)
+        first = self.num_windows - stored
+        return (first + np.arange(stored)) % self.capacity
+
+    def get_starts(self):
+        """ Sample index of the start of each stored window, from oldest to newest. """
+        return self.starts[self.window_order()]
+
+    def results(self):
+        """ AverageData of the stored windows, from oldest to newest. """
+        if self.num_windows == 0:
+            raise ValueError('No complete window yet')
+        order = self.window_order()
+        return AverageData.from_arrays(self.param, self.station, self.sampling_rate, self.spectra[order],
+                                       self.coherence[order], self.AIC[order], self.a[order], self.b[order])
+
+    def get_frequency(self, conf=None):
+        """ Current resonance frequency estimate, see AverageData.get_frequency. """
+        return self.results().get_frequency(self.param.freq_conf if conf is None else conf)
@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Synthetic micro-tremor records with a known H/V transfer function.
+
+The vertical component is Gaussian noise and the horizontal component
+x = N + iE is the vertical filtered by the ARMA model of HVarma,
+A(q) x = B(q) v, so the H/V spectrum and its peaks are known exactly.
+Records of any length are generated in chunks, the filter state being
+carried from one chunk to the next.
+
+Usage example:
+    model = SyntheticModel.from_resonances([2.5], damping=0.05, sampling_rate=100)
+    data = synthetic_data(model, duration=3600, seed=0)
+    pos_freq, neg_freq = model.true_peaks(-20, 20)
+"""
+
+from dataclasses import dataclass
+import numpy as np
+from .read_input import Data
+
+
+@dataclass
+class SyntheticModel:
+    """ H/V transfer function B/A with real a (a[0] = 1) and complex b, as in HVarma. """
+    a: np.ndarray
+    b: np.ndarray
+    sampling_rate: float
+
+    def __post_init__(self):
+        self.a = np.array(self.a, dtype=np.float64)
+        self.b = np.array(self.b, dtype=np.complex128)
+        self.sampling_rate = float(self.sampling_rate)
+        if self.a[0] != 1:
+            raise ValueError('First coefficient of a must be 1')
+        if np.any(np.abs(np.roots(self.a)) >= 1):
+            raise ValueError('Model is unstable')
+
+    @classmethod
+    def from_resonances(cls, frequencies, damping, sampling_rate, gain=1., azimuth=0.):
+        """ Model with a resonance at each of frequencies (Hz, positive), each a
+            pair of complex conjugate poles with the given damping ratio (a number
+            or one per frequency). The horizontal motion is polarized along
+            azimuth (degrees from North towards East) with amplitude gain.  """
+        frequencies = np.atleast_1d(np.array(frequencies, dtype=float))
+        damping = np.broadcast_to(np.array(damping, dtype=float), frequencies.shape)
+        if np.any(frequencies <= 0) or np.any(frequencies >= sampling_rate / 2):
+            raise ValueError('Resonance frequencies must be between 0 and the Nyquist frequency')
+        if np.any(damping <= 0) or np.any(damping >= 1):
+            raise ValueError('Damping must be between 0 and 1')
+
+        t = 1. / sampling_rate
+        a = np.ones(1)
+        for f0, zeta in zip(frequencies, damping):
+            radius = np.exp(-2 * np.pi * f0 * zeta * t)
+            a = np.convolve(a, [1, -2 * radius * np.cos(2 * np.pi * f0 * t), radius ** 2])
+        b = [gain * np.exp(1j * np.deg2rad(azimuth))]
+        return cls(a, b, sampling_rate)
+
+    def response(self, freq):
+        """ H/V amplitude at freq (Hz), as computed by transfer_function. """
+        z = np.exp(-1j * 2 * np.pi * np.asarray(freq, dtype=float)[..., None] / self.sampling_rate)
+        return np.abs((z ** np.arange(len(self.b))) @ self.b / ((z ** np.arange(len(self.a))) @ self.a))
+
+    def true_peaks(self, neg_freq=None, pos_freq=None, points=2**16):
+        """ Frequencies of the maximum of the response in (0, pos_freq] and
+            [neg_freq, 0), the whole band up to Nyquist by default. Peaks are
+            located on a grid of points and refined to 1e-9 Hz.  """
+        from scipy.optimize import minimize_scalar
+        nyquist = self.sampling_rate / 2
+        peaks = []
+        for low, upp in ((0, nyquist if pos_freq is None else pos_freq),
+                         (-nyquist if neg_freq is None else neg_freq, 0)):
+            if upp <= low:
+                peaks.append(0)
+                continue
+            freq = np.linspace(low, upp, points)
+            idx = np.argmax(self.response(freq))
+            bounds = (freq[max(idx - 1, 0)], freq[min(idx + 1, points - 1)])
+            best = minimize_scalar(lambda f: -self.response(f), bounds=bounds, method='bounded',
+                                   options={'xatol': 1e-9})
+            peaks.append(best.x if -best.fun >= self.response(freq[idx]) else freq[idx])
+        return peaks[0], peaks[1]
+
+
+def synthetic_chunks(model, duration, chunk_size=2**16, seed=None, noise=0.):
+    """ Generator of (dataZ, dataN, dataE) chunks of at most chunk_size samples
+        covering duration seconds at model.sampling_rate. noise is the standard
+        deviation of white noise added to each component. The samples do not
+        depend on chunk_size for a given seed.  """
+    from scipy.signal import lfilter
+    num_samples = int(round(duration * model.sampling_rate))
+    rng_v, rng_z, rng_n, rng_e = [np.random.default_rng(seq) for seq in np.random.SeedSequence(seed).spawn(4)]
+    state = np.zeros(max(len(model.a), len(model.b)) - 1, dtype=np.complex128)
+
+    for start in range(0, num_samples, chunk_size):
+        size = min(chunk_size, num_samples - start)
+        v = rng_v.standard_normal(size)
+        x, state = lfilter(model.b, model.a, v, zi=state)
+        dataZ, dataN, dataE = v, x.real, x.imag
+        if noise:
+            dataZ = dataZ + noise * rng_z.standard_normal(size)
+            dataN = dataN + noise * rng_n.standard_normal(size)
+            dataE = dataE + noise * rng_e.standard_normal(size)
+        yield dataZ, dataN, dataE
+
+
+def synthetic_data(model, duration, seed=None, noise=0., station='SYN', chunk_size=2**16):
+    """ Data with duration seconds of synthetic record, see synthetic_chunks. """
+    chunks = list(synthetic_chunks(model, duration, chunk_size, seed, noise))
+    dataZ, dataN, dataE = [np.concatenate(comp) for comp in zip(*chunks)]
+    return Data(dataZ, dataN, dataE, model.sampling_rate, station, copy_data=False)
@@ -0,0 +1,288 @@
+"""
+Copyright (c) 2022, Spanish National Research Council (CSIC)
+
+Work queue of station jobs in a directory of a shared filesystem.
+
+Workers on any node take jobs from the queue with no other service than
+the filesystem. A job is a JSON file with the same contents as a job of
+hvarma.server, and it moves between the subdirectories
+
+    pending/<id>@<attempts>.json
+    claimed/<id>@<attempt>@<worker>.json
+    done/<id>.json, failed/<id>.json
+
+A worker claims a job by renaming it from pending to claimed, which only
+one worker can do, and touches the claimed file while the job runs. A
+claim whose file has not been touched for stale_after seconds belongs to
+a worker that crashed and any worker puts it back in pending, or in
+failed after max_attempts claims. The response of each job is written
+in results/<id>.json and, unless the job gives "output", its binary
+results in results/<id>.npz.
+
+Stale claims are found by comparing the time of each node with the
+modification times of the claims, which the file server sets, so the
+clocks of all the nodes and of the file server must be kept in sync
+(e.g. with NTP) to well within stale_after.
+
+Usage example:
+    submit_jobs('/shared/queue', jobs)
+    run_worker('/shared/queue', cache_dir='/shared/cache')  # on each node
+    rows = collect_results('/shared/queue')
+"""
+
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+
+STATES = ('pending', 'claimed', 'done', 'failed', 'results')
+
+
+def queue_paths(directory):
+    """ Subdirectories of the queue, created if missing. """
+    paths = {state: os.path.join(directory, state) for state in STATES}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    return paths
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'.replace('@', '_').replace(os.sep, '_')
+
+
+def write_json(filename, content):
+    """ Write content to filename so that readers never see a partial file. """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(content, file)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, filename)
+
+
+def read_json(filename):
+    with open(filename) as file:
+        return json.load(file)
+
+
+def parse_name(fname):
+    """ Id, attempts and worker of a file of the queue. """
+    parts = fname[:-len('.json')].split('@')
+    return parts[0], int(parts[1]) if len(parts) > 1 else 0, parts[2] if len(parts) > 2 else None
+
+
+def queued_ids(paths):
+    """ Ids of the jobs in any state of the queue, results included. """
+    ids = set()
+    for state in STATES:
+        for fname in os.listdir(paths[state]):
+            if state == 'results':
+                ids.add(os.path.splitext(fname)[0])
+            elif fname.endswith('.json'):
+                ids.add(parse_name(fname)[0])
+    return ids
+
+
+def submit_jobs(directory, jobs):
+    """ Add jobs to the queue. Each job needs an "id", unique in the queue:
+        ids already in any state of the queue raise ValueError, and no
+        job is added. Relative paths are taken from the current directory. """
+    paths = queue_paths(directory)
+    existing = queued_ids(paths)
+    ids = set()
+    for job in jobs:
+        job_id = str(job['id'])
+        if not job_id or '@' in job_id or os.sep in job_id or job_id.startswith('.'):
+            raise ValueError(f'Invalid job id {job_id!r}')
+        if job_id in ids:
+            raise ValueError(f'Duplicated job id {job_id!r}')
+        if job_id in existing:
+            raise ValueError(f'Job {job_id!r} is already in the queue')
+        ids.add(job_id)
+    for job in jobs:
+        job_id = str(job['id'])
+        job = dict(job)
+        for comp in ('Z', 'N', 'E', 'output'):
+            if job.get(comp):
+                job[comp] = os.path.abspath(job[comp])
+        write_json(os.path.join(paths['pending'], f'{job_id}@0.json'), job)
+
+
+def station_job(job, param, order_search=False, tol=0.05):
+    """ Job of the queue from a StationJob of hvarma.batch. Its id is the
+        name of the station, with the directories of stations named by their
+        relative path joined by dots.   """
+    content = {'id': job.name.replace(os.sep, '.'), 'Z': job.Z, 'N': job.N, 'E': job.E, 'format': job.format,
+               'param': {key: value for key, value in param.get_dict().items() if key != 'output_dir'}}
+    if job.format == 'npy':
+        content.update({'sampling_rate': job.sampling_rate, 'station': job.station or job.name})
+    if order_search:
+        content.update({'order_search': True, 'tol': tol})
+    return content
+
+
+def reclaim_stale(directory, stale_after, max_attempts):
+    """ Put the jobs of claims not touched for stale_after seconds back
+        in pending, or in failed after max_attempts. Returns their ids. """
+    paths = queue_paths(directory)
+    now = time.time()
+    reclaimed = []
+    for fname in sorted(os.listdir(paths['claimed'])):
+        if not fname.endswith('.json'):
+            continue
+        path = os.path.join(paths['claimed'], fname)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # The rename of a claim changes its ctime, so a claim is fresh until its first heartbeat
+        if now - max(stat.st_mtime, stat.st_ctime) < stale_after:
+            continue
+        job_id, attempts, worker = parse_name(fname)
+        if attempts >= max_attempts:
+            target = os.path.join(paths['failed'], f'{job_id}.json')
+        else:
+            target = os.path.join(paths['pending'], f'{job_id}@{attempts}.json')
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            continue
+        if attempts >= max_attempts:
+            write_json(os.path.join(paths['results'], f'{job_id}.json'),
+                       {'id': job_id, 'status': 'error',
+                        'error': f'Claim of {worker} expired after {attempts} attempts'})
+        reclaimed.append(job_id)
+    return reclaimed
+
+
+def claim_job(directory, worker_id):
+    """ Move the pending job with the smallest id to claimed. Returns the
+        path of the claim, or None if no job is pending.   """
+    paths = queue_paths(directory)
+    pending = [fname for fname in os.listdir(paths['pending']) if fname.endswith('.json')]
+    for fname in sorted(pending, key=lambda fname: parse_name(fname)[0]):
+        job_id, attempts, _ = parse_name(fname)
+        claim = os.path.join(paths['claimed'], f'{job_id}@{attempts + 1}@{worker_id}.json')
+        try:
+            os.rename(os.path.join(paths['pending'], fname), claim)
+        except FileNotFoundError:
+            continue  # Claimed by another worker
+        return claim
+    return None
+
+
+class Heartbeat:
+    """ Touch a claim every interval seconds while the job runs. """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True
+                return
+
+    def __enter__(self):
+        os.utime(self.path)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def run_claim(directory, claim, heartbeat=30, cache_dir=None, verbose=True):
+    """ Run a claimed job and move it to done or failed. Returns the response. """
+    from .server import run_job
+    paths = queue_paths(directory)
+    job_id, _, _ = parse_name(os.path.basename(claim))
+    job = read_json(claim)
+    job.setdefault('output', os.path.join(os.path.abspath(paths['results']), f'{job_id}.npz'))
+
+    beg = time.time()
+    with Heartbeat(claim, heartbeat) as beat:
+        response = run_job(job, cache_dir)
+    if response['status'] == 'ok':
+        from .read_input import ArmaParam
+        response['model_order'] = response.get('final_order', ArmaParam.from_dict(job.get('param', {})).model_order)
+    response['elapsed'] = round(time.time() - beg, 3)
+    write_json(os.path.join(paths['results'], f'{job_id}.json'), response)
+
+    state = 'done' if response['status'] == 'ok' else 'failed'
+    try:
+        os.rename(claim, os.path.join(paths[state], f'{job_id}.json'))
+    except FileNotFoundError:
+        beat.lost = True
+    if verbose:
+        lost = ' (claim was reclaimed)' if beat.lost else ''
+        print(f'{job_id}: {response["status"]} in {response["elapsed"]} s{lost}', flush=True)
+    return response
+
+
+def queue_status(directory):
+    """ Number of jobs in each state of the queue. """
+    paths = queue_paths(directory)
+    return {state: sum(fname.endswith('.json') for fname in os.listdir(paths[state]))
+            for state in STATES if state != 'results'}
+
+
+def run_worker(directory, worker_id=None, cache_dir=None, heartbeat=30, stale_after=300,
+               max_attempts=3, max_jobs=None, wait=False, poll=10, verbose=True):
+    """ Run jobs of the queue until it is empty, or forever if wait.
+        A worker only stops when no job is claimed either, so the jobs of
+        crashed workers are run by the last ones standing. Returns the
+        number of jobs run.   """
+    if stale_after <= heartbeat:
+        raise ValueError('stale_after must be longer than heartbeat')
+    worker_id = worker_id or default_worker_id()
+    if '@' in worker_id:
+        raise ValueError(f'Invalid worker id {worker_id!r}')
+    from .server import warm_up
+    warm_up()
+
+    num_jobs = 0
+    while max_jobs is None or num_jobs < max_jobs:
+        reclaim_stale(directory, stale_after, max_attempts)
+        claim = claim_job(directory, worker_id)
+        if claim is not None:
+            run_claim(directory, claim, heartbeat, cache_dir, verbose)
+            num_jobs += 1
+            continue
+        status = queue_status(directory)
+        if not wait and status['pending'] == 0 and status['claimed'] == 0:
+            break
+        time.sleep(poll)
+    return num_jobs
+
+
+def run_workers(directory, workers=None, **kwargs):
+    """ Run workers processes of run_worker on this node. Returns the number of jobs run. """
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return run_worker(directory, **kwargs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_worker, directory, **kwargs) for _ in range(workers)]
+        return sum(future.result() for future in futures)
+
+
+def collect_results(directory, summary=None):
+    """ Responses of the finished jobs, sorted by id. If summary is given,
+        also write them as a table with the columns of hvarma.batch. """
+    paths = queue_paths(directory)
+    rows = [read_json(os.path.join(paths['results'], fname))
+            for fname in sorted(os.listdir(paths['results'])) if fname.endswith('.json')]
+    if summary is not None:
+        from .batch import SUMMARY_FIELDS, write_summary
+        write_summary([{'station': row['id'], **{key: row.get(key, '') for key in SUMMARY_FIELDS[1:]}}
+                       for row in rows], summary)
+    return rows
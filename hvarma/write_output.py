@@ -14,6 +14,12 @@ def progress_bar(size, wsize, overlap, maxwin, file=sys.stdout):
          Usage call: next(progress_bar_object).     Yields the current window number.   """
     assert wsize > overlap, "Window size must be larger than overlap"
 
+    nwin = min((size - overlap) // (wsize - overlap), maxwin)
+    yield from window_progress(nwin, file=file)
+
+
+def window_progress(nwin, file=sys.stdout):
+    """ Progress bar generator for a known number of windows. See progress_bar. """
     start = time.time()
 
     def show(j):  # Print or update progress bar on screen
@@ -24,8 +30,6 @@ def progress_bar(size, wsize, overlap, maxwin, file=sys.stdout):
                    ('Progress: ', "#" * x, "." * (30 - x), j, nwin, time_left))
         file.flush()
 
-    nwin = min((size - overlap) // (wsize - overlap), maxwin)
-
     for i in range(1, nwin):
         show(i)
         yield i
@@ -117,14 +121,15 @@ def plot_hvratio(param, results, format='png', write=True):
 
 
 def write_data(freqs, spectrum, low_err, up_err, coherence, filename='out.txt'):
-    """ Write processed data in a text file. """
+    """ Write processed data in a text file, each value in its shortest
+        representation. Use write_binary_results to keep all the results. """
+    table = np.column_stack((freqs, spectrum, low_err, up_err, coherence)).tolist()
     with open(filename, 'w') as f:
-        print('Frequency', 'H/V', 'Low_err', 'Upp_err', 'Coherence', file=f, sep=' ')
-        for freq, spec, low, up, coh in zip(freqs, spectrum, low_err, up_err, coherence):
-            print(freq, spec, low, up, coh, file=f, sep=' ')
+        f.write('Frequency H/V Low_err Upp_err Coherence\n')
+        f.write(''.join(' '.join(map(str, row)) + '\n' for row in table))
 
 
-def write_results(data, param, results):
+def write_results(data, param, results, binary=False):
     outfile = generate_filename(param.output_dir, data.station,
                                 param.model_order, results.num_windows)
     err = param.plot_conf / 2
@@ -135,6 +140,98 @@ def write_results(data, param, results):
                results.get_spectrum_percentile(50 + err),
                results.get_coherence_percentile(50), outfile + '.txt')
 
+    if binary:
+        write_binary_results(results, outfile + '.npz')
+
+
+COVARIANCE_NAMES = ('auto_cov_x', 'auto_cov_v', 'cross_cov_v_zx', 'cross_cov_zx_v')
+
+
+def write_binary_results(results, filename='out.npz'):
+    """ Write all the per-window results in an uncompressed npz file,
+        including the window models (coefficients and covariances).
+        Arrays are stored as .npy members so they can be memory mapped. """
+    import json
+    arrays = {}
+    if results.screening is not None:
+        screening = results.screening
+        arrays = {'screening_' + name: np.asarray(getattr(screening, name))
+                  for name in ['starts', 'sta_lta', 'rms', 'kurtosis', 'clipping', 'reasons']}
+    if getattr(results, 'covariances', None) is not None:
+        for name, cov in zip(COVARIANCE_NAMES, results.covariances):
+            arrays[name] = cov
+    np.savez(filename,
+             freqs=results.get_frequencies(),
+             spectra=results.spectra,
+             coherence=results.coherence,
+             AIC=results.AIC,
+             a=results.a,
+             b=results.b,
+             param=np.array(json.dumps(results.param.get_dict())),
+             station=np.array(results.station),
+             sampling_rate=np.array(results.sampling_rate),
+             decimation=np.array(results.decimation),
+             **arrays)
+
+
+def load_npz(filename, mmap=True):
+    """ Load the arrays of an npz file. Uncompressed members are
+        memory mapped in place (read-only) if mmap is set.  """
+    import struct
+    import zipfile
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as file:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # Skip the local file header to reach the .npy member
+            file.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', file.read(30)[26:30])
+            file.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(file)
+
+            if dtype.hasobject or len(shape) == 0 or 0 in shape:
+                file.seek(info.header_offset + 30 + name_len + extra_len)
+                arrays[name] = np.lib.format.read_array(file)
+            else:
+                arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=file.tell(),
+                                         shape=shape, order='F' if fortran else 'C')
+    return arrays
+
+
+def read_binary_results(filename, mmap=True):
+    """ Read results written by write_binary_results into an AverageData. """
+    import json
+    from .processing import AverageData
+    from .read_input import ArmaParam
+    from .preprocessing import WindowScreening
+    arrays = load_npz(filename, mmap=mmap)
+    param = ArmaParam.from_dict(json.loads(str(arrays['param'])))
+
+    screening = None
+    if 'screening_starts' in arrays:
+        screening = WindowScreening(arrays['screening_starts'], arrays['screening_sta_lta'],
+                                    arrays['screening_rms'], arrays['screening_kurtosis'],
+                                    arrays['screening_clipping'],
+                                    [str(reason) for reason in arrays['screening_reasons']])
+
+    covariances = None
+    if all(name in arrays for name in COVARIANCE_NAMES):
+        covariances = tuple(arrays[name] for name in COVARIANCE_NAMES)
+
+    return AverageData.from_arrays(param, str(arrays['station']), float(arrays['sampling_rate']),
+                                   arrays['spectra'], arrays['coherence'], arrays['AIC'],
+                                   arrays['a'], arrays['b'], decimation=int(arrays['decimation']),
+                                   screening=screening, covariances=covariances)
+
 
 def plot_search_iterations(orders, found_p, stat_name, tol=0.1, output_dir='.'):
     """ Create relevant plots for the hvarma order finder algorithm. """
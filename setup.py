@@ -12,11 +12,12 @@ setup (name = 'hvarma',
        packages=['hvarma', 'hvarma.ext_c'],
        ext_modules = [cmodule],
        install_requires=[
-        'numpy>=1.19.0',
+        'numpy>=1.20.0',
         'scipy>=1.5.1',
         'obspy>=1.2.2',
         'matplotlib>=3.3.0',
         'pytest'
         ],
         include_package_data=True,
+        entry_points={'console_scripts': ['hvarma=hvarma.__main__:main']},
 )
\ No newline at end of file
@@ -0,0 +1,87 @@
+# file to test the asynchronous api
+import unittest
+import asyncio
+from numpy.testing import assert_array_almost_equal
+from helpers import random_walk, small_param
+
+
+class AsyncRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(4, 5000)
+        self.param = small_param(max_windows=30)
+
+    def test_run_model(self):
+        from hvarma import Data, run_model
+        from hvarma.aio import run_model_async, ProgressStream
+
+        async def main():
+            progress = ProgressStream()
+            task = asyncio.create_task(run_model_async(Data(*self.arrays, 100, 'SYN'), self.param,
+                                                       batch_windows=8, progress=progress))
+            events = [event async for event in progress]
+            return await task, events
+
+        results, events = asyncio.run(main())
+        expected = run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False)
+        self.assertEqual(results.num_windows, 30)
+        assert_array_almost_equal(results.spectra, expected.spectra)
+        assert_array_almost_equal(results.coherence, expected.coherence)
+        assert_array_almost_equal(results.AIC, expected.AIC)
+        self.assertListEqual([event.done for event in events], [8, 16, 24, 30])
+        self.assertTrue(all(event.total == 30 for event in events))
+
+    def test_cancel(self):
+        from hvarma import Data
+        from hvarma.aio import run_model_async, ProgressStream
+
+        async def main():
+            progress = ProgressStream()
+            task = asyncio.create_task(run_model_async(Data(*self.arrays, 100, 'SYN'), self.param,
+                                                       batch_windows=2, progress=progress))
+            async for event in progress:
+                task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return event
+
+        event = asyncio.run(main())
+        self.assertLess(event.done, 30)
+
+    def test_limiter(self):
+        from hvarma import Data
+        from hvarma.aio import run_model_async
+        active, peak = [0], [0]
+
+        class Limiter(asyncio.Semaphore):
+            async def __aenter__(self):
+                await super().__aenter__()
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+
+            async def __aexit__(self, *args):
+                active[0] -= 1
+                await super().__aexit__(*args)
+
+        async def main():
+            limiter = Limiter(2)
+            param = self.param.update({'max_windows': 4})
+            return await asyncio.gather(*[run_model_async(Data(*self.arrays, 100, 'SYN'), param, limiter=limiter)
+                                          for _ in range(5)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(results), 5)
+        self.assertEqual(peak[0], 2)
+
+    def test_find_optimal_order(self):
+        from hvarma import Data, find_optimal_order
+        from hvarma.aio import find_optimal_order_async
+        param = self.param.update({'max_windows': 10})
+        results = asyncio.run(find_optimal_order_async(Data(*self.arrays, 100, 'SYN'), param))
+        expected = find_optimal_order(Data(*self.arrays, 100, 'SYN'), param)
+        self.assertEqual(results.final_order, expected.final_order)
+        self.assertListEqual(list(results.order_results), list(expected.order_results))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,6 +1,7 @@
 # file to test the module api calls from the end user
 import unittest
-from numpy.testing import assert_array_almost_equal
+from numpy.testing import assert_array_almost_equal, assert_allclose, assert_array_equal
+from helpers import random_walk, small_param
 
 
 class RunModelTest(unittest.TestCase):
@@ -81,5 +82,387 @@ class BinarySearchTest(unittest.TestCase):
         self.assertEqual(search_results.final_order, 49)
 
 
+class DecimationTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma import Data, ArmaParam
+        self.data = Data.from_sac('test/resources/B001_Z.sac', 'test/resources/B001_N.sac', 'test/resources/B001_E.sac')
+        self.param = ArmaParam.from_dict({
+            'model_order': 10,
+            'maxtau': 64,
+            'neg_freq': -10,
+            'pos_freq': 10,
+            'freq_points': 1000,
+            'window_size': 512,
+            'overlap': 256,
+            'max_windows': 100
+        })
+
+    def test_parameters(self):
+        from hvarma.preprocessing import decimation_factor, effective_parameters
+        self.assertEqual(decimation_factor(100, -10, 10, 1.25), 4)
+        self.assertEqual(decimation_factor(100, -20, 5, 1.25), 2)
+        self.assertEqual(decimation_factor(100, -40, 40, 1.25), 1)
+        param = effective_parameters(self.data, self.param.update({'decimate': 1}))
+        self.assertEqual(param.window_size, 128)
+        self.assertEqual(param.overlap, 64)
+        self.assertEqual(param.maxtau, 16)
+        self.assertEqual(param.nfir, 16)
+
+    def test_frequencies(self):
+        from hvarma import run_model
+        results = run_model(self.data, self.param, verbose=False)
+        decimated = run_model(self.data, self.param.update({'decimate': 1}), verbose=False)
+        self.assertEqual(decimated.decimation, 4)
+        self.assertAlmostEqual(decimated.sampling_rate, 25)
+        pos_freq, pos_err, neg_freq, neg_err = results.get_frequency(20)
+        dec_pos_freq, dec_pos_err, dec_neg_freq, dec_neg_err = decimated.get_frequency(20)
+        self.assertAlmostEqual(pos_freq, dec_pos_freq, delta=max(pos_err, dec_pos_err))
+        self.assertAlmostEqual(neg_freq, dec_neg_freq, delta=max(neg_err, dec_neg_err))
+
+
+class DecimationDefaultsTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma import ArmaParam
+        from hvarma.synthetic import SyntheticModel, synthetic_data
+        self.model = SyntheticModel.from_resonances([2.5], 0.05, 200)
+        self.data = synthetic_data(self.model, 600, seed=3)
+        self.param = ArmaParam().update({'decimate': 1, 'neg_freq': -10, 'pos_freq': 10, 'max_windows': 200})
+
+    def test_model_order(self):
+        from hvarma import run_model
+        from hvarma.preprocessing import effective_parameters
+        param = effective_parameters(self.data, self.param)
+        self.assertEqual(param.window_size, 64)
+        self.assertEqual(param.maxtau, 16)
+        self.assertEqual(param.model_order, 16)
+
+        results = run_model(self.data, self.param, verbose=False)
+        self.assertEqual(results.decimation, 8)
+        pos_freq, _, neg_freq, _ = results.get_frequency(self.param.freq_conf)
+        true_pos, true_neg = self.model.true_peaks(-10, 10)
+        self.assertLess(abs(pos_freq - true_pos), 0.1)
+        self.assertLess(abs(neg_freq - true_neg), 0.1)
+
+
+class ScreeningTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        from hvarma import Data, ArmaParam
+        rng = np.random.default_rng(0)
+        dataZ, dataN, dataE = rng.standard_normal((3, 20000))
+        dataZ[3000:3040] += 30            # Transient
+        dataN[8000:8300] = 10             # Clipped record
+        dataE[12000:12512] *= 20          # Amplitude outlier
+        self.data = Data(dataZ, dataN, dataE, 100, 'SYN')
+        self.param = ArmaParam.from_dict({'model_order': 6, 'maxtau': 16, 'nfir': 8,
+                                          'window_size': 512, 'overlap': 256,
+                                          'freq_points': 100, 'screen': 1})
+
+    def test_screening(self):
+        from hvarma.preprocessing import screen_windows
+        screening = screen_windows(self.data, self.param)
+        skipped = screening.skipped()
+        self.assertEqual(len(screening.starts), 77)
+        self.assertIn('sta_lta', skipped[2816])
+        self.assertIn('kurtosis', skipped[2816])
+        self.assertIn('clipping', skipped[7936])
+        self.assertIn('rms', skipped[12032])
+        self.assertNotIn(0, skipped)
+
+    def test_run_model(self):
+        from hvarma import run_model
+        results = run_model(self.data, self.param, verbose=False)
+        self.assertEqual(results.num_windows, 77 - len(results.screening.skipped()))
+        self.assertEqual(results.spectra.shape, (results.num_windows, 100))
+
+    def test_short_windows(self):
+        import numpy as np
+        from hvarma import Data, run_model
+        from hvarma.preprocessing import screen_windows
+        data = Data(*np.random.default_rng(1).standard_normal((3, 20000)), 100, 'SYN')
+        param = self.param.update({'window_size': 64, 'overlap': 32, 'maxtau': 16, 'max_windows': 500})
+        screening = screen_windows(data, param)
+        self.assertEqual(np.count_nonzero(screening.clipping), 0)
+        self.assertLess(len(screening.skipped()), len(screening.starts) // 20)
+        results = run_model(data, param, verbose=False)
+        self.assertGreater(results.num_windows, 0)
+
+        dataN = data.dataN.copy()
+        dataN[1000:1003] = dataN.max() + 1
+        screening = screen_windows(Data(data.dataZ, dataN, data.dataE, 100, 'SYN'), param)
+        self.assertIn('clipping', screening.skipped()[992])
+
+
+class ModelEvaluationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(6, 6000)
+        self.param = small_param(model_order=6, max_windows=30)
+
+    def test_evaluate(self):
+        import os
+        import tempfile
+        from hvarma import Data, run_model, read_binary_results
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'models.npz')
+            run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False, save_models=filename)
+            models = read_binary_results(filename)
+            results = models.evaluate(neg_freq=-5, pos_freq=8, freq_points=77)
+
+        param = self.param.update({'neg_freq': -5, 'pos_freq': 8, 'freq_points': 77})
+        expected = run_model(Data(*self.arrays, 100, 'SYN'), param, verbose=False)
+        self.assertEqual(results.param, param)
+        assert_array_almost_equal(results.spectra, expected.spectra)
+        assert_array_almost_equal(results.coherence, expected.coherence)
+        self.assertEqual(results.get_frequency(20), expected.get_frequency(20))
+
+    def test_wrong_parameter(self):
+        from hvarma import Data, run_model
+        results = run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False)
+        with self.assertRaises(AttributeError):
+            results.evaluate(model_order=10)
+
+    def test_data_unchanged(self):
+        from hvarma import Data, run_model
+        data = Data(*self.arrays, 100, 'SYN')
+        results = run_model(data, self.param, verbose=False)
+        for comp, array in zip((data.dataZ, data.dataN, data.dataE), self.arrays):
+            assert_array_equal(comp, array)
+        # Windows do not depend on the previous ones
+        later = run_model(Data(*self.arrays[:, 1280:], 100, 'SYN'), self.param.update({'max_windows': 10}),
+                          verbose=False)
+        assert_array_equal(later.spectra, results.spectra[10:20])
+        assert_array_equal(later.AIC, results.AIC[10:20])
+        parallel = run_model(data, self.param, verbose=False, backend='threads', workers=2, batch_windows=4)
+        assert_array_equal(parallel.spectra, results.spectra)
+        assert_array_equal(parallel.AIC, results.AIC)
+
+
+class WeightSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(7, 5000)
+        self.param = small_param()
+
+    def test_sweep(self):
+        from hvarma import Data, run_model, sweep_weights
+        weights = [(0.5, 0.5), (1, 0), (0.2, 0.8)]
+        sweep = sweep_weights(Data(*self.arrays, 100, 'SYN'), self.param, weights)
+        self.assertListEqual(list(sweep), [(0.5, 0.5), (1.0, 0.0), (0.2, 0.8)])
+        for mu, nu in weights[1:]:
+            expected = run_model(Data(*self.arrays, 100, 'SYN'), self.param.update({'mu': mu, 'nu': nu}),
+                                 verbose=False)
+            results = sweep[(mu, nu)]
+            self.assertEqual(results.param.mu, mu)
+            assert_array_almost_equal(results.spectra, expected.spectra)
+            assert_array_almost_equal(results.coherence, expected.coherence)
+            assert_allclose(results.AIC, expected.AIC, rtol=1e-7)
+
+
+class DirectionalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(11, 5000)
+        self.param = small_param()
+
+    def test_rotated_traces(self):
+        import numpy as np
+        from hvarma import Data, run_model, run_directional
+        dataZ, dataN, dataE = self.arrays
+        azimuths = [0, 30, 90, 135]
+        directional = run_directional(Data(*self.arrays, 100, 'SYN'), self.param, azimuths)
+        self.assertListEqual(list(directional), [0., 30., 90., 135.])
+        for az in azimuths:
+            theta = np.deg2rad(az)
+            rotated = Data(dataZ, dataN * np.cos(theta) + dataE * np.sin(theta), np.zeros_like(dataE), 100, 'SYN')
+            expected = run_model(rotated, self.param, verbose=False)
+            results = directional[az]
+            assert_array_almost_equal(results.spectra, expected.spectra)
+            assert_array_almost_equal(results.coherence, expected.coherence)
+            assert_allclose(results.AIC, expected.AIC, rtol=1e-7)
+            assert_array_almost_equal(results.evaluate().spectra, expected.spectra)
+
+
+class PreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(5, 5000)
+        self.param = small_param()
+
+    def test_single_window(self):
+        from hvarma import Data, run_model
+        param = self.param.update({'max_windows': 1})
+        expected = run_model(Data(*self.arrays, 100, 'SYN'), param, verbose=False)
+        preview = run_model(Data(*self.arrays, 100, 'SYN'), param, verbose=False, preview=True)
+        self.assertEqual(preview.num_windows, 1)
+        assert_array_almost_equal(preview.spectrum, expected.spectra[0])
+        assert_array_almost_equal(preview.coherence, expected.coherence[0])
+
+    def test_averaged_covariances(self):
+        import numpy as np
+        from hvarma import Data, run_model
+        from hvarma.compute import compute_autocovariance, compute_crosscovariance, compute_coherence
+        data = Data(*self.arrays, 100, 'SYN')
+        preview = run_model(data, self.param, verbose=False, preview=True)
+        self.assertEqual(preview.num_windows, 20)
+
+        covs = []
+        for idx in range(20):
+            start = idx * 128
+            dataZ, dataN, dataE = (comp[start:start + 256] - comp[start:start + 256].mean()
+                                   for comp in self.arrays)
+            covs.append(compute_autocovariance(dataE, dataN, dataZ, 256, 32)
+                        + compute_crosscovariance(dataE, dataN, dataZ, 256, 32)[::-1])
+        auto_cov_x, auto_cov_v, cross_cov_zx_v, cross_cov_v_zx = (np.mean(cov, axis=0) for cov in zip(*covs))
+        coherence = compute_coherence(auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v,
+                                      16, -20, 20, 200, 0.01)
+        assert_array_almost_equal(preview.coherence, coherence)
+        pos_freq, pos_err, neg_freq, neg_err = preview.get_frequency()
+        self.assertEqual(pos_err, 0)
+        self.assertEqual(pos_freq, preview.get_frequencies()[np.argmax(np.where(preview.get_frequencies() > 0,
+                                                                                preview.spectrum, -np.inf))])
+
+
+class MultifidelityOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        from scipy.signal import lfilter
+        rng = np.random.default_rng(2)
+        w = 2 * np.pi * 5 / 100
+        resonance = [1, -1.9 * np.cos(w), 0.95 ** 2]
+        dataZ = rng.standard_normal(6000)
+        dataN = lfilter([1], resonance, dataZ) + 0.3 * rng.standard_normal(6000)
+        dataE = lfilter([1], resonance, rng.standard_normal(6000))
+        self.arrays = (dataZ, dataN, dataE)
+        self.param = small_param(max_windows=100)
+
+    def test_stratified_windows(self):
+        from hvarma import Data
+        from hvarma.running import stratified_windows
+        subset, param = stratified_windows(Data(*self.arrays, 100, 'SYN'), self.param, 10)
+        self.assertEqual(param.overlap, 0)
+        self.assertEqual(param.max_windows, 10)
+        self.assertEqual(subset.size, 10 * 256 + 1)
+        assert_array_almost_equal(subset.dataZ[:256], self.arrays[0][:256])
+        assert_array_almost_equal(subset.dataZ[-257:-1], self.arrays[0][44 * 128:44 * 128 + 256])
+
+    def test_search(self):
+        from hvarma import Data, find_optimal_order
+        from hvarma.running import get_difference, convergence_condition
+        results = find_optimal_order(Data(*self.arrays, 100, 'SYN'), self.param, method='multifidelity')
+        fast = find_optimal_order(Data(*self.arrays, 100, 'SYN'), self.param, method='fast')
+        self.assertEqual(results.method, 'multifidelity')
+        self.assertTrue(results.success)
+        self.assertIn(results.screening_order, results.screening_results)
+        order = results.final_order
+        self.assertEqual(order, fast.final_order)
+        self.assertTrue(convergence_condition(*get_difference(results.order_results[order],
+                                                              results.order_results[order - 3]), 0.05))
+        self.assertEqual(results.order_results[order].num_windows, 45)
+
+    def test_synthetic(self):
+        from hvarma import ArmaParam, find_optimal_order
+        from hvarma.running import get_difference, convergence_condition
+        from hvarma.synthetic import SyntheticModel, synthetic_data
+        param = ArmaParam.from_dict({'maxtau': 64, 'nfir': 16, 'window_size': 256, 'overlap': 128,
+                                     'freq_points': 200, 'max_windows': 100, 'neg_freq': -10, 'pos_freq': 10})
+        for resonances, seed in [([1.0, 4.0], 0), ([6.0], 1), ([6.0], 0)]:
+            model = SyntheticModel.from_resonances(resonances, 0.05, 100)
+            results = find_optimal_order(synthetic_data(model, 140, seed=seed), param, method='multifidelity')
+            fast = find_optimal_order(synthetic_data(model, 140, seed=seed), param, method='fast')
+            order = results.final_order
+            self.assertEqual(order, fast.final_order, (resonances, seed))
+            self.assertTrue(convergence_condition(*get_difference(results.order_results[order],
+                                                                  results.order_results[order - 3]), 0.05))
+
+
+class BootstrapTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma import Data, run_model
+        arrays = random_walk(9, 5000)
+        param = small_param()
+        self.results = run_model(Data(*arrays, 100, 'SYN'), param, verbose=False)
+
+    def test_reproducible(self):
+        boot = self.results.bootstrap_frequency(200, seed=1)
+        self.assertEqual(len(boot.pos_peaks), 200)
+        same = self.results.bootstrap_frequency(200, seed=1, max_bytes=10**5, n_jobs=3)
+        assert_array_almost_equal(boot.pos_peaks, same.pos_peaks)
+        assert_array_almost_equal(boot.neg_peaks, same.neg_peaks)
+        other = self.results.bootstrap_frequency(200, seed=2)
+        self.assertFalse(all(boot.pos_peaks == other.pos_peaks) and all(boot.neg_peaks == other.neg_peaks))
+
+    def test_resample(self):
+        import numpy as np
+        boot = self.results.bootstrap_frequency(1, seed=3)
+        rng = np.random.default_rng(np.random.SeedSequence(3).spawn(1)[0])
+        index = rng.integers(0, 20, size=20)
+        freq = self.results.get_frequencies()
+        median = np.percentile(self.results.spectra[index], 50, axis=0)
+        self.assertEqual(boot.pos_peaks[0], freq[freq > 0][np.argmax(median[freq > 0])])
+        self.assertEqual(boot.neg_peaks[0], freq[freq < 0][np.argmax(median[freq < 0])])
+
+    def test_interval(self):
+        boot = self.results.bootstrap_frequency(300, conf=90, seed=0)
+        pos_freq, pos_err, neg_freq, neg_err = boot.get_frequency()
+        self.assertEqual(pos_freq, self.results.get_frequency(20)[0])
+        low, upp = boot.pos_interval
+        self.assertLessEqual(low, upp)
+        self.assertAlmostEqual(pos_err, max(upp - pos_freq, pos_freq - low))
+
+
+class TimelapseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(10, 6000)
+        self.param = small_param(max_windows=100)
+
+    def test_segments(self):
+        import numpy as np
+        from hvarma import Data, run_model, run_timelapse
+        from hvarma.processing import peak_frequency
+        timelapse = run_timelapse(Data(*self.arrays, 100, 'SYN'), self.param, 20, 10, backend='serial')
+        results = run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False)
+        assert_allclose(timelapse.times, [0, 10, 20, 30, 40])
+        self.assertEqual(timelapse.spectra.shape, (5, 200))
+
+        freq = results.get_frequencies()
+        for seg, start in enumerate(range(0, 5000, 1000)):
+            index = [k for k in range(results.num_windows) if start <= 128 * k <= start + 2000 - 256]
+            self.assertEqual(timelapse.num_windows[seg], len(index))
+            assert_allclose(timelapse.spectra[seg], np.percentile(results.spectra[index], 50, axis=0))
+            assert_allclose(timelapse.coherence[seg], np.percentile(results.coherence[index], 50, axis=0))
+            peaks = peak_frequency(results.spectra[index], freq, self.param.freq_conf)
+            self.assertEqual(tuple(arr[seg] for arr in timelapse.get_frequency()), peaks)
+
+    def test_parallel(self):
+        from hvarma import Data, run_timelapse
+        serial = run_timelapse(Data(*self.arrays, 100, 'SYN'), self.param, 20, 10, backend='serial')
+        for backend in ('threads', 'processes'):
+            parallel = run_timelapse(Data(*self.arrays, 100, 'SYN'), self.param, 20, 10, workers=3,
+                                     batch_windows=4, backend=backend)
+            assert_allclose(serial.spectra, parallel.spectra)
+            assert_allclose(serial.pos_freq, parallel.pos_freq)
+
+    def test_empty_segment(self):
+        import numpy as np
+        from hvarma import Data, run_timelapse
+        timelapse = run_timelapse(Data(*self.arrays, 100, 'SYN'), self.param, 2.56, 0.64, backend='serial')
+        assert_allclose(timelapse.num_windows[:3], [1, 0, 1])
+        for values in (timelapse.spectra, *timelapse.get_frequency()):
+            self.assertFalse(np.isnan(values[0]).any())
+            self.assertTrue(np.isnan(values[1]).all())
+
+    def test_short_segment(self):
+        from hvarma import Data, run_timelapse
+        with self.assertRaises(ValueError):
+            run_timelapse(Data(*self.arrays, 100, 'SYN'), self.param, 1)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
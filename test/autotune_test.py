@@ -0,0 +1,129 @@
+# file to test the backends of run_model and the auto-tuner
+import os
+import unittest
+import tempfile
+from unittest import mock
+from helpers import save_components, small_param
+
+
+class Interrupted(Exception):
+    pass
+
+
+class AutotuneTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma.synthetic import SyntheticModel, synthetic_data
+        self.model = SyntheticModel.from_resonances([2.5], 0.05, 100)
+        self.data = lambda: synthetic_data(self.model, 60, seed=0)
+        self.param = small_param(max_windows=30)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_backends(self):
+        from numpy.testing import assert_array_equal
+        from hvarma import run_model
+        expected_data = self.data()
+        expected = run_model(expected_data, self.param, verbose=False, backend='serial')
+        for backend, batch_windows in (('threads', 4), ('threads', 7), ('processes', 16)):
+            data = self.data()
+            results = run_model(data, self.param, verbose=False, backend=backend, workers=2,
+                                batch_windows=batch_windows)
+            self.assertEqual(results.num_windows, expected.num_windows)
+            for field in ('spectra', 'coherence', 'AIC', 'a', 'b'):
+                assert_array_equal(getattr(results, field), getattr(expected, field))
+            assert_array_equal(data.dataZ, expected_data.dataZ)
+        with self.assertRaises(ValueError):
+            run_model(self.data(), self.param, verbose=False, backend='gpu')
+
+    def test_checkpoint(self):
+        from numpy.testing import assert_array_equal
+        from hvarma import running, run_model
+        from hvarma.checkpoint import Checkpoint
+        expected = run_model(self.data(), self.param, verbose=False)
+        checkpoint = Checkpoint(self.tmpdir.name, every=4)
+        solve_windows = running.solve_windows
+        count = [0]
+
+        def interrupted(windows, param):
+            count[0] += 1
+            if count[0] > 3:
+                raise Interrupted
+            return solve_windows(windows, param)
+        with mock.patch.object(running, 'solve_windows', interrupted), self.assertRaises(Interrupted):
+            run_model(self.data(), self.param, verbose=False, checkpoint=checkpoint,
+                      backend='threads', workers=1, batch_windows=3)
+        chunks = os.listdir(checkpoint.window_dir)
+        self.assertEqual(len(os.listdir(os.path.join(checkpoint.window_dir, chunks[0]))), 2)
+
+        results = run_model(self.data(), self.param, verbose=False, checkpoint=checkpoint,
+                            backend='threads', workers=2, batch_windows=4)
+        assert_array_equal(results.spectra, expected.spectra)
+        assert_array_equal(results.AIC, expected.AIC)
+
+    def test_profile(self):
+        from hvarma.autotune import autotune, load_profile, choose_backend, profile_path, Backend
+        self.assertEqual(choose_backend(self.param, cache_dir=self.tmpdir.name), Backend('serial', 1, 1))
+        profile = autotune(self.tmpdir.name, params=[{'window_size': 256, 'maxtau': 32, 'model_order': 8,
+                                                      'nfir': 16, 'freq_points': 200}],
+                           workers=[2], batch_sizes=(4,), num_windows=8, repeat=1)
+        self.assertTrue(os.path.exists(profile_path(self.tmpdir.name)))
+        self.assertEqual(len(profile.entries), 1)
+        entry = profile.entries[0]
+        self.assertIn(entry['backend'], ('serial', 'threads', 'processes'))
+        self.assertGreaterEqual(entry['throughput'], entry['serial_throughput'])
+        self.assertEqual(load_profile(self.tmpdir.name).to_dict(), profile.to_dict())
+
+        entry.update({'backend': 'threads', 'workers': 1, 'batch_windows': 5})
+        with mock.patch('hvarma.autotune.load_profile', return_value=profile):
+            self.assertEqual(choose_backend(self.param.update({'model_order': 10})), Backend('threads', 1, 5))
+            self.assertEqual(choose_backend(self.param, batch_windows=2), Backend('threads', 1, 2))
+            self.assertEqual(choose_backend(self.param, 'serial'), Backend())
+
+    def test_pooled_callers(self):
+        from hvarma import running, find_optimal_order
+        from hvarma.autotune import Profile, save_profile
+        from hvarma.server import run_job
+        entry = {'window_size': 256, 'maxtau': 32, 'model_order': 8, 'freq_points': 200, 'backend': 'threads',
+                 'workers': 2, 'batch_windows': 4, 'throughput': 2., 'serial_throughput': 1.}
+        save_profile(Profile([entry], 2), self.tmpdir.name)
+        data = self.data()
+        files = save_components((data.dataZ, data.dataN, data.dataE), self.tmpdir.name)
+        job = dict(id=1, format='npy', sampling_rate=100, station='SYN', param=self.param.get_dict(), **files)
+
+        pools = []
+        solve_parallel = running.solve_parallel
+
+        def record(windows, param, backend, *args):
+            pools.append(backend.pool)
+            return solve_parallel(windows, param, backend, *args)
+        with mock.patch.dict(os.environ, {'HVARMA_CACHE_DIR': self.tmpdir.name}), \
+                mock.patch.object(running, 'solve_parallel', record):
+            find_optimal_order(self.data(), self.param)
+            self.assertGreater(len(pools), 2)
+            self.assertEqual(len(set(map(id, pools))), 1)
+            pools.clear()
+            self.assertEqual(run_job(job)['status'], 'ok')
+            self.assertEqual(run_job(dict(job, order_search=True))['status'], 'ok')
+            self.assertListEqual(pools, [])
+
+    def test_workers_serial(self):
+        from concurrent.futures import ProcessPoolExecutor
+        from hvarma.autotune import Profile, Backend, save_profile, choose_backend
+        entry = {'window_size': 256, 'maxtau': 32, 'model_order': 8, 'freq_points': 200, 'backend': 'threads',
+                 'workers': 1, 'batch_windows': 4, 'throughput': 2., 'serial_throughput': 1.}
+        save_profile(Profile([entry], 1), self.tmpdir.name)
+        with mock.patch.dict(os.environ, {'HVARMA_CACHE_DIR': self.tmpdir.name}):
+            self.assertEqual(choose_backend(self.param), Backend('threads', 1, 4))
+            with Backend('threads', 1, 4) as backend:
+                self.assertEqual(choose_backend(self.param), Backend())
+                self.assertIs(backend.pool.submit(choose_backend, self.param, backend).result(), backend)
+            self.assertEqual(choose_backend(self.param), Backend('threads', 1, 4))
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                self.assertEqual(pool.submit(choose_backend, self.param).result(), Backend())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# file to test the batch processing of stations
+import os
+import csv
+import unittest
+import tempfile
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def touch(self, *parts):
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        return path
+
+    def test_discover(self):
+        from hvarma.batch import discover_triplets
+        for comp in 'ZNE':
+            self.touch('net', f'B001_{comp}.sac')
+            self.touch('net', 'sub', f'XX.STA..HH{comp}.SAC')
+        self.touch('net', 'C003_Z.sac')
+        self.touch('net', 'C003_N.sac')
+        jobs = discover_triplets(self.root)
+        self.assertListEqual([job.name for job in jobs], ['B001', 'XX.STA..HH'])
+        self.assertTrue(jobs[0].Z.endswith('B001_Z.sac'))
+        self.assertTrue(jobs[1].E.endswith('XX.STA..HHE.SAC'))
+
+        for comp in 'ZNE':
+            self.touch('net', '2022', f'B001_{comp}.sac')
+        jobs = discover_triplets(self.root)
+        expected = [os.path.join('net', 'B001'), os.path.join('net', '2022', 'B001'), 'XX.STA..HH']
+        self.assertListEqual([job.name for job in jobs], expected)
+
+    def test_duplicates(self):
+        from hvarma import ArmaParam
+        from hvarma.batch import read_manifest, run_batch, StationJob
+        from hvarma.workqueue import station_job, submit_jobs
+        with open(os.path.join(self.root, 'manifest.csv'), 'w') as file:
+            file.write('station,Z,N,E\nS1,a_Z.sac,a_N.sac,a_E.sac\nS1,b_Z.sac,b_N.sac,b_E.sac\n')
+        with self.assertRaises(ValueError):
+            read_manifest(os.path.join(self.root, 'manifest.csv'))
+        jobs = [StationJob('S1', 'Z', 'N', 'E'), StationJob('S1', 'Z2', 'N2', 'E2')]
+        with self.assertRaises(ValueError):
+            run_batch(jobs, ArmaParam(), os.path.join(self.root, 'out'), verbose=False)
+        with self.assertRaises(ValueError):
+            submit_jobs(os.path.join(self.root, 'queue'), [station_job(job, ArmaParam()) for job in jobs])
+        self.assertEqual(station_job(StationJob(os.path.join('2022', 'B001'), 'Z', 'N', 'E'), ArmaParam())['id'],
+                         '2022.B001')
+
+    def test_run_batch(self):
+        import numpy as np
+        from hvarma import Data, ArmaParam, run_model
+        from hvarma.batch import read_manifest, run_batch
+        rng = np.random.default_rng(8)
+        arrays = {}
+        with open(os.path.join(self.root, 'manifest.csv'), 'w') as file:
+            file.write('station,Z,N,E,format,sampling_rate\n')
+            for name in ('S1', 'S2', 'S3'):
+                arrays[name] = rng.standard_normal((3, 3000)).cumsum(axis=1)
+                for comp, array in zip('ZNE', arrays[name]):
+                    np.save(os.path.join(self.root, f'{name}_{comp}.npy'), array)
+                file.write(f'{name},{name}_Z.npy,{name}_N.npy,{name}_E.npy,npy,100\n')
+            file.write('BAD,missing.npy,missing.npy,missing.npy,npy,100\n')
+
+        param = ArmaParam.from_dict({'model_order': 8, 'maxtau': 32, 'nfir': 16, 'window_size': 256,
+                                     'overlap': 128, 'freq_points': 200, 'max_windows': 10})
+        output_dir = os.path.join(self.root, 'out')
+        rows = run_batch(read_manifest(os.path.join(self.root, 'manifest.csv')), param, output_dir,
+                         workers=2, verbose=False)
+        self.assertListEqual([row['station'] for row in rows], ['S1', 'S2', 'S3', 'BAD'])
+        self.assertListEqual([row['status'] for row in rows], ['ok', 'ok', 'ok', 'error'])
+
+        expected = run_model(Data(*arrays['S2'], 100, 'S2'), param, verbose=False)
+        self.assertAlmostEqual(rows[1]['pos_freq'], expected.get_frequency(param.freq_conf)[0])
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'S2', 'S2_p8_win10.txt')))
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'S2', 'S2_p8_win10.npz')))
+        with open(os.path.join(output_dir, 'summary.csv')) as file:
+            summary = list(csv.DictReader(file))
+        self.assertEqual(len(summary), 4)
+        self.assertEqual(summary[3]['status'], 'error')
+
+    def test_load_in_workers(self):
+        import threading
+        import numpy as np
+        from unittest import mock
+        from hvarma import ArmaParam, batch
+        rng = np.random.default_rng(9)
+        jobs = []
+        for name in ('S1', 'S2'):
+            files = []
+            for comp, array in zip('ZNE', rng.standard_normal((3, 3000)).cumsum(axis=1)):
+                files.append(os.path.join(self.root, f'{name}_{comp}.npy'))
+                np.save(files[-1], array)
+            jobs.append(batch.StationJob(name, *files, 'npy', 100, name))
+
+        threads = []
+        load_station = batch.load_station
+
+        def record(job):
+            threads.append(threading.current_thread())
+            return load_station(job)
+        param = ArmaParam.from_dict({'model_order': 8, 'maxtau': 32, 'nfir': 16, 'window_size': 256,
+                                     'overlap': 128, 'freq_points': 200, 'max_windows': 10})
+        with mock.patch.object(batch, 'load_station', record):
+            rows = batch.run_batch(jobs, param, os.path.join(self.root, 'out'), workers=2, prefetch=0,
+                                   processes=False, verbose=False)
+        self.assertListEqual([row['status'] for row in rows], ['ok', 'ok'])
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
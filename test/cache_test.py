@@ -0,0 +1,61 @@
+# file to test the on-disk result cache
+import unittest
+import tempfile
+from numpy.testing import assert_array_equal
+from helpers import random_walk, small_param
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(4, 5000)
+        self.param = small_param(model_order=6, maxtau=16, nfir=8, freq_points=100)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_data(self):
+        from hvarma import Data
+        return Data(*self.arrays, 100, 'SYN')
+
+    def test_keys(self):
+        from hvarma.cache import ResultCache
+        cache = ResultCache(self.tmpdir.name)
+        data = self.make_data()
+        key = cache.key(data, self.param)
+        self.assertEqual(key, cache.key(self.make_data(), self.param.update({'plot_conf': 30})))
+        self.assertNotEqual(key, cache.key(data, self.param.update({'model_order': 7})))
+        data.dataZ[10] += 1
+        self.assertNotEqual(key, cache.key(data, self.param))
+
+    def test_run_model(self):
+        from hvarma import run_model
+        from hvarma.cache import ResultCache
+        cache = ResultCache(self.tmpdir.name)
+        data1, data2 = self.make_data(), self.make_data()
+        results = run_model(data1, self.param, verbose=False, cache=cache)
+        self.assertEqual(len(cache.entries()), 1)
+
+        cached = run_model(data2, self.param, verbose=False, cache=self.tmpdir.name)
+        self.assertEqual(len(cache.entries()), 1)
+        assert_array_equal(cached.spectra, results.spectra)
+        assert_array_equal(cached.b, results.b)
+        for data in (data1, data2):  # Input data is not modified
+            assert_array_equal(data.dataN, self.arrays[1])
+
+    def test_eviction(self):
+        from hvarma import run_model
+        from hvarma.cache import ResultCache
+        cache = ResultCache(self.tmpdir.name)
+        for order in [4, 5, 6]:
+            run_model(self.make_data(), self.param.update({'model_order': order}), verbose=False, cache=cache)
+        self.assertEqual(len(cache.entries()), 3)
+        cache.max_bytes = cache.size() // 2
+        cache.evict()
+        self.assertLessEqual(cache.size(), cache.max_bytes)
+        self.assertGreater(len(cache.entries()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
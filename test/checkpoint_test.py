@@ -0,0 +1,95 @@
+# file to test checkpoints of interrupted runs
+import os
+import unittest
+import tempfile
+from unittest import mock
+from numpy.testing import assert_array_equal
+from helpers import random_walk, small_param
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(calls):
+    """ Patch HVarma.solve_arma to fail after a number of calls. """
+    from hvarma.processing import HVarma
+    solve_arma = HVarma.solve_arma
+    count = [0]
+
+    def solve(self, *args, **kwargs):
+        count[0] += 1
+        if count[0] > calls:
+            raise Interrupted
+        return solve_arma(self, *args, **kwargs)
+    return mock.patch.object(HVarma, 'solve_arma', solve)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arrays = random_walk(12, 4000)
+        self.param = small_param(max_windows=25)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_run_model(self):
+        from hvarma import Data, run_model
+        from hvarma.checkpoint import Checkpoint
+        expected_data = Data(*self.arrays, 100, 'SYN')
+        expected = run_model(expected_data, self.param, verbose=False)
+
+        checkpoint = Checkpoint(self.tmpdir.name, every=4)
+        with interrupt_after(14), self.assertRaises(Interrupted):
+            run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False, checkpoint=checkpoint)
+        chunks = os.listdir(checkpoint.window_dir)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(os.listdir(os.path.join(checkpoint.window_dir, chunks[0]))), 3)
+
+        data = Data(*self.arrays, 100, 'SYN')
+        with interrupt_after(25 - 12):
+            results = run_model(data, self.param, verbose=False, checkpoint=checkpoint)
+        assert_array_equal(results.spectra, expected.spectra)
+        assert_array_equal(results.coherence, expected.coherence)
+        assert_array_equal(results.AIC, expected.AIC)
+        assert_array_equal(data.dataN, expected_data.dataN)
+        self.assertEqual(os.listdir(checkpoint.window_dir), [])
+        self.assertEqual(len(checkpoint.entries()), 1)
+
+    def test_order_search(self):
+        from hvarma import Data, find_optimal_order
+        param = self.param.update({'max_windows': 10})
+        expected_data = Data(*self.arrays, 100, 'SYN')
+        expected = find_optimal_order(expected_data, param)
+        total_calls = 10 * len(expected.order_results)
+
+        data = Data(*self.arrays, 100, 'SYN')
+        for calls in (total_calls // 3, total_calls // 3, total_calls):
+            try:
+                with interrupt_after(calls):
+                    results = find_optimal_order(data, param, checkpoint=self.tmpdir.name)
+                break
+            except Interrupted:
+                data = Data(*self.arrays, 100, 'SYN')
+        self.assertEqual(results.final_order, expected.final_order)
+        self.assertListEqual(list(results.order_results), list(expected.order_results))
+        for order in expected.order_results:
+            assert_array_equal(results.order_results[order].spectra, expected.order_results[order].spectra)
+        assert_array_equal(data.dataZ, expected_data.dataZ)
+
+    def test_with_cache(self):
+        from hvarma import Data, run_model, find_optimal_order
+        cache = os.path.join(self.tmpdir.name, 'cache')
+        with self.assertRaises(ValueError):
+            run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False, cache=cache,
+                      checkpoint=self.tmpdir.name)
+        for method in ('fast', 'multifidelity'):
+            with self.assertRaises(ValueError):
+                find_optimal_order(Data(*self.arrays, 100, 'SYN'), self.param, method=method, cache=cache,
+                                   checkpoint=self.tmpdir.name)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -106,6 +106,59 @@ class CovarianceTest(unittest.TestCase):
         assert_array_almost_equal(self.set4[1]/1e8, cov_v/1e8)
 
 
+class BatchCovarianceTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma.read_input import Data
+        rng = np.random.default_rng(2)
+        self.data = Data(*rng.standard_normal((3, 2000)), 100, 'SYN')
+
+    def test_batch_matches_windows(self):
+        from hvarma.compute import compute_covariances_batch, compute_autocovariance, \
+            compute_crosscovariance
+        batch = self.data.make_batch(200, 100, max_windows=6)
+        dataZ, dataN, dataE = batch.centered()
+        covs = compute_covariances_batch(dataE, dataN, dataZ, 16)
+        for idx in range(batch.num_windows):
+            auto_cov_x, auto_cov_v = compute_autocovariance(dataE[idx], dataN[idx], dataZ[idx], 200, 16)
+            cross_cov_v_zx, cross_cov_zx_v = compute_crosscovariance(dataE[idx], dataN[idx], dataZ[idx],
+                                                                     200, 16)
+            for batch_cov, cov in zip(covs, [auto_cov_x, auto_cov_v, cross_cov_v_zx, cross_cov_zx_v]):
+                assert_array_almost_equal(batch_cov[idx], cov)
+
+
+class BatchEvaluationTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma.read_input import ArmaParam, Data
+        from hvarma.processing import HVarma
+        rng = np.random.default_rng(5)
+        data = Data(*rng.standard_normal((3, 2000)).cumsum(axis=1), 100, 'SYN')
+        self.param = ArmaParam.from_dict({'model_order': 6, 'maxtau': 32, 'nfir': 12,
+                                          'window_size': 256, 'freq_points': 150})
+        self.models = []
+        for start in [0, 500, 1000]:
+            model = HVarma(data.make_window(start, 256, copy=True), self.param)
+            model.solve_arma()
+            model.get_coherence()
+            self.models.append(model)
+
+    def test_transfer_function(self):
+        from hvarma.compute import transfer_function_batch
+        a = np.vstack([model.a for model in self.models])
+        b = np.vstack([model.b for model in self.models])
+        spectra = transfer_function_batch(-20, 20, 150, 0.01, a, b)
+        for model, spectrum in zip(self.models, spectra):
+            assert_array_almost_equal(spectrum, model.transfer_fun())
+
+    def test_coherence(self):
+        from hvarma.compute import compute_coherence_batch
+        covs = [np.vstack(cov) for cov in zip(*[model.correlations for model in self.models])]
+        coherence = compute_coherence_batch(*covs, 12, -20, 20, 150, 0.01, max_elements=1000)
+        for model, coh in zip(self.models, coherence):
+            assert_array_almost_equal(coh, model.get_coherence())
+
+
 class ModelEquationsTest(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,117 @@
+# file to test the cost estimator
+import os
+import unittest
+import tempfile
+from unittest import mock
+from helpers import small_param
+
+
+def fake_calibration():
+    """ Calibration with unit coefficients, to test without the micro-benchmark. """
+    from hvarma.estimate import Calibration, STAGE_TERMS
+    coefficients = {name: [1e-6] * len(terms(1, 1, 1, 1, 1)) for name, terms in STAGE_TERMS.items()}
+    return Calibration(coefficients, {'decimation': 1e-8, 'screening': 1e-8})
+
+
+class EstimateTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma.synthetic import SyntheticModel, synthetic_data
+        self.data = synthetic_data(SyntheticModel.from_resonances([2.5], 0.05, 100), 60, seed=0)
+        self.param = small_param(max_windows=100)
+        self.calibration = fake_calibration()
+
+    def test_num_windows(self):
+        from hvarma import run_model
+        from hvarma.estimate import estimate_run_model
+        for changes in ({}, {'max_windows': 10}, {'overlap': 0},
+                        {'decimate': 1, 'neg_freq': -5, 'pos_freq': 5, 'maxtau': 64, 'window_size': 1024}):
+            param = self.param.update(changes)
+            estimate = estimate_run_model(self.data, param, self.calibration)
+            results = run_model(self.data, param, verbose=False)
+            self.assertEqual(estimate.num_windows, results.num_windows, changes)
+            self.assertGreater(estimate.peak_memory, 3 * 8 * self.data.size)
+            self.assertAlmostEqual(estimate.runtime, sum(estimate.stages.values()))
+
+    def test_size_and_rate(self):
+        from hvarma.estimate import estimate_run_model
+        estimate = estimate_run_model((self.data.size, 100), self.param, self.calibration)
+        self.assertEqual(estimate, estimate_run_model(self.data, self.param, self.calibration))
+        longer = estimate_run_model((2 * self.data.size, 100), self.param, self.calibration)
+        self.assertGreater(longer.runtime, estimate.runtime)
+
+    def test_order_search(self):
+        from hvarma import find_optimal_order
+        from hvarma.estimate import estimate_order_search
+        results = find_optimal_order(self.data, self.param)
+        estimate = estimate_order_search(self.data, self.param, expected_order=results.final_order,
+                                         calibration=self.calibration)
+        self.assertEqual(sorted(estimate.orders), sorted(results.order_results))
+
+        results = find_optimal_order(self.data, self.param, method='multifidelity')
+        estimate = estimate_order_search(self.data, self.param, expected_order=results.final_order,
+                                         method='multifidelity', calibration=self.calibration)
+        screened = len(results.screening_results)
+        self.assertEqual(sorted(estimate.orders[:screened]), sorted(results.screening_results))
+        self.assertEqual(sorted(estimate.orders[screened:]), sorted(results.order_results))
+
+        worst = estimate_order_search(self.data, self.param, calibration=self.calibration)
+        self.assertIn(32, worst.orders)
+        self.assertGreater(worst.runtime, estimate.runtime)
+
+    def test_calibration_cache(self):
+        from hvarma import estimate
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(estimate, 'calibrate', fake_calibration):
+                first = estimate.get_calibration(tmpdir)
+            self.assertTrue(os.path.exists(estimate.calibration_path(tmpdir)))
+            with mock.patch.object(estimate, 'calibrate', side_effect=AssertionError):
+                second = estimate.get_calibration(tmpdir)
+            self.assertEqual(first.to_dict(), second.to_dict())
+
+    def test_calibrate(self):
+        from hvarma.estimate import calibrate, STAGE_TERMS
+        calibration = calibrate(num_windows=2)
+        self.assertEqual(set(calibration.coefficients), set(STAGE_TERMS))
+        stages = calibration.window_stages(self.param)
+        self.assertGreater(sum(stages.values()), 0)
+
+    def test_runtime(self):
+        import time
+        from hvarma import run_model
+        from hvarma.estimate import calibrate, estimate_run_model
+        from hvarma.synthetic import SyntheticModel, synthetic_data
+        calibration = calibrate()
+        model = SyntheticModel.from_resonances([2.5], 0.05, 100)
+        for changes in ({}, {'model_order': 30, 'maxtau': 64, 'nfir': 40, 'window_size': 1024,
+                             'overlap': 512, 'freq_points': 500, 'max_windows': 20}):
+            param = self.param.update(changes)
+            estimate = estimate_run_model((30000, 100), param, calibration, backend='serial')
+            elapsed = []
+            for _ in range(2):
+                data = synthetic_data(model, 300, seed=1)
+                beg = time.perf_counter()
+                run_model(data, param, verbose=False, backend='serial')
+                elapsed.append(time.perf_counter() - beg)
+            ratio = min(elapsed) / estimate.runtime
+            self.assertGreater(ratio, 0.5, changes)
+            self.assertLess(ratio, 2, changes)
+
+    def test_backend(self):
+        from hvarma.autotune import Backend, Profile
+        from hvarma.estimate import estimate_run_model
+        serial = estimate_run_model(self.data, self.param, self.calibration, backend='serial')
+        threads = estimate_run_model(self.data, self.param, self.calibration, backend=Backend('threads', 4, 4))
+        self.assertEqual(threads.num_windows, serial.num_windows)
+        self.assertAlmostEqual(threads.stages['solve'], serial.stages['solve'] / 4)
+        self.assertAlmostEqual(threads.stages['aic'], serial.stages['aic'])
+
+        entry = {'window_size': 256, 'maxtau': 32, 'model_order': 8, 'freq_points': 200, 'backend': 'processes',
+                 'workers': 4, 'batch_windows': 16, 'throughput': 3., 'serial_throughput': 1.}
+        with mock.patch('hvarma.autotune.load_profile', return_value=Profile([entry], 4)):
+            tuned = estimate_run_model(self.data, self.param, self.calibration)
+        self.assertAlmostEqual(tuned.runtime, serial.runtime / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
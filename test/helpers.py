@@ -0,0 +1,28 @@
+# synthetic recordings and parameters shared by the tests
+import os
+import numpy as np
+
+# Small windows and orders, so that every test runs in seconds
+SMALL_PARAMS = {'model_order': 8, 'maxtau': 32, 'nfir': 16, 'window_size': 256, 'overlap': 128,
+                'freq_points': 200, 'max_windows': 20}
+
+
+def random_walk(seed, size):
+    """ Z, N, E random walks of size samples, one per row. """
+    return np.random.default_rng(seed).standard_normal((3, size)).cumsum(axis=1)
+
+
+def small_param(**changes):
+    """ ArmaParam of SMALL_PARAMS with changes. """
+    from hvarma import ArmaParam
+    return ArmaParam.from_dict(dict(SMALL_PARAMS, **changes))
+
+
+def save_components(arrays, directory):
+    """ Save each component of arrays as Z.npy, N.npy and E.npy in directory.
+        Returns their file names by component, as jobs take them. """
+    files = {}
+    for comp, array in zip('ZNE', arrays):
+        files[comp] = os.path.join(directory, comp + '.npy')
+        np.save(files[comp], array)
+    return files
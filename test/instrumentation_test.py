@@ -0,0 +1,77 @@
+# file to test the per-stage statistics
+import json
+import unittest
+from numpy.testing import assert_array_equal
+from helpers import random_walk, small_param
+
+
+class RunStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = random_walk(13, 3000)
+        self.param = small_param(max_windows=10)
+
+    def test_run_model(self):
+        import tracemalloc
+        from hvarma import Data, run_model
+        from hvarma.instrumentation import RunStats, STAGES
+        self.addCleanup(tracemalloc.stop)
+        events = []
+        stats = RunStats(callback=lambda *event: events.append(event), memory=True)
+        results = run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False, stats=stats)
+        plain = run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False)
+        assert_array_equal(results.spectra, plain.spectra)
+        self.assertIs(results.stats, stats)
+        self.assertIsNone(plain.stats)
+
+        self.assertEqual(list(stats.stages), list(STAGES))
+        for name in STAGES[1:-1]:
+            self.assertEqual(stats.stages[name].calls, 10, name)
+        self.assertEqual(stats.stages['windowing'].calls, 10)
+        self.assertEqual(stats.stages['aggregation'].calls, 1)
+        self.assertGreater(stats.stages['solve'].wall, 0)
+        self.assertGreater(stats.stages['covariance'].bytes, 0)
+        self.assertEqual(len(events), sum(stage.calls for stage in stats.stages.values()))
+
+    def test_order_search(self):
+        from hvarma import Data, find_optimal_order
+        from hvarma.instrumentation import RunStats
+        stats = RunStats()
+        results = find_optimal_order(Data(*self.arrays, 100, 'SYN'), self.param, stats=stats)
+        self.assertEqual(set(stats.children), set(results.order_results))
+        self.assertEqual(stats.total()['solve'].calls, 10 * len(results.order_results))
+        self.assertEqual(stats.children[4].labels, {'order': '4'})
+        self.assertIs(results.stats, stats)
+
+    def test_timed(self):
+        import tracemalloc
+        from hvarma.instrumentation import RunStats
+        self.addCleanup(tracemalloc.stop)
+        stats = RunStats(memory=True)
+        self.assertEqual(list(stats.timed('windowing', iter(range(3)))), [0, 1, 2])
+        self.assertEqual(stats.stages['windowing'].calls, 3)
+
+    def test_export(self):
+        from hvarma import Data, run_model
+        from hvarma.instrumentation import RunStats
+        stats = RunStats()
+        run_model(Data(*self.arrays, 100, 'SYN'), self.param, verbose=False, stats=stats.child(8))
+        data = json.loads(stats.to_json())
+        self.assertEqual(data['total']['solve']['calls'], 10)
+        self.assertEqual(data['children']['8']['stages']['solve']['calls'], 10)
+
+        text = stats.to_prometheus(labels={'station': 'SYN'})
+        self.assertIn('# TYPE hvarma_stage_wall_seconds gauge', text)
+        self.assertIn('hvarma_stage_calls{station="SYN",order="8",stage="solve"} 10', text)
+
+    def test_disabled(self):
+        from hvarma.instrumentation import NULL_STATS, get_stats
+        self.assertIs(get_stats(None), NULL_STATS)
+        self.assertIs(NULL_STATS.child(4), NULL_STATS)
+        with NULL_STATS.stage('solve'):
+            pass
+        self.assertEqual(list(NULL_STATS.timed('windowing', range(3))), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
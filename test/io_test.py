@@ -107,5 +107,136 @@ class ProgressBarTest(unittest.TestCase):
             self.assertEqual(count, 4)  # max windows parameter
 
 
+class LazyDataTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        from hvarma.read_input import Data, ArmaParam
+        rng = np.random.default_rng(0)
+        self.arrays = rng.standard_normal((3, 6000)).cumsum(axis=1)
+        self.data = Data(*self.arrays, 100, 'SYN')
+        self.param = ArmaParam.from_dict({'model_order': 6, 'maxtau': 16, 'nfir': 8,
+                                          'window_size': 128, 'overlap': 64,
+                                          'freq_points': 100, 'max_windows': 40})
+
+    def make_lazy(self, chunk_size):
+        from hvarma.lazy_input import LazyData, ArraySegment, SegmentReader
+
+        def reader(array):  # Split each component in two segments
+            return SegmentReader([ArraySegment(array[:2500], 100, 'SYN'),
+                                  ArraySegment(array[2500:], 100, 'SYN')])
+        return LazyData(*[reader(array) for array in self.arrays], chunk_size=chunk_size)
+
+    def test_window(self):
+        from numpy.testing import assert_array_equal
+        with self.make_lazy(chunk_size=1000) as lazy:
+            self.assertEqual(lazy.size, self.data.size)
+            for start in [0, 900, 2400, 4000, 10]:
+                win = lazy.make_window(start, 300)
+                assert_array_equal(win.dataZ, self.arrays[0][start:start + 300])
+                assert_array_equal(win.dataE, self.arrays[2][start:start + 300])
+
+    def test_run_model(self):
+        from numpy.testing import assert_array_equal
+        from hvarma import run_model
+        expected = run_model(self.data, self.param, verbose=False)
+        with self.make_lazy(chunk_size=500) as lazy:
+            results = run_model(lazy, self.param, verbose=False)
+        self.assertEqual(results.num_windows, expected.num_windows)
+        assert_array_equal(results.spectra, expected.spectra)
+        assert_array_equal(results.coherence, expected.coherence)
+
+
+class WindowBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        from hvarma.read_input import Data
+        rng = np.random.default_rng(1)
+        self.data = Data(*rng.standard_normal((3, 1000)), 100, 'SYN')
+
+    def test_views(self):
+        import numpy as np
+        batch = self.data.make_batch(100, 40, max_windows=12)
+        self.assertEqual(batch.num_windows, 12)
+        self.assertEqual(batch.size, 100)
+        self.assertListEqual(list(batch.starts[:3]), [0, 60, 120])
+        self.assertTrue(np.shares_memory(batch.dataZ, self.data.dataZ))
+        self.assertFalse(batch.dataZ.flags.writeable)
+        np.testing.assert_array_equal(batch.dataN[2], self.data.dataN[120:220])
+
+    def test_centered(self):
+        import numpy as np
+        original = self.data.dataE.copy()
+        batch = self.data.make_batch(100, 50)
+        dataZ, dataN, dataE = batch.centered()
+        np.testing.assert_array_almost_equal(dataE.mean(axis=1), np.zeros(batch.num_windows))
+        np.testing.assert_array_almost_equal(dataE[1] + batch.means()[2][1], original[50:150])
+        np.testing.assert_array_equal(self.data.dataE, original)
+
+    def test_iter_batches(self):
+        batches = list(self.data.iter_batches(100, 50, 5, max_windows=12))
+        self.assertListEqual([len(batch) for batch in batches], [5, 5, 2])
+        self.assertEqual(batches[1].starts[0], 250)
+
+
+class BinaryOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        import numpy as np
+        from hvarma import Data, ArmaParam, run_model
+        rng = np.random.default_rng(3)
+        data = Data(*rng.standard_normal((3, 4000)), 100, 'SYN')
+        param = ArmaParam.from_dict({'model_order': 6, 'maxtau': 16, 'nfir': 8,
+                                     'window_size': 256, 'overlap': 128, 'freq_points': 100})
+        self.results = run_model(data, param, verbose=False)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_binary_roundtrip(self):
+        import os
+        import numpy as np
+        from hvarma import write_binary_results, read_binary_results
+        filename = os.path.join(self.tmpdir.name, 'out.npz')
+        write_binary_results(self.results, filename)
+        loaded = read_binary_results(filename)
+
+        self.assertIsInstance(loaded.spectra, np.memmap)
+        self.assertEqual(loaded.param, self.results.param)
+        self.assertEqual(loaded.station, 'SYN')
+        self.assertEqual(loaded.num_windows, self.results.num_windows)
+        for name in ['spectra', 'coherence', 'AIC', 'a', 'b']:
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(self.results, name))
+        self.assertEqual(loaded.get_frequency(20), self.results.get_frequency(20))
+
+    def test_text_output(self):
+        import os
+        import numpy as np
+        from hvarma.write_output import write_data
+        filename = os.path.join(self.tmpdir.name, 'out.txt')
+        freqs = self.results.get_frequencies()
+        spectrum = self.results.get_spectrum_percentile(50)
+        write_data(freqs, spectrum, spectrum, spectrum, spectrum, filename)
+        with open(filename) as file:
+            self.assertEqual(file.readline().split(), ['Frequency', 'H/V', 'Low_err', 'Upp_err', 'Coherence'])
+        table = np.loadtxt(filename, skiprows=1)
+        np.testing.assert_array_equal(table[:, 0], freqs)
+        np.testing.assert_array_equal(table[:, 1], spectrum)
+
+        # Same text as printing each row of values
+        values = np.array([0.1, 1e-5, 2.5e16, -3., 123456.789])
+        write_data(values, values, values, values, values, filename)
+        expected = os.path.join(self.tmpdir.name, 'expected.txt')
+        with open(expected, 'w') as file:
+            print('Frequency', 'H/V', 'Low_err', 'Upp_err', 'Coherence', file=file, sep=' ')
+            for value in values:
+                print(value, value, value, value, value, file=file, sep=' ')
+        with open(filename) as file, open(expected) as expected_file:
+            self.assertEqual(file.read(), expected_file.read())
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
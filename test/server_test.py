@@ -0,0 +1,75 @@
+# file to test the job server
+import os
+import unittest
+import tempfile
+import threading
+from helpers import SMALL_PARAMS, random_walk, save_components
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma import ArmaParam
+        from hvarma.server import HVarmaServer
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arrays = random_walk(6, 3000)
+        self.files = save_components(self.arrays, self.tmpdir.name)
+        self.param = dict(SMALL_PARAMS, max_windows=10)
+        self.expected_param = ArmaParam.from_dict(self.param)
+
+        self.socket = os.path.join(self.tmpdir.name, 'hvarma.sock')
+        self.server = HVarmaServer(self.socket, workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmpdir.cleanup()
+
+    def job(self, job_id, **kwargs):
+        job = dict(id=job_id, format='npy', sampling_rate=100, station='SYN', param=self.param, **self.files)
+        job.update(kwargs)
+        return job
+
+    def test_jobs(self):
+        from hvarma import Data, run_model, read_binary_results
+        from hvarma.server import submit
+        output = os.path.join(self.tmpdir.name, 'out.npz')
+        jobs = [self.job(idx) for idx in range(4)] + [self.job('out', output=output), {'command': 'ping', 'id': 'p'}]
+        responses = {resp['id']: resp for resp in submit(self.socket, jobs)}
+        self.assertEqual(len(responses), 6)
+        self.assertEqual(responses['p']['status'], 'ok')
+
+        expected = run_model(Data(*self.arrays, 100, 'SYN'), self.expected_param, verbose=False)
+        pos_freq, pos_err, neg_freq, neg_err = expected.get_frequency(self.expected_param.freq_conf)
+        for idx in list(range(4)) + ['out']:
+            self.assertEqual(responses[idx]['status'], 'ok')
+            self.assertEqual(responses[idx]['num_windows'], 10)
+            self.assertAlmostEqual(responses[idx]['pos_freq'], pos_freq)
+            self.assertAlmostEqual(responses[idx]['neg_err'], neg_err)
+        self.assertEqual(responses['out']['output'], output)
+        self.assertEqual(read_binary_results(output).num_windows, 10)
+
+    def test_errors(self):
+        from hvarma.server import submit
+        jobs = [self.job('bad', param={'unknown': 1}), self.job('missing', Z='missing.npy')]
+        responses = {resp['id']: resp for resp in submit(self.socket, jobs)}
+        self.assertEqual(responses['bad']['status'], 'error')
+        self.assertIn('unknown', responses['bad']['error'])
+        self.assertEqual(responses['missing']['status'], 'error')
+
+    def test_existing_file(self):
+        from hvarma.server import HVarmaServer
+        path = os.path.join(self.tmpdir.name, 'notes.txt')
+        with open(path, 'w') as file:
+            file.write('keep')
+        with self.assertRaises(FileExistsError):
+            HVarmaServer(path, workers=1, processes=False)
+        with open(path) as file:
+            self.assertEqual(file.read(), 'keep')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
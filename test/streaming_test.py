@@ -0,0 +1,71 @@
+# file to test the streaming processor
+import unittest
+from numpy.testing import assert_allclose, assert_array_equal
+from helpers import random_walk, small_param
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+        self.arrays = random_walk(5, 3000)
+        self.param = small_param(overlap=160, max_windows=100)
+        rng = np.random.default_rng(6)
+        self.splits = np.sort(rng.choice(np.arange(1, 3000), 40, replace=False))
+
+    def push_chunks(self, stream):
+        import numpy as np
+        for chunk in np.split(self.arrays, self.splits, axis=1):
+            stream.push(*chunk)
+
+    def test_matches_run_model(self):
+        from hvarma import Data, run_model
+        from hvarma.streaming import StreamingHVarma
+        stream = StreamingHVarma(self.param, 50, 'STA')
+        self.push_chunks(stream)
+        stream.flush()
+
+        results = run_model(Data(*self.arrays, 50, 'STA'), self.param, verbose=False)
+        streamed = stream.results()
+        self.assertEqual(streamed.num_windows, results.num_windows)
+        assert_allclose(streamed.spectra, results.spectra)
+        assert_allclose(streamed.coherence, results.coherence)
+        assert_allclose(streamed.AIC, results.AIC)
+        self.assertEqual(stream.get_frequency(), results.get_frequency(self.param.freq_conf))
+
+    def test_rolling_windows(self):
+        import numpy as np
+        from hvarma import Data, run_model
+        from hvarma.streaming import StreamingHVarma
+        stream = StreamingHVarma(self.param, 50, 'STA', max_windows=5)
+        self.push_chunks(stream)
+        stream.flush()
+
+        results = run_model(Data(*self.arrays, 50, 'STA'), self.param, verbose=False)
+        streamed = stream.results()
+        self.assertEqual(streamed.num_windows, 5)
+        assert_allclose(streamed.spectra, results.spectra[-5:])
+        assert_allclose(streamed.AIC, results.AIC[-5:])
+        assert_array_equal(stream.get_starts(), 96 * np.arange(results.num_windows - 5, results.num_windows))
+        # Only the samples of the next window are kept
+        self.assertLess(stream.buffer.shape[1], self.param.window_size)
+
+    def test_windows_per_push(self):
+        from hvarma.streaming import StreamingHVarma
+        stream = StreamingHVarma(self.param, 50, 'STA', max_windows_per_push=2)
+        self.assertEqual(stream.push(*self.arrays), 2)
+        self.assertEqual(stream.num_windows, 2)
+        pending = stream.pending_windows()
+        self.assertEqual(stream.process(), pending)
+        self.assertEqual(stream.pending_windows(), 0)
+
+    def test_no_windows(self):
+        from hvarma.streaming import StreamingHVarma
+        stream = StreamingHVarma(self.param, 50, 'STA')
+        stream.push(*self.arrays[:, :100])
+        with self.assertRaises(ValueError):
+            stream.get_frequency()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# file to test the synthetic record generator
+import unittest
+from numpy.testing import assert_allclose, assert_array_equal
+
+
+class SyntheticTest(unittest.TestCase):
+
+    def setUp(self):
+        from hvarma.synthetic import SyntheticModel
+        self.model = SyntheticModel.from_resonances([2.5], damping=0.05, sampling_rate=50, azimuth=30)
+
+    def test_chunks(self):
+        import numpy as np
+        from hvarma.synthetic import synthetic_chunks, synthetic_data
+        data = synthetic_data(self.model, 100, seed=4, noise=0.1)
+        self.assertEqual(data.size, 5000)
+        chunks = list(synthetic_chunks(self.model, 100, chunk_size=777, seed=4, noise=0.1))
+        self.assertEqual(len(chunks), 7)
+        for comp, arrays in zip((data.dataZ, data.dataN, data.dataE), zip(*chunks)):
+            assert_array_equal(comp, np.concatenate(arrays))
+
+    def test_response(self):
+        import numpy as np
+        from hvarma.compute import transfer_function
+        b = np.concatenate((self.model.b, np.zeros(len(self.model.a) - 1)))
+        assert_allclose(self.model.response(np.linspace(-10, 10, 101)),
+                        transfer_function(-10, 10, 101, 1 / 50, self.model.a, b, len(b)))
+
+    def test_true_peaks(self):
+        pos_freq, neg_freq = self.model.true_peaks(-10, 10)
+        self.assertAlmostEqual(pos_freq, -neg_freq, places=6)
+        self.assertLess(abs(pos_freq - 2.5), 0.05)
+        self.assertGreater(self.model.response(pos_freq), self.model.response(pos_freq + 1e-4))
+        self.assertGreater(self.model.response(pos_freq), self.model.response(pos_freq - 1e-4))
+
+    def test_estimate(self):
+        from hvarma import ArmaParam, run_model
+        from hvarma.synthetic import synthetic_data
+        param = ArmaParam.from_dict({'model_order': 10, 'maxtau': 64, 'window_size': 512, 'overlap': 256,
+                                     'neg_freq': -10, 'pos_freq': 10, 'freq_points': 401, 'max_windows': 30})
+        results = run_model(synthetic_data(self.model, 200, seed=1), param, verbose=False)
+        pos_freq, _, neg_freq, _ = results.get_frequency(param.freq_conf)
+        true_pos, true_neg = self.model.true_peaks(param.neg_freq, param.pos_freq)
+        self.assertLess(abs(pos_freq - true_pos), 0.1)
+        self.assertLess(abs(neg_freq - true_neg), 0.1)
+
+    def test_invalid(self):
+        from hvarma.synthetic import SyntheticModel
+        with self.assertRaises(ValueError):
+            SyntheticModel([1, -2.5, 1.5], [1], 50)
+        with self.assertRaises(ValueError):
+            SyntheticModel.from_resonances([30], 0.05, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
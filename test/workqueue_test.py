@@ -0,0 +1,76 @@
+# file to test the work queue on a shared directory
+import os
+import time
+import unittest
+import tempfile
+from helpers import SMALL_PARAMS, random_walk, save_components
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = os.path.join(self.tmpdir.name, 'queue')
+        self.arrays = random_walk(9, 3000)
+        self.files = save_components(self.arrays, self.tmpdir.name)
+        self.param = dict(SMALL_PARAMS, max_windows=10)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def job(self, job_id, **kwargs):
+        job = dict(id=job_id, format='npy', sampling_rate=100, station='SYN', param=self.param, **self.files)
+        job.update(kwargs)
+        return job
+
+    def test_run_worker(self):
+        from hvarma import Data, ArmaParam, run_model, read_binary_results
+        from hvarma.workqueue import submit_jobs, run_worker, queue_status, collect_results
+        submit_jobs(self.queue, [self.job('S1'), self.job('S2'), self.job('BAD', Z='missing.npy')])
+        self.assertEqual(run_worker(self.queue, verbose=False), 3)
+        self.assertEqual(queue_status(self.queue), {'pending': 0, 'claimed': 0, 'done': 2, 'failed': 1})
+        for job_id in ('S1', 'BAD'):
+            with self.assertRaises(ValueError):
+                submit_jobs(self.queue, [self.job(job_id)])
+
+        summary = os.path.join(self.tmpdir.name, 'summary.csv')
+        rows = collect_results(self.queue, summary)
+        self.assertListEqual([row['id'] for row in rows], ['BAD', 'S1', 'S2'])
+        self.assertListEqual([row['status'] for row in rows], ['error', 'ok', 'ok'])
+        self.assertTrue(os.path.exists(summary))
+
+        param = ArmaParam.from_dict(self.param)
+        expected = run_model(Data(*self.arrays, 100, 'SYN'), param, verbose=False)
+        self.assertAlmostEqual(rows[1]['pos_freq'], expected.get_frequency(param.freq_conf)[0])
+        self.assertEqual(rows[1]['model_order'], 8)
+        results = read_binary_results(os.path.join(self.queue, 'results', 'S1.npz'))
+        self.assertEqual(results.num_windows, expected.num_windows)
+
+    def test_claim(self):
+        from hvarma.workqueue import submit_jobs, claim_job
+        submit_jobs(self.queue, [self.job('S1')])
+        claim = claim_job(self.queue, 'w1')
+        self.assertTrue(claim.endswith(os.path.join('claimed', 'S1@1@w1.json')))
+        self.assertIsNone(claim_job(self.queue, 'w2'))
+        with self.assertRaises(ValueError):
+            submit_jobs(self.queue, [self.job('a@b')])
+        with self.assertRaises(ValueError):
+            submit_jobs(self.queue, [self.job('S2'), self.job('S1')])
+        self.assertIsNone(claim_job(self.queue, 'w2'))
+
+    def test_reclaim_stale(self):
+        from hvarma.workqueue import submit_jobs, claim_job, reclaim_stale, run_worker, queue_status
+        submit_jobs(self.queue, [self.job('S1'), self.job('S2')])
+        claim_job(self.queue, 'crashed')
+        self.assertListEqual(reclaim_stale(self.queue, 60, 3), [])
+        time.sleep(0.3)
+        self.assertListEqual(reclaim_stale(self.queue, 0.2, 1), ['S1'])
+        self.assertEqual(queue_status(self.queue)['failed'], 1)
+
+        claim_job(self.queue, 'crashed')
+        self.assertEqual(run_worker(self.queue, heartbeat=0.1, stale_after=0.2, poll=0.1, verbose=False), 1)
+        self.assertEqual(queue_status(self.queue), {'pending': 0, 'claimed': 0, 'done': 1, 'failed': 1})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)